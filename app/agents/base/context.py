@@ -0,0 +1,76 @@
+"""
+Shared context passed between the nodes of the agent workflow.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Mapping, Optional, TypedDict, Union
+
+from app.agents.base.events import NULL_EVENT_BATCHER, EventBatcher, NullEventBatcher
+
+# Oldest actions are dropped past this, so long conversations can't grow the history without bound
+ACTION_HISTORY_MAXLEN = 100
+
+
+class ActionEntry(TypedDict, total=False):
+    """
+    One entry of the agent's action history.
+    """
+
+    action: str
+    tool_name: str
+    result_type: str
+    parameters: Mapping[str, Any]
+    success: bool
+    message: str
+    result: Dict[str, Any]
+
+
+class ThinkingEntry(TypedDict):
+    """
+    One decision's reasoning, as recorded in the thinking history.
+    """
+
+    step: int
+    thinking: str
+
+
+@dataclass(slots=True)
+class SharedContext:
+    """
+    State shared by all nodes of one agent flow run.
+
+    Nodes read and write attributes directly instead of going through
+    `shared.get(key, default)`; defaults are set once, at construction.
+    """
+
+    space_id: str
+    query: str
+    active_file_id: Optional[str] = None
+    stream: bool = True
+    model_name: Optional[str] = None
+    top_k: Optional[int] = None
+    user_id: Optional[str] = None
+    regenerate: bool = False  # Explicit retry by the user, so cached responses are bypassed
+    context: Dict[str, Any] = field(default_factory=dict)
+    action_history: Deque[ActionEntry] = field(default_factory=lambda: deque(maxlen=ACTION_HISTORY_MAXLEN))
+    thinking_history: List[ThinkingEntry] = field(default_factory=list)
+    recent_actions: Deque[ActionEntry] = field(default_factory=lambda: deque(maxlen=3))  # Last few action_history entries, for the final prompt
+    decision_thinking_count: int = 0  # Number of decision thinking steps recorded so far
+    tool_retry_count: int = 0         # Track the number of consecutive tool retries
+    max_tool_retries: int = 3         # Maximum number of consecutive retries before forcing finish
+    total_tool_calls: int = 0         # Track total number of tool calls for this query
+    max_total_tool_calls: int = 5     # Absolute maximum tool calls to prevent infinite loops
+    event_queue: Optional[asyncio.Queue] = None
+    event_batcher: Union[EventBatcher, NullEventBatcher] = NULL_EVENT_BATCHER  # Replaced with a real batcher when streaming
+    query_embedding_task: Optional[asyncio.Task] = None
+    final_response: Any = None
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
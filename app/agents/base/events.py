@@ -0,0 +1,308 @@
+"""
+Event plumbing for streaming agent workflow events to the client.
+"""
+import asyncio
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, ClassVar, Deque, Dict, List, Optional, Union
+
+from app.core.logging import logger
+
+# Upper bound on queued items, so a stalled consumer can't grow memory without limit
+EVENT_QUEUE_MAXSIZE = 1024
+
+# Items a batcher holds back for a full queue before it starts dropping progress events
+EVENT_BACKLOG_MAXSIZE = 256
+
+# Events that only report progress; once the backlog is full they are dropped to make room
+_PROGRESS_EVENT_TYPES = frozenset({"progress", "thinking", "reasoning"})
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    """
+    Base class for workflow events.
+
+    Events have a fixed slot layout instead of a per-event dict, but still support
+    `event["key"]` and `event.get("key")`, so consumers can handle them the same
+    way as the plain dict events put on the queue by the toolshed.
+    """
+
+    type: ClassVar[str] = "event"
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+
+@dataclass(frozen=True, slots=True)
+class DecisionStartEvent(Event):
+    type: ClassVar[str] = "decision_start"
+    message: str
+
+
+@dataclass(frozen=True, slots=True)
+class DecisionEvent(Event):
+    type: ClassVar[str] = "decision"
+    decision: str
+
+
+@dataclass(frozen=True, slots=True)
+class ReasoningEvent(Event):
+    type: ClassVar[str] = "reasoning"
+    content: str
+
+
+@dataclass(frozen=True, slots=True)
+class RagCompleteEvent(Event):
+    type: ClassVar[str] = "rag_complete"
+    message: str
+
+
+@dataclass(frozen=True, slots=True)
+class ToolExecutionStartEvent(Event):
+    type: ClassVar[str] = "tool_execution_start"
+    message: str
+    query: str
+
+
+@dataclass(frozen=True, slots=True)
+class ToolExecutionErrorEvent(Event):
+    type: ClassVar[str] = "tool_execution_error"
+    message: str
+    error: str
+    traceback: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class ForcedFinishEvent(Event):
+    type: ClassVar[str] = "forced_finish"
+    message: str
+
+
+@dataclass(frozen=True, slots=True)
+class FileEditStartEvent(Event):
+    type: ClassVar[str] = "file_edit_start"
+    file_id: str
+
+
+@dataclass(frozen=True, slots=True)
+class FileEditCompleteEvent(Event):
+    type: ClassVar[str] = "file_edit_complete"
+    file_id: str
+
+
+@dataclass(frozen=True, slots=True)
+class ToolCompleteEvent(Event):
+    type: ClassVar[str] = "tool_complete"
+    tool: str
+
+
+@dataclass(frozen=True, slots=True)
+class FinishStartEvent(Event):
+    type: ClassVar[str] = "finish_start"
+    message: str
+
+
+@dataclass(frozen=True, slots=True)
+class TokenEvent(Event):
+    type: ClassVar[str] = "token"
+    content: str
+
+
+@dataclass(frozen=True, slots=True)
+class FlowCompleteEvent(Event):
+    type: ClassVar[str] = "flow_complete"
+    message: str
+
+
+class EventBatcher:
+    """
+    Coalesces workflow events into batches before putting them on the event queue.
+
+    Nodes call the synchronous `emit` instead of awaiting a queue put per event.
+    Events are flushed as a single list either when `max_items` have accumulated
+    or `flush_ms` after the first buffered event, whichever comes first.
+
+    Every item put on the queue goes through its batcher, so items reach the
+    consumer in the order they were sent. While the queue is full they wait in
+    a backlog; once that holds `max_backlog` items, progress-only items are
+    dropped to make room, while tokens and terminal events are always kept.
+    """
+
+    def __init__(self, queue: asyncio.Queue, max_items: int = 16, flush_ms: int = 5, max_backlog: int = EVENT_BACKLOG_MAXSIZE):
+        """
+        Initializes the batcher.
+
+        Args:
+            queue: The queue the consumer reads event batches from.
+            max_items: Flush as soon as this many events are buffered.
+            flush_ms: Flush at most this many milliseconds after the first buffered event.
+            max_backlog: Backlog size beyond which progress events are dropped.
+        """
+        self.queue = queue
+        self.max_items = max_items
+        self.flush_delay = flush_ms / 1000
+        self.max_backlog = max_backlog
+        self.dropped = 0
+        self._buffer: List[Event] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Batches waiting for room in a full queue, drained in order by one task
+        self._backlog: Deque[Any] = deque()
+        self._drain_task: Optional[asyncio.Task] = None
+        _BATCHERS[queue] = self
+
+    @property
+    def pending(self) -> bool:
+        """Whether any events are still buffered or waiting for room in the queue."""
+        return bool(self._buffer or self._backlog)
+
+    def emit(self, event: Event) -> None:
+        """
+        Buffers an event for the next flush.
+
+        Args:
+            event: The event to send to the client.
+        """
+        self._buffer.append(event)
+        if len(self._buffer) >= self.max_items:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_delay, self.flush)
+
+    def flush(self) -> None:
+        """
+        Puts all buffered events on the queue as one batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+
+        batch, self._buffer = self._buffer, []
+        self._put(batch)
+
+    def send(self, item: Any) -> None:
+        """
+        Puts an item on the queue right away, after every event emitted before it.
+
+        Args:
+            item: A dict event, or a list of them sent as one batch.
+        """
+        self.flush()
+        self._put(item)
+
+    def _put(self, item: Any) -> None:
+        if not self._backlog:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                pass
+
+        # The consumer is behind: wait for room without blocking the emitter,
+        # keeping items in the order they were sent
+        if len(self._backlog) >= self.max_backlog and not self._make_room(item):
+            self.dropped += 1
+            return
+        self._backlog.append(item)
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+
+    def _make_room(self, item: Any) -> bool:
+        """Drops the oldest progress item from the backlog, or reports that item itself should be dropped."""
+        # The head is being put on the queue by the drain task, so it is never dropped
+        for i in range(1, len(self._backlog)):
+            if _is_progress(self._backlog[i]):
+                del self._backlog[i]
+                self.dropped += 1
+                return True
+        # With nothing to drop the backlog grows past its bound rather than lose a token or terminal event
+        return not _is_progress(item)
+
+    async def _drain(self) -> None:
+        while self._backlog:
+            await self.queue.put(self._backlog[0])
+            self._backlog.popleft()
+
+    def close(self) -> None:
+        """
+        Stops flushing and discards anything not yet on the queue, for when the consumer has gone.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            self._drain_task = None
+        self._buffer.clear()
+        self._backlog.clear()
+
+
+def _is_progress(item: Any) -> bool:
+    """Whether a queued item, a single event or a batch of them, only reports progress."""
+    events = item if isinstance(item, list) else (item,)
+    return all(_is_progress_event(event) for event in events)
+
+
+def _is_progress_event(event: Any) -> bool:
+    event_type = event.get("type") if hasattr(event, "get") else None
+    return isinstance(event_type, str) and (event_type in _PROGRESS_EVENT_TYPES or event_type.endswith("_progress"))
+
+
+class NullEventBatcher:
+    """
+    Stand-in batcher for runs with no stream consumer; emitted events are dropped.
+
+    Installed by default so nodes can emit unconditionally instead of checking
+    for a batcher first. Compare against `NULL_EVENT_BATCHER` to skip building
+    events that are expensive to create.
+    """
+
+    def emit(self, event: Event) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+NULL_EVENT_BATCHER = NullEventBatcher()
+
+
+# The batcher feeding each event queue, so events put on it directly keep their order
+_BATCHERS: "weakref.WeakKeyDictionary[asyncio.Queue, EventBatcher]" = weakref.WeakKeyDictionary()
+
+
+def emit_event(event_queue: Optional[asyncio.Queue], event: Union[Dict[str, Any], List[Dict[str, Any]]]) -> None:
+    """
+    Puts a plain dict event, or a list of them sent as one batch, on the event queue without waiting.
+
+    Used by the toolshed and its tools, which report progress with dict events. The event
+    goes through the queue's EventBatcher, so it follows every event emitted before it,
+    and waits in the batcher's backlog rather than being dropped while the queue is full.
+    Does nothing without a queue, and never raises: failing to report progress shouldn't
+    fail the step.
+
+    Args:
+        event_queue: The queue the stream consumer reads from, or None.
+        event: The event or events to send to the client.
+    """
+    if event_queue is None:
+        return
+    try:
+        batcher = _BATCHERS.get(event_queue)
+        if batcher is None:
+            batcher = EventBatcher(event_queue)
+        batcher.send(event)
+    except Exception:
+        logger.exception("Error sending event")
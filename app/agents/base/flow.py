@@ -5,10 +5,14 @@
 # ToolShed - "decide" >> DecisionModel
 # RAGService - "decide" >> DecisionModel
 
-from typing import Union, Dict, Any, AsyncGenerator, Optional
+from typing import Union, Dict, Any, AsyncGenerator, Iterator, Optional
 from pocketflow import AsyncFlow
 from app.agents.base.nodes import DecisionNode, RAGNode, ToolShedNode, FinishNode
+from app.agents.base.context import SharedContext
+from app.agents.base.events import EventBatcher, EVENT_QUEUE_MAXSIZE
+from app.core.config import settings
 from app.core.logging import logger
+from app.services.embedding_service import embedding_service
 import asyncio
 import traceback
 
@@ -54,6 +58,43 @@ def create_agent_flow() -> AsyncFlow:
     return AsyncFlow(start=decision_node)
 
 
+def _format_response_chunk(chunk: str) -> Iterator[str]:
+    """
+    Yield the pieces of a response chunk to send to the client, with any
+    reasoning section sent on its own.
+    """
+    # Check if the chunk contains a reasoning tag
+    if "<reasoning>" in chunk and "</reasoning>" in chunk:
+        # Extract reasoning and yield it separately with special formatting
+        start_idx = chunk.find("<reasoning>") + len("<reasoning>")
+        end_idx = chunk.find("</reasoning>")
+        reasoning = chunk[start_idx:end_idx].strip()
+        
+        # Yield the reasoning chunk separately
+        yield f"<reasoning>{reasoning}</reasoning>"
+        
+        # Remove the reasoning part from the chunk before processing the rest
+        chunk = chunk[:start_idx - len("<reasoning>")] + chunk[end_idx + len("</reasoning>"):]
+    
+    # Handle the regular token content
+    if chunk:
+        yield chunk  # Yield chunks directly without buffering for faster response
+
+
+def _start_prefetch(shared: SharedContext) -> None:
+    """
+    Start I/O that later nodes need but that doesn't depend on earlier nodes,
+    so it overlaps with the first decision instead of running inside it.
+    """
+    if settings.SEMANTIC_CACHE_ENABLED:
+        # Every DecisionNode visit looks up the semantic cache with the same query embedding
+        shared.query_embedding_task = asyncio.create_task(
+            embedding_service.generate_embedding(shared.query)
+        )
+        # Cache hits may never await it; retrieve any error so it isn't reported as unhandled
+        shared.query_embedding_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
 async def run_agent_flow(
     space_id: str, 
     query: str, 
@@ -61,7 +102,8 @@ async def run_agent_flow(
     stream: bool = True,
     model_name: Optional[str] = None,
     top_k: Optional[int] = None,
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None,
+    regenerate: bool = False
 ) -> Union[str, AsyncGenerator[str, None], Dict[str, Any]]:
     """
     Run the agent flow with the given inputs.
@@ -74,6 +116,7 @@ async def run_agent_flow(
         model_name: Optional model name to use for the response
         top_k: Optional number of top results to consider
         user_id: Optional user ID for tracking or personalization
+        regenerate: Whether the user asked for a fresh answer, bypassing cached responses
         
     Returns:
         Union[str, AsyncGenerator[str, None], Dict[str, Any]]: 
@@ -83,22 +126,16 @@ async def run_agent_flow(
     logger.info(f"Running agent flow for space_id={space_id}, query='{query}', stream={stream}, active_file_id={active_file_id}, model_name={model_name}, top_k={top_k}, user_id={user_id}")
     
     # Create a shared context for the flow
-    shared = {
-        "space_id": space_id,
-        "active_file_id": active_file_id,
-        "query": query,
-        "stream": stream,
-        "model_name": model_name,
-        "top_k": top_k,
-        "user_id": user_id,
-        "context": {},
-        "action_history": [],
-        "thinking_history": [],
-        "tool_retry_count": 0,         # Track the number of consecutive tool retries 
-        "max_tool_retries": 3,         # Maximum number of consecutive retries before forcing finish
-        "total_tool_calls": 0,         # Track total number of tool calls for this query
-        "max_total_tool_calls": 5      # Absolute maximum tool calls to prevent infinite loops
-    }
+    shared = SharedContext(
+        space_id=space_id,
+        query=query,
+        active_file_id=active_file_id,
+        stream=stream,
+        model_name=model_name,
+        top_k=top_k,
+        user_id=user_id,
+        regenerate=regenerate
+    )
     
     if stream:
         # For streaming, we'll create a generator that yields response chunks
@@ -109,93 +146,90 @@ async def run_agent_flow(
             # First, yield a special marker to indicate the start of thinking
             yield "[THINKING_START]\n"
             
-            # Set up a queue for async communication between nodes and this generator
-            shared["event_queue"] = asyncio.Queue()
+            # Set up a bounded queue for async communication between nodes and this generator;
+            # nodes emit through the batcher, which puts lists of events on the queue
+            shared.event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAXSIZE)
+            shared.event_batcher = EventBatcher(shared.event_queue)
             
             # Start a task to run the flow asynchronously
+            _start_prefetch(shared)
             flow_task = asyncio.create_task(flow.run_async(shared))
             
-            # Process events as they come in
-            running = True
-            while running or not shared["event_queue"].empty():
-                try:
-                    # Try to get an event from the queue with a timeout
-                    try:
-                        event = await asyncio.wait_for(shared["event_queue"].get(), 0.1)
-                        
-                        # Process the event based on its type
-                        if event["type"] == "decision":
-                            # Send a special marker for decision events
-                            yield f"[EVENT:{event['type']}]{event['decision']}[/EVENT]\n"
-                        elif event["type"] == "file_edit_start":
-                            # Send a special marker for file edit start events
-                            yield f"[EVENT:{event['type']}]{event['file_id']}[/EVENT]\n"
-                        elif event["type"] == "file_edit_complete":
-                            # Send a special marker for file edit complete events
-                            yield f"[EVENT:{event['type']}]{event['file_id']}[/EVENT]\n"
-                        elif event["type"] == "thinking":
-                            # Send thinking steps as before
-                            yield f"Step {event['step']} Reasoning:\n{event['thinking']}\n\n"
-                        elif event["type"] == "flow_complete":
-                            running = False
-                    except asyncio.TimeoutError:
-                        # Check if the flow has completed
-                        if flow_task.done():
-                            running = False
-                        continue
-                except Exception as e:
-                    logger.error(f"Error processing event: {str(e)}")
-                    yield f"[EVENT:error]Error processing event: {str(e)}[/EVENT]\n"
-            
-            # Wait for the flow task to complete
+            # The client may disconnect mid-stream, closing this generator; the flow must not outlive it
             try:
-                await flow_task
-            except Exception as e:
-                logger.error(f"Error in flow execution: {str(e)}")
-                logger.error(f"Flow execution traceback: {traceback.format_exc()}")
-                yield f"[EVENT:error]Error in flow execution: {str(e)}[/EVENT]\n"
+                # Process events as they come in
+                running = True
+                response_started = False
+                while running or not shared.event_queue.empty() or shared.event_batcher.pending:
+                    try:
+                        # Try to get an event from the queue with a timeout
+                        try:
+                            item = await asyncio.wait_for(shared.event_queue.get(), 0.1)
+                        except asyncio.TimeoutError:
+                            # Check if the flow has completed
+                            if flow_task.done():
+                                # Push out anything still buffered before we stop reading;
+                                # the loop keeps reading until the backlog has drained too
+                                shared.event_batcher.flush()
+                                running = False
+                            continue
+                    
+                        # Batched events arrive as a list, the toolshed may also put single events
+                        for event in (item if isinstance(item, list) else (item,)):
+                            # Process the event based on its type
+                            if event["type"] == "decision":
+                                # Send a special marker for decision events
+                                yield f"[EVENT:{event['type']}]{event['decision']}[/EVENT]\n"
+                            elif event["type"] == "file_edit_start":
+                                # Send a special marker for file edit start events
+                                yield f"[EVENT:{event['type']}]{event['file_id']}[/EVENT]\n"
+                            elif event["type"] == "file_edit_complete":
+                                # Send a special marker for file edit complete events
+                                yield f"[EVENT:{event['type']}]{event['file_id']}[/EVENT]\n"
+                            elif event["type"] == "thinking":
+                                # Send thinking steps as before
+                                yield f"Step {event['step']} Reasoning:\n{event['thinking']}\n\n"
+                            elif event["type"] == "token":
+                                # Response tokens stream out as FinishNode receives them
+                                if not response_started:
+                                    # Yield a marker to indicate the end of thinking and start of response
+                                    yield "[THINKING_END]\n[RESPONSE_START]\n"
+                                    response_started = True
+                                for piece in _format_response_chunk(event["content"]):
+                                    yield piece
+                            elif event["type"] == "flow_complete":
+                                running = False
+                    except Exception as e:
+                        logger.error(f"Error processing event: {str(e)}")
+                        yield f"[EVENT:error]Error processing event: {str(e)}[/EVENT]\n"
             
-            # Yield a marker to indicate the end of thinking and start of response
-            yield "[THINKING_END]\n[RESPONSE_START]\n"
+                # Wait for the flow task to complete
+                try:
+                    await flow_task
+                except Exception as e:
+                    logger.error(f"Error in flow execution: {str(e)}")
+                    logger.error(f"Flow execution traceback: {traceback.format_exc()}")
+                    yield f"[EVENT:error]Error in flow execution: {str(e)}[/EVENT]\n"
             
-            # Get the final response
-            if "final_response" not in shared:
-                logger.error("No final_response in shared context - shared keys: " + str(shared.keys()))
-                final_response = "I encountered an error while processing your request. Please try again."
-                yield final_response
-                yield "[RESPONSE_END]"
-                return
+                # If no tokens were streamed, fall back to the stored final response
+                if not response_started:
+                    # Yield a marker to indicate the end of thinking and start of response
+                    yield "[THINKING_END]\n[RESPONSE_START]\n"
                 
-            final_response = shared.get("final_response", "No response generated")
-            
-            # Log the type of final_response for debugging
-            logger.info(f"Final response type: {type(final_response)}, value preview: {str(final_response)[:100]}")
-            
-            # If the final response is a generator (streaming from the LLM), yield from it
-            if hasattr(final_response, '__aiter__'):
-                async for chunk in final_response:
-                    # Check if the chunk contains a reasoning tag
-                    if "<reasoning>" in chunk and "</reasoning>" in chunk:
-                        # Extract reasoning and yield it separately with special formatting
-                        start_idx = chunk.find("<reasoning>") + len("<reasoning>")
-                        end_idx = chunk.find("</reasoning>")
-                        reasoning = chunk[start_idx:end_idx].strip()
-                        
-                        # Yield the reasoning chunk separately
-                        yield f"<reasoning>{reasoning}</reasoning>"
-                        
-                        # Remove the reasoning part from the chunk before processing the rest
-                        chunk = chunk[:start_idx - len("<reasoning>")] + chunk[end_idx + len("</reasoning>"):]
-                    
-                    # Handle the regular token content
-                    if chunk:
-                        yield chunk  # Yield chunks directly without buffering for faster response
-            else:
-                # Otherwise, yield the entire response
-                yield final_response
+                    if shared.final_response is None:
+                        logger.error("No final_response in shared context")
+                        yield "I encountered an error while processing your request. Please try again."
+                    else:
+                        for piece in _format_response_chunk(shared.final_response):
+                            yield piece
                 
-            # Yield a marker to indicate the end of the response
-            yield "[RESPONSE_END]"
+                # Yield a marker to indicate the end of the response
+                yield "[RESPONSE_END]"
+            finally:
+                for task in (flow_task, shared.query_embedding_task):
+                    if task is not None and not task.done():
+                        task.cancel()
+                shared.event_batcher.close()
             
         # Return the generator
         return stream_generator()
@@ -203,11 +237,12 @@ async def run_agent_flow(
         # For non-streaming, run the flow and return the full response with metadata
         # Now this is just a fallback as we prefer streaming
         flow = create_agent_flow()
+        _start_prefetch(shared)
         await flow.run_async(shared)
         
         # Get the thinking history and final response
-        thinking_history = shared.get("thinking_history", [])
-        final_response = shared.get("final_response", "No response generated")
+        thinking_history = shared.thinking_history
+        final_response = shared.final_response if shared.final_response is not None else "No response generated"
         
         # Return a dictionary with both the final response and thinking history
         return {
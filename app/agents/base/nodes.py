@@ -1,13 +1,170 @@
 """
 Node implementations for the agent workflow using PocketFlow.
 """
-from typing import Dict, Any, List
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Iterable, List, Optional, Sequence
+import asyncio
+import json
 import logging
+import re
+import traceback
+from itertools import islice
+from types import MappingProxyType
 
 from pocketflow import Node, AsyncNode
+from app.core.config import settings
 from app.services.llm_service import llm_service
+from app.services.embedding_service import embedding_service
+from app.services.cache_service import decision_cache, response_cache
 from app.core.logging import logger
-from app.agents.toolshed.flow import run_toolshed_flow
+from app.agents.base.context import ActionEntry, SharedContext
+from app.agents.base.events import (
+    NULL_EVENT_BATCHER,
+    DecisionEvent,
+    DecisionStartEvent,
+    FileEditCompleteEvent,
+    FileEditStartEvent,
+    FinishStartEvent,
+    FlowCompleteEvent,
+    ForcedFinishEvent,
+    RagCompleteEvent,
+    ReasoningEvent,
+    TokenEvent,
+    ToolCompleteEvent,
+    ToolExecutionErrorEvent,
+    ToolExecutionStartEvent,
+)
+# Imported as a module: the toolshed's file tool imports app.agents.base, which imports this module
+from app.agents.toolshed import flow as toolshed_flow
+
+
+_format_exc = traceback.format_exc
+
+# Read-only stand-in for tools that report no parameters
+_EMPTY_MAPPING = MappingProxyType({})
+
+# Phrases that mark a query as casual chat rather than a request
+_CASUAL_GREETINGS = frozenset({"hi", "hello", "hey", "sup", "yo", "howdy", "hiya", "heya", "greetings", "good morning", "good afternoon", "good evening"})
+_MAX_GREETING_LEN = max(map(len, _CASUAL_GREETINGS))
+_CASUAL_QUESTION_PHRASES = ("how are you", "what's up", "wassup", "how's it going", "how are things", "what's new")
+# One alternation matches any phrase anywhere in the query in a single scan
+_CASUAL_RE = re.compile("|".join(map(re.escape, (*sorted(_CASUAL_GREETINGS), *_CASUAL_QUESTION_PHRASES))))
+
+
+# FinishNode prompt templates, compiled once and filled in with str.format per request
+_CASUAL_PROMPT_TEMPLATE = """
+        You are a conversational assistant. For casual greetings or simple queries, keep your responses extremely brief.
+        # USER QUERY
+        {query}
+        
+        # TASK
+        Respond naturally but extremely briefly to this casual greeting. DO NOT explain what the greeting means. Just respond as a human would in a chat.
+        """
+
+_TOOL_CONTEXT_TEMPLATE = """
+        ## TOOL EXECUTION RESULTS
+        Tool: {tool_name}
+        Type: {result_type}
+        {file_info}
+        {success_info}
+        {success_summary}
+        {message}
+        """
+
+_FULL_PROMPT_TEMPLATE = """
+        You are a general purpose chatbot designed to be helpful, informative, and supportive while assisting users with a wide range of tasks, providing accurate information, and responding to queries in a friendly and conversational manner.
+        # USER QUERY
+        {query}
+        
+        # AVAILABLE CONTEXT
+        {rag_results}
+        
+        {action_context}
+        {tool_context}
+        
+        # TASK
+        Based on the user's query and the context information, provide a comprehensive and accurate response.
+        Be direct, concise, and helpful. If you cannot provide a complete answer due to missing information,
+        acknowledge this and provide the best response possible with the available information.
+        
+        {forced_note}
+        
+        # INSTRUCTIONS
+        - If you see that a tool operation was successful, acknowledge it and provide a relevant response.
+        - If the user requested a file edit that was successful, confirm this in your response.
+        - If the user's query was something ambiguous and could have used a tool, or if it was a question that could be answered by the context, ask
+          them if they would like to use a tool. The current tools available are for file reading, and note editing.
+        """
+
+_ACTION_LINE_TEMPLATE = "{index}. Used {tool_name}: [{status}] - {message}\n"
+_ACTION_CHANGES_TEMPLATE = "   Changes: {changes}\n"
+
+
+def _format_action_context(recent_actions: Iterable[ActionEntry]) -> str:
+    """
+    Format the most recent tool actions for the final response prompt.
+    """
+    if not recent_actions:
+        return ""
+    
+    parts = ["## ACTIONS PERFORMED\n"]
+    for i, action in enumerate(recent_actions):
+        if action.get("action", "unknown") != "tool":
+            continue
+        tool_name = action.get("tool_name", "unknown tool")
+        success = action.get("success", False)
+        parts.append(_ACTION_LINE_TEMPLATE.format(
+            index=i + 1,
+            tool_name=tool_name,
+            status="✅ SUCCESS" if success else "❌ FAILED",
+            message=action.get("message", "")
+        ))
+        
+        # Add extra details for successful file edits
+        result = action.get("result")
+        if success and tool_name == "file_interaction" and isinstance(result, dict) and "changes" in result:
+            parts.append(_ACTION_CHANGES_TEMPLATE.format(changes=result["changes"]))
+    return "".join(parts)
+
+
+# Chunks the LLM service streams in place of a response when the call fails
+_STREAM_ERROR_PREFIXES = ("\nError: ", "Error from LLM API: ")
+
+
+def _is_cacheable_decision(decision: Dict[str, Any]) -> bool:
+    # Don't cache the fallback decision returned on errors
+    return not str(decision.get("thinking") or "").startswith("Error")
+
+
+async def _replay_chunks(chunks: Sequence[str]) -> AsyncGenerator[str, None]:
+    """
+    Stream a cached response back chunk by chunk, like a live LLM stream.
+    """
+    for chunk in chunks:
+        yield chunk
+
+
+async def _record_chunks(stream: AsyncIterator[str], cache_key: bytes) -> AsyncGenerator[str, None]:
+    """
+    Pass a live LLM stream through, caching its chunks once it completes without errors.
+    """
+    chunks: List[str] = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    if not any(chunk.startswith(_STREAM_ERROR_PREFIXES) for chunk in chunks):
+        response_cache.set(cache_key, tuple(chunks))
+
+
+def _decision_signature(shared: SharedContext, action_history: Sequence[ActionEntry], active_file_id: Optional[str]) -> str:
+    """
+    Summarise the state a decision depends on, so cached decisions are only
+    reused for the same user and space, at the same stage of the workflow.
+    """
+    recent = [
+        (action.get("action"), action.get("tool_name"), action.get("success"))
+        for action in islice(action_history, max(0, len(action_history) - 5), None)
+    ]
+    return json.dumps([shared.user_id, shared.space_id, bool(active_file_id), recent])
 
 
 class DecisionNode(AsyncNode):
@@ -16,15 +173,15 @@ class DecisionNode(AsyncNode):
     Uses a fast model to quickly decide between RAG, Tool, or Finish actions.
     """
     
-    async def prep_async(self, shared):
+    async def prep_async(self, shared: SharedContext) -> Dict[str, Any]:
         # Get the user query and any context gathered so far
-        query = shared.get("query", "")
-        context = shared.get("context", {})
-        action_history = shared.get("action_history", [])
-        stream = shared.get("stream", True)  # Default to stream
-        active_file_id = shared.get("active_file_id")
+        query = shared.query
+        context = shared.context
+        action_history = shared.action_history
+        stream = shared.stream
+        active_file_id = shared.active_file_id
         
-        logger.info(f"DecisionNode: Processing query '{query}' (stream={stream})")
+        logger.info("DecisionNode: Processing query '{}' (stream={})", query, stream)
         
         return {
             "query": query,
@@ -32,79 +189,134 @@ class DecisionNode(AsyncNode):
             "action_history": action_history,
             "stream": stream,
             "active_file_id": active_file_id,
+            "query_embedding_task": shared.query_embedding_task,
             "_shared": shared  # Pass full shared context for event queue access
         }
     
-    async def exec_async(self, prep_res):
+    async def exec_async(self, prep_res: Dict[str, Any]) -> Dict[str, Any]:
         query = prep_res["query"]
         context = prep_res["context"]
         action_history = prep_res["action_history"]
         stream = prep_res.get("stream", True)
         active_file_id = prep_res.get("active_file_id")
-        shared = prep_res.get("_shared", {})
+        embedding_task = prep_res.get("query_embedding_task")
+        shared = prep_res["_shared"]
         
-        # If stream is enabled and we have an event queue, send a decision start event
-        if stream and "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "decision_start",
-                "message": "Making decision on next action"
-            }
-            await shared["event_queue"].put(event)
-        
-        # Use the LLM service to get the decision
-        decision = await llm_service.get_decision(
-            query=query,
-            context=context,
-            action_history=action_history,
-            stream=stream,
-            active_file_id=active_file_id
+        # Send a decision start event; emitting doesn't block, so the decision
+        # request isn't held up behind it
+        shared.event_batcher.emit(DecisionStartEvent(message="Making decision on next action"))
+        
+        decision = await self._decide(shared, query, context, action_history, stream, active_file_id, embedding_task)
+        
+        # Immediately send the decision event
+        shared.event_batcher.emit(DecisionEvent(decision=decision["action"]))
+        
+        return decision
+    
+    async def _decide(
+        self,
+        shared: SharedContext,
+        query: str,
+        context: Dict[str, Any],
+        action_history: Sequence[ActionEntry],
+        stream: bool,
+        active_file_id: Optional[str],
+        embedding_task: Optional["asyncio.Task[List[float]]"] = None
+    ) -> Dict[str, Any]:
+        """Get the next action, serving exact repeats from the response cache."""
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return await self._request_decision(shared, query, context, action_history, stream, active_file_id, embedding_task)
+        
+        # Decisions are only shared within one user's space
+        cache_key = response_cache.make_key(
+            kind="decision", u=shared.user_id, s=shared.space_id, q=query, h=action_history, f=active_file_id
+        )
+        if shared.regenerate:
+            # An explicit retry asks for a fresh decision, which replaces the cached one
+            decision = await self._request_decision(shared, query, context, action_history, stream, active_file_id, embedding_task)
+            if _is_cacheable_decision(decision):
+                response_cache.set(cache_key, decision)
+            return dict(decision)
+        
+        decision = await response_cache.get_or_compute(
+            cache_key,
+            lambda: self._request_decision(shared, query, context, action_history, stream, active_file_id, embedding_task),
+            should_cache=_is_cacheable_decision
         )
+        return dict(decision)
+    
+    async def _request_decision(
+        self,
+        shared: SharedContext,
+        query: str,
+        context: Dict[str, Any],
+        action_history: Sequence[ActionEntry],
+        stream: bool,
+        active_file_id: Optional[str],
+        embedding_task: Optional["asyncio.Task[List[float]]"] = None
+    ) -> Dict[str, Any]:
+        """Get the next action, consulting the semantic cache before the LLM."""
+        decision = None
+        embedding = None
+        signature = None
+        # An explicit retry asks for a fresh decision, so it neither reuses nor adds a similar one
+        if settings.SEMANTIC_CACHE_ENABLED and not shared.regenerate:
+            signature = _decision_signature(shared, action_history, active_file_id)
+            try:
+                if embedding_task is not None:
+                    # Prefetched at flow start; shielded so one decision giving up can't cancel it for the rest
+                    embedding = await asyncio.shield(embedding_task)
+                else:
+                    embedding = await embedding_service.generate_embedding(query)
+                decision = decision_cache.lookup(embedding, signature)
+            except Exception as e:
+                logger.error("Error looking up semantic decision cache: {}", e)
         
-        # Immediately send the decision event if streaming
-        if stream and "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "decision",
-                "decision": decision["action"]
-            }
-            await shared["event_queue"].put(event)
+        if decision is None:
+            # Use the LLM service to get the decision
+            decision = await llm_service.get_decision(
+                query=query,
+                context=context,
+                action_history=action_history,
+                stream=stream,
+                active_file_id=active_file_id
+            )
+            
+            if embedding is not None and _is_cacheable_decision(decision):
+                decision_cache.add(embedding, signature, decision)
         
         return decision
     
-    async def post_async(self, shared, prep_res, decision):
+    async def post_async(self, shared: SharedContext, prep_res: Dict[str, Any], decision: Dict[str, Any]) -> str:
         # Store thinking for later reference, but keep it minimal
-        thinking_history = shared.get("thinking_history", [])
-        thinking_step = len([t for t in thinking_history if isinstance(t, dict) and t.get("step") == "decision"])
-        thinking_history.append({
-            "step": thinking_step + 1,
-            "thinking": decision.get("thinking", "")
+        shared.decision_thinking_count += 1
+        shared.thinking_history.append({
+            "step": shared.decision_thinking_count,
+            # The LLM may return null or a non-string; ThinkingStep requires a string
+            "thinking": str(decision.get("thinking") or "")
         })
-        shared["thinking_history"] = thinking_history
         
         # Store minimal context for the next step
-        if shared.get("context") is None:
-            shared["context"] = {}
+        if shared.context is None:
+            shared.context = {}
         
         # Store action history - minimal version
-        action_history = shared.get("action_history", [])
-        action_entry = {
+        action_entry: ActionEntry = {
             "action": decision.get("action", "unknown")
         }
-        action_history.append(action_entry)
-        shared["action_history"] = action_history
+        shared.action_history.append(action_entry)
+        shared.recent_actions.append(action_entry)
         
-        # Send decision thinking as a reasoning event if available
-        if "event_queue" in shared and shared["event_queue"] is not None and decision.get("thinking"):
+        # Send decision thinking as a reasoning event if available; only build it when someone is listening
+        if shared.event_batcher is not NULL_EVENT_BATCHER and decision.get("thinking"):
             try:
                 # Format the reasoning with a clear header
                 reasoning_content = f"Initial Decision: I'm deciding on the next step for '{prep_res.get('query', '')}'\n\n{decision['thinking']}"
-                await shared["event_queue"].put({
-                    "type": "reasoning",
-                    "content": reasoning_content
-                })
+                shared.event_batcher.emit(ReasoningEvent(content=reasoning_content))
             except Exception as e:
-                logger.error(f"Error sending decision reasoning event: {str(e)}")
+                logger.error("Error sending decision reasoning event: {}", e)
         
-        logger.info(f"DecisionNode: Next action '{decision.get('action')}'")
+        logger.info("DecisionNode: Next action '{}'", decision.get("action"))
         
         return decision.get("action")
 
@@ -116,13 +328,13 @@ class RAGNode(AsyncNode):
     Currently a placeholder that returns a message.
     """
     
-    async def prep_async(self, shared):
-        query = shared.get("query", "")
-        context = shared.get("context", {})
-        space_id = shared.get("space_id", "")
-        stream = shared.get("stream", False)
+    async def prep_async(self, shared: SharedContext) -> Dict[str, Any]:
+        query = shared.query
+        context = shared.context
+        space_id = shared.space_id
+        stream = shared.stream
         
-        logger.info(f"RAGNode: Processing query for space '{space_id}' (stream={stream})")
+        logger.info("RAGNode: Processing query for space '{}' (stream={})", space_id, stream)
         
         return {
             "query": query,
@@ -131,26 +343,21 @@ class RAGNode(AsyncNode):
             "stream": stream
         }
     
-    async def exec_async(self, prep_res):
+    async def exec_async(self, prep_res: Dict[str, Any]) -> Dict[str, Any]:
         # Placeholder implementation
         return {
             "message": "RAG has not been implemented yet, continue",
             "result_type": "placeholder"
         }
     
-    async def post_async(self, shared, prep_res, results):
+    async def post_async(self, shared: SharedContext, prep_res: Dict[str, Any], results: Dict[str, Any]) -> str:
         # Update the context with the RAG results
-        context = shared.get("context", {})
-        context["rag_results"] = results
-        shared["context"] = context
-        
-        # If we have an event queue, send the RAG complete event
-        if "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "rag_complete",
-                "message": results.get("message", "RAG processing complete")
-            }
-            await shared["event_queue"].put(event)
+        shared.context["rag_results"] = results
+        
+        # Send the RAG complete event
+        shared.event_batcher.emit(RagCompleteEvent(
+            message=results.get("message", "RAG processing complete")
+        ))
         
         # Always go back to the decision node
         return "decide"
@@ -161,16 +368,16 @@ class ToolShedNode(AsyncNode):
     Node for executing tools based on the decision made.
     """
     
-    async def prep_async(self, shared):
-        query = shared.get("query", "")
-        context = shared.get("context", {})
-        action_history = shared.get("action_history", [])
-        active_file_id = shared.get("active_file_id")
-        space_id = shared.get("space_id")
-        user_id = shared.get("user_id")
-        stream = shared.get("stream", False)
+    async def prep_async(self, shared: SharedContext) -> Dict[str, Any]:
+        query = shared.query
+        context = shared.context
+        action_history = shared.action_history
+        active_file_id = shared.active_file_id
+        space_id = shared.space_id
+        user_id = shared.user_id
+        stream = shared.stream
         
-        logger.info(f"ToolShedNode: Processing query for toolshed, active_file_id={active_file_id}")
+        logger.info("ToolShedNode: Processing query for toolshed, active_file_id={}", active_file_id)
         
         return {
             "query": query,
@@ -183,7 +390,7 @@ class ToolShedNode(AsyncNode):
             "_shared": shared  # Store the shared context for later access
         }
     
-    async def exec_async(self, prep_res):
+    async def exec_async(self, prep_res: Dict[str, Any]) -> Dict[str, Any]:
         """Execute the tool and return results."""
         query = prep_res.get("query", "")
         context = prep_res.get("context", {})
@@ -192,22 +399,19 @@ class ToolShedNode(AsyncNode):
         space_id = prep_res.get("space_id")
         user_id = prep_res.get("user_id")
         stream = prep_res.get("stream", False)
-        shared = prep_res.get("_shared", {})  # Get the shared context
-        
-        # If we have an event queue, send the tool execution start event
-        if shared and "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "tool_execution_start",
-                "message": "Starting tool selection and execution process",
-                "query": query
-            }
-            await shared["event_queue"].put(event)
+        shared = prep_res["_shared"]  # Get the shared context
+        
+        # Send the tool execution start event
+        shared.event_batcher.emit(ToolExecutionStartEvent(
+            message="Starting tool selection and execution process",
+            query=query
+        ))
+        # The toolshed puts its events on the queue directly, so flush ours first to keep them ordered
+        shared.event_batcher.flush()
         
         try:
-            from app.agents.toolshed.flow import run_toolshed_flow
-            
             # Run the toolshed flow to execute the selected tool
-            tool_results = await run_toolshed_flow(
+            tool_results = await toolshed_flow.run_toolshed_flow(
                 query=query,
                 context=context,
                 action_history=action_history,
@@ -215,24 +419,24 @@ class ToolShedNode(AsyncNode):
                 active_file_id=active_file_id,
                 space_id=space_id,
                 user_id=user_id,
-                event_queue=shared.get("event_queue") if shared else None  # Pass the event queue to toolshed
+                event_queue=shared.event_queue,  # Pass the event queue to toolshed
+                regenerate=shared.regenerate
             )
             
-            # Add extensive debugging about tool_results
-            logger.info(f"ToolShedNode: Tool execution completed. Results type: {type(tool_results)}")
-            logger.info(f"ToolShedNode: Tool execution results: {tool_results}")
+            # One record for the results; loguru only formats them if a handler takes the record
+            logger.info(
+                "ToolShedNode: Tool execution completed. Results type: {}, results: {}",
+                type(tool_results).__name__, tool_results
+            )
             
             if tool_results is None:
                 logger.error("ToolShedNode: Tool results is None. Setting default response.")
                 
                 # Send error event
-                if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                    event = {
-                        "type": "tool_execution_error",
-                        "message": "Tool execution returned no results",
-                        "error": "No results returned"
-                    }
-                    await shared["event_queue"].put(event)
+                shared.event_batcher.emit(ToolExecutionErrorEvent(
+                    message="Tool execution returned no results",
+                    error="No results returned"
+                ))
                     
                 return {
                     "result_type": "error",
@@ -244,19 +448,15 @@ class ToolShedNode(AsyncNode):
             
         except Exception as e:
             # Handle any exceptions from tool execution
-            logger.error(f"Error executing tool: {str(e)}")
-            import traceback
-            logger.error(f"Tool execution error traceback: {traceback.format_exc()}")
+            tb = _format_exc()
+            logger.error("Error executing tool: {}\nTool execution error traceback: {}", e, tb)
             
             # Send error event
-            if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                event = {
-                    "type": "tool_execution_error",
-                    "message": f"Error executing tool: {str(e)}",
-                    "error": str(e),
-                    "traceback": traceback.format_exc()
-                }
-                await shared["event_queue"].put(event)
+            shared.event_batcher.emit(ToolExecutionErrorEvent(
+                message=f"Error executing tool: {str(e)}",
+                error=str(e),
+                traceback=tb
+            ))
             
             return {
                 "result_type": "error",
@@ -264,163 +464,116 @@ class ToolShedNode(AsyncNode):
                 "tool_name": "unknown"
             }
     
-    async def post_async(self, shared, prep_res, tool_results):
+    async def post_async(self, shared: SharedContext, prep_res: Dict[str, Any], tool_results: Dict[str, Any]) -> str:
         """Process tool results and decide next step."""
-        # Add tool results to context
-        context = shared.get("context", {})
-        
-        # Enhanced formatting of tool_results for better context sharing
-        if isinstance(tool_results, dict):
-            # Ensure we capture all relevant information for later nodes
-            # Result info comes from 'result' key typically
-            result = tool_results.get("result", {})
-            
-            # Add enhanced information to tool_results if available
-            if isinstance(result, dict):
-                # If a file edit was successful, let's emphasize that in the message
-                if (tool_results.get("tool_used", tool_results.get("tool_name")) == "file_interaction" and
-                    result.get("success", False) and "changes" in result):
-                    
-                    # Make sure the message field exists and has clear indication of success
-                    if "message" not in tool_results or not tool_results["message"]:
-                        tool_results["message"] = f"File edit successful. {result.get('message', '')}"
-                    
-                    # Add a specific success_summary that other nodes can easily check
-                    tool_results["success_summary"] = (
-                        f"✅ File edit completed successfully:\n{result.get('changes', 'Changes applied to file.')}"
-                    )
-        
-        # Store the enhanced tool_results in context
-        context["tool_results"] = tool_results
-        shared["context"] = context
-        
-        # Increment the total tool calls counter
-        shared["total_tool_calls"] = shared.get("total_tool_calls", 0) + 1
-        
-        # Extract the correct tool name from the results
+        # Read everything we need from the results once
         tool_name = tool_results.get("tool_used", tool_results.get("tool_name", "unknown"))
-        
-        # Map result_type to a more standardized format
         result_type = tool_results.get("result_type", "unknown")
-        
-        # Extract parameters properly - avoid recursive data
-        parameters = {}
-        if "parameters" in tool_results:
-            parameters = {k: v for k, v in tool_results["parameters"].items() if k != "_shared"}
-        
-        action_entry = {
-            "action": "tool",
-            "tool_name": tool_name,
-            "result_type": result_type,
-            "parameters": parameters
-        }
-        
-        # Check for success or failure based on result
         result = tool_results.get("result", {})
-        if isinstance(result, dict) and "success" in result:
+        result_is_dict = isinstance(result, dict)
+        
+        # Classify the outcome in a single pass
+        if result_is_dict and "success" in result:
             # Some tools explicitly return success status
-            action_entry["success"] = result["success"]
-            if not result["success"]:
-                action_entry["message"] = result.get("error", "Unknown error")
+            success = result["success"]
+            if success:
+                message = result.get("message", "Tool executed successfully")
             else:
-                action_entry["message"] = result.get("message", "Tool executed successfully")
-                # Include the complete result for more context
-                action_entry["result"] = result
+                message = result.get("error", "Unknown error")
         elif "error" in tool_results:
             # Tool returned an error
-            action_entry["success"] = False
-            action_entry["message"] = tool_results.get("error", "Unknown error")
+            success = False
+            message = tool_results["error"]
         elif result_type == "error":
             # Result type indicates error
-            action_entry["success"] = False
-            action_entry["message"] = "Tool execution error"
+            success = False
+            message = "Tool execution error"
         else:
             # All other cases count as success
-            action_entry["success"] = True
-            action_entry["message"] = tool_results.get("message", "Tool executed")
-            # Include the complete result for more context if available
-            if isinstance(result, dict):
-                action_entry["result"] = result
+            success = True
+            message = tool_results.get("message", "Tool executed")
+        
+        # If a file edit was successful, let's emphasize that for later nodes
+        if tool_name == "file_interaction" and result_is_dict and result.get("success", False) and "changes" in result:
+            # Make sure the message field exists and has clear indication of success
+            if not tool_results.get("message"):
+                tool_results["message"] = f"File edit successful. {result.get('message', '')}"
+            
+            # Add a specific success_summary that other nodes can easily check
+            tool_results["success_summary"] = (
+                f"✅ File edit completed successfully:\n{result.get('changes', 'Changes applied to file.')}"
+            )
+        
+        # Store the enhanced tool_results in context
+        shared.context["tool_results"] = tool_results
+        
+        # Increment the total tool calls counter
+        shared.total_tool_calls += 1
+        
+        # Tools pass the shared context separately, so parameters can be stored as is
+        action_entry: ActionEntry = {
+            "action": "tool",
+            "tool_name": tool_name,
+            "result_type": result_type,
+            "parameters": tool_results.get("parameters", _EMPTY_MAPPING),
+            "success": success,
+            "message": message
+        }
+        if success and result_is_dict:
+            # Include the complete result for more context
+            action_entry["result"] = result
             
-        action_history = shared.get("action_history", [])
-        action_history.append(action_entry)
-        shared["action_history"] = action_history
+        shared.action_history.append(action_entry)
+        shared.recent_actions.append(action_entry)
         
         # Update retry counter based on success or failure
-        if action_entry["success"]:
+        if success:
             # Reset retry counter on success
-            shared["tool_retry_count"] = 0
+            shared.tool_retry_count = 0
         else:
             # Increment retry counter on failure
-            shared["tool_retry_count"] = shared.get("tool_retry_count", 0) + 1
-            logger.info(f"Tool failed, retry count now at {shared['tool_retry_count']}")
+            shared.tool_retry_count += 1
+            logger.info("Tool failed, retry count now at {}", shared.tool_retry_count)
         
         # Check if we've hit any retry limits
-        if shared.get("tool_retry_count", 0) >= shared.get("max_tool_retries", 3):
+        if shared.tool_retry_count >= shared.max_tool_retries:
             # Force finish after too many consecutive retries
-            logger.warning(f"Tool retry limit reached ({shared['tool_retry_count']}). Forcing finish.")
+            logger.warning("Tool retry limit reached ({}). Forcing finish.", shared.tool_retry_count)
             
-            # Add an event to the queue if streaming is enabled
-            if shared.get("stream", False) and "event_queue" in shared:
-                try:
-                    event = {
-                        "type": "forced_finish",
-                        "message": "Automatically finishing due to too many consecutive tool failures"
-                    }
-                    await shared["event_queue"].put(event)
-                except Exception as e:
-                    logger.error(f"Error sending forced_finish event: {str(e)}")
+            # Let the client know why the flow is finishing
+            try:
+                shared.event_batcher.emit(ForcedFinishEvent(
+                    message="Automatically finishing due to too many consecutive tool failures"
+                ))
+            except Exception as e:
+                logger.error("Error sending forced_finish event: {}", e)
             
             return "finish"
             
         # Check if we've hit total tool calls limit
-        if shared.get("total_tool_calls", 0) >= shared.get("max_total_tool_calls", 5):
+        if shared.total_tool_calls >= shared.max_total_tool_calls:
             # Force finish after too many total tool calls
-            logger.warning(f"Total tool calls limit reached ({shared['total_tool_calls']}). Forcing finish.")
+            logger.warning("Total tool calls limit reached ({}). Forcing finish.", shared.total_tool_calls)
             
-            # Add an event to the queue if streaming is enabled
-            if shared.get("stream", False) and "event_queue" in shared:
-                try:
-                    event = {
-                        "type": "forced_finish",
-                        "message": "Automatically finishing due to maximum tool call limit reached"
-                    }
-                    await shared["event_queue"].put(event)
-                except Exception as e:
-                    logger.error(f"Error sending forced_finish event: {str(e)}")
+            # Let the client know why the flow is finishing
+            try:
+                shared.event_batcher.emit(ForcedFinishEvent(
+                    message="Automatically finishing due to maximum tool call limit reached"
+                ))
+            except Exception as e:
+                logger.error("Error sending forced_finish event: {}", e)
             
             return "finish"
         
-        # Add an event to the queue if streaming is enabled and the queue exists
-        if shared.get("stream", False) and "event_queue" in shared:
-            # If tool is making file edits, send special markers
-            if tool_results.get("result_type") == "file_edit" and "file_id" in tool_results:
-                try:
-                    # First, send a marker that edit is starting
-                    start_event = {
-                        "type": "file_edit_start",
-                        "file_id": tool_results["file_id"]
-                    }
-                    await shared["event_queue"].put(start_event)
-                    
-                    # Then, after a short delay, send a marker that edit is complete
-                    complete_event = {
-                        "type": "file_edit_complete",
-                        "file_id": tool_results["file_id"]
-                    }
-                    await shared["event_queue"].put(complete_event)
-                except Exception as e:
-                    logger.error(f"Error sending file edit events: {str(e)}")
-            
-            # Send a general tool complete event
-            try:
-                tool_event = {
-                    "type": "tool_complete",
-                    "tool": tool_results.get("tool_name", "unknown")
-                }
-                await shared["event_queue"].put(tool_event)
-            except Exception as e:
-                logger.error(f"Error sending tool complete event: {str(e)}")
+        batcher = shared.event_batcher
+        
+        # If tool is making file edits, send special markers for the start and completion of the edit
+        if result_type == "file_edit" and "file_id" in tool_results:
+            batcher.emit(FileEditStartEvent(file_id=tool_results["file_id"]))
+            batcher.emit(FileEditCompleteEvent(file_id=tool_results["file_id"]))
+        
+        # Send a general tool complete event
+        batcher.emit(ToolCompleteEvent(tool=tool_results.get("tool_name", "unknown")))
         
         # Always go back to the decision node after tool execution
         return "decide"
@@ -432,49 +585,45 @@ class FinishNode(AsyncNode):
     Optimized for fast streaming responses with exposed reasoning.
     """
     
-    async def prep_async(self, shared):
-        query = shared.get("query", "")
-        context = shared.get("context", {})
-        action_history = shared.get("action_history", [])
-        stream = shared.get("stream", True)  # Default to stream
-        model_name = shared.get("model_name", "deepseek/deepseek-chat:free")
+    async def prep_async(self, shared: SharedContext) -> Dict[str, Any]:
+        query = shared.query
+        context = shared.context
+        # The deque already holds only the last few actions, so no slicing is needed
+        recent_actions = shared.recent_actions
+        stream = shared.stream
+        model_name = shared.model_name
         
-        logger.info(f"FinishNode: Generating final response (stream={stream})")
+        logger.info("FinishNode: Generating final response (stream={})", stream)
         
         return {
             "query": query,
             "context": context,
-            "action_history": action_history,
+            "recent_actions": recent_actions,
             "stream": stream,
             "model_name": model_name,
             "_shared": shared  # Pass the shared context for event handling
         }
     
-    async def exec_async(self, prep_res):
+    async def exec_async(self, prep_res: Dict[str, Any]) -> str:
         query = prep_res["query"]
         context = prep_res.get("context", {})
-        action_history = prep_res.get("action_history", [])
+        recent_actions = prep_res.get("recent_actions", ())
         stream = prep_res.get("stream", True)
         model_name = prep_res.get("model_name", "deepseek/deepseek-chat:free")
-        shared = prep_res.get("_shared", {})
+        shared = prep_res["_shared"]
         
-        # If streaming, notify that we're starting response generation
-        if stream and "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "finish_start",
-                "message": "Starting final response generation"
-            }
-            await shared["event_queue"].put(event)
+        # Notify that we're starting response generation
+        shared.event_batcher.emit(FinishStartEvent(message="Starting final response generation"))
             
         # Check if we were forced to finish due to retry limits
         was_forced = False
         forced_message = ""
-        if shared.get("tool_retry_count", 0) >= shared.get("max_tool_retries", 3):
+        if shared.tool_retry_count >= shared.max_tool_retries:
             was_forced = True
-            forced_message = f"The system encountered {shared.get('tool_retry_count')} consecutive tool failures and could not complete your request. "
-        elif shared.get("total_tool_calls", 0) >= shared.get("max_total_tool_calls", 5):
+            forced_message = f"The system encountered {shared.tool_retry_count} consecutive tool failures and could not complete your request. "
+        elif shared.total_tool_calls >= shared.max_total_tool_calls:
             was_forced = True
-            forced_message = f"The system reached the maximum number of tool calls ({shared.get('total_tool_calls')}) and could not complete all operations. "
+            forced_message = f"The system reached the maximum number of tool calls ({shared.total_tool_calls}) and could not complete all operations. "
             
         # Optimize context for the final response - keep it minimal
         # Extract only what's needed from available context
@@ -482,32 +631,20 @@ class FinishNode(AsyncNode):
         tool_results = context.get("tool_results", {})
         
         # Check if this is a casual greeting or very simple query
-        casual_greetings = ["hi", "hello", "hey", "sup", "yo", "howdy", "hiya", "heya", "greetings", "good morning", "good afternoon", "good evening"]
-        casual_questions = ["how are you", "what's up", "wassup", "how's it going", "how are things", "what's new"]
-        
-        words = query.lower().split()
-        is_casual = (len(words) <= 5 and 
-                    (any(greeting in query.lower() for greeting in casual_greetings) or
-                     any(question in query.lower() for question in casual_questions) or
-                     query.lower().strip() in casual_greetings))
+        stripped = query.strip()
+        if len(stripped) <= _MAX_GREETING_LEN and stripped.lower() in _CASUAL_GREETINGS:
+            # Bare greetings are short, so they're settled by one hash lookup on a tiny string
+            is_casual = True
+        else:
+            # Stop splitting after 6 words, and only lowercase and scan queries short enough to qualify
+            is_casual = len(query.split(None, 5)) <= 5 and _CASUAL_RE.search(query.lower()) is not None
         
         if is_casual:
-            prompt = f"""
-        You are a conversational assistant. For casual greetings or simple queries, keep your responses extremely brief.
-        # USER QUERY
-        {query}
-        
-        # TASK
-        Respond naturally but extremely briefly to this casual greeting. DO NOT explain what the greeting means. Just respond as a human would in a chat.
-        """
+            prompt = _CASUAL_PROMPT_TEMPLATE.format(query=query)
         else:
             # Extract detailed information from tool_results for final response
             tool_context = ""
             if tool_results:
-                # Include tool name and type
-                tool_name = tool_results.get("tool_used", tool_results.get("tool_name", "unknown"))
-                result_type = tool_results.get("result_type", "unknown")
-                
                 # Extract any success information
                 success_info = ""
                 result = tool_results.get("result", {})
@@ -521,96 +658,70 @@ class FinishNode(AsyncNode):
                     elif result.get("success") is False:
                         success_info = f"❌ FAILED: {result.get('error', 'Operation failed')}"
                 
-                # Include file information if present
-                file_info = ""
-                if "file_id" in tool_results:
-                    file_info = f"File ID: {tool_results['file_id']}"
-                
-                # Include any message
-                message = tool_results.get("message", "")
-                
-                # Check for success_summary field added by ToolShedNode
-                success_summary = tool_results.get("success_summary", "")
-                
                 # Compile all information
-                tool_context = f"""
-        ## TOOL EXECUTION RESULTS
-        Tool: {tool_name}
-        Type: {result_type}
-        {file_info}
-        {success_info}
-        {success_summary}
-        {message}
-        """
-            
-            # Format action history for context
-            action_context = ""
-            if action_history:
-                action_context = "## ACTIONS PERFORMED\n"
-                for i, action in enumerate(action_history[-3:]):  # Only include last 3 actions for brevity
-                    action_type = action.get('action', 'unknown')
-                    if action_type == "tool":
-                        tool_name = action.get('tool_name', 'unknown tool')
-                        success = action.get('success', False)
-                        success_str = "✅ SUCCESS" if success else "❌ FAILED"
-                        message = action.get('message', '')
-                        
-                        action_context += f"{i+1}. Used {tool_name}: [{success_str}] - {message}\n"
-                        
-                        # Add extra details for successful file edits
-                        if (success and tool_name == "file_interaction" and 
-                            "result" in action and isinstance(action["result"], dict)):
-                            result = action["result"]
-                            if "changes" in result:
-                                action_context += f"   Changes: {result['changes']}\n"
+                tool_context = _TOOL_CONTEXT_TEMPLATE.format(
+                    tool_name=tool_results.get("tool_used", tool_results.get("tool_name", "unknown")),
+                    result_type=tool_results.get("result_type", "unknown"),
+                    file_info=f"File ID: {tool_results['file_id']}" if "file_id" in tool_results else "",
+                    success_info=success_info,
+                    # Check for success_summary field added by ToolShedNode
+                    success_summary=tool_results.get("success_summary", ""),
+                    message=tool_results.get("message", "")
+                )
             
-            prompt = f"""
-        You are a general purpose chatbot designed to be helpful, informative, and supportive while assisting users with a wide range of tasks, providing accurate information, and responding to queries in a friendly and conversational manner.
-        # USER QUERY
-        {query}
-        
-        # AVAILABLE CONTEXT
-        {rag_results if rag_results else "No additional context available."}
-        
-        {action_context}
-        {tool_context}
-        
-        # TASK
-        Based on the user's query and the context information, provide a comprehensive and accurate response.
-        Be direct, concise, and helpful. If you cannot provide a complete answer due to missing information,
-        acknowledge this and provide the best response possible with the available information.
-        
-        {"IMPORTANT NOTE: " + forced_message if was_forced else ""}
-        
-        # INSTRUCTIONS
-        - If you see that a tool operation was successful, acknowledge it and provide a relevant response.
-        - If the user requested a file edit that was successful, confirm this in your response.
-        - If the user's query was something ambiguous and could have used a tool, or if it was a question that could be answered by the context, ask
-          them if they would like to use a tool. The current tools available are for file reading, and note editing.
-        """
+            prompt = _FULL_PROMPT_TEMPLATE.format(
+                query=query,
+                rag_results=rag_results if rag_results else "No additional context available.",
+                action_context=_format_action_context(recent_actions),
+                tool_context=tool_context,
+                forced_note="IMPORTANT NOTE: " + forced_message if was_forced else ""
+            )
                 
-        # Generate the final response - always stream for immediate feedback
-        response_text = await llm_service._call_llm(
-            prompt=prompt,
-            stream=True,  # Always stream
-            temperature=0.3,
-            max_tokens=2048,
-            model_name=model_name
-        )
+        # The prompt captures every input to the response, so identical prompts can be replayed
+        cache_key = None
+        cached_chunks = None
+        if settings.RESPONSE_CACHE_ENABLED:
+            cache_key = response_cache.make_key(
+                kind="finish", u=shared.user_id, s=shared.space_id, prompt=prompt, m=model_name
+            )
+            # An explicit retry asks for a fresh answer, which replaces the cached one
+            if not shared.regenerate:
+                cached_chunks = response_cache.get(cache_key)
         
-        return response_text
+        if cached_chunks is not None:
+            logger.info("FinishNode: Replaying cached response")
+            response_stream = _replay_chunks(cached_chunks)
+        else:
+            # Generate the final response - always stream for immediate feedback
+            response_stream = await llm_service._call_llm(
+                prompt=prompt,
+                stream=True,  # Always stream
+                temperature=0.3,
+                max_tokens=2048,
+                model_name=model_name
+            )
+            
+            if cache_key is not None:
+                response_stream = _record_chunks(response_stream, cache_key)
+        
+        # Forward tokens to the client as they arrive and keep them for the final response
+        # Skip allocating an event per token when there is no stream consumer
+        batcher = shared.event_batcher if shared.event_batcher is not NULL_EVENT_BATCHER else None
+        parts: List[str] = []
+        async for chunk in response_stream:
+            parts.append(chunk)
+            if batcher is not None:
+                batcher.emit(TokenEvent(content=chunk))
+        
+        return "".join(parts)
     
-    async def post_async(self, shared, prep_res, response_text):
+    async def post_async(self, shared: SharedContext, prep_res: Dict[str, Any], response_text: str) -> str:
         # Set the final response in the shared context
-        shared["final_response"] = response_text
+        shared.final_response = response_text
         
-        # If we have an event queue, send the flow complete event
-        if "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "flow_complete",
-                "message": "Agent flow completed successfully"
-            }
-            await shared["event_queue"].put(event)
+        # Send the flow complete event and flush right away
+        shared.event_batcher.emit(FlowCompleteEvent(message="Agent flow completed successfully"))
+        shared.event_batcher.flush()
         
         # Return finish to indicate completion
         return "complete"
@@ -2,12 +2,12 @@
 Flow module for research digest generation.
 """
 import re
-import yaml
 import json
 import asyncio
 from typing import List, Dict, Any, Optional, Tuple
 
 from app.core.logging import logger
+from app.core.yaml_utils import safe_load
 from app.services.llm_service import llm_service
 from app.agents.research.nodes import DigestNode
 
@@ -86,7 +86,7 @@ async def generate_search_queries(notes_content: str, space_id: str, note_ids: L
         
         # Extract YAML from response
         yaml_str = extract_yaml_from_text(response_text)
-        result = yaml.safe_load(yaml_str)
+        result = safe_load(yaml_str)
         
         topic_groups = result.get("parameters", {}).get("topic_groups", [])
         
@@ -227,7 +227,7 @@ async def generate_digest(notes_content: str, search_results: List[Tuple[str, st
         
         try:
             # Try to parse the YAML
-            result = yaml.safe_load(yaml_str)
+            result = safe_load(yaml_str)
             
             # Extract digest components
             parameters = result.get("parameters", {})
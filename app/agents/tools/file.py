@@ -1,16 +1,677 @@
 # app/tools/file.py
 
-import json
+import codecs
+import gzip
+import hashlib
 import asyncio
-from typing import Dict, Any, List, Optional
-import yaml
+import re
+import string
+from typing import Dict, Any, List, Optional, Tuple, Union
+import msgpack
+import orjson
 
 from pocketflow import AsyncNode
+from app.core.config import settings
 from app.core.logging import logger
+from app.core.yaml_utils import safe_load
+from app.agents.base.events import emit_event
 from app.services.llm_service import llm_service
+from app.services.cache_service import file_content_cache, file_meta_cache, numbered_note_cache, response_cache
 from app.models.space_file import SpaceFile
+from app.db.sqlite import sqlite_mirror
 from app.db.supabase import supabase_client
 
+# Compiled once for _extract_yaml_from_text: a ```yaml fenced block, or else the line holding the first action key
+_YAML_FENCE_RE = re.compile(r"```yaml(.*?)```", re.DOTALL)
+_YAML_ACTION_LINE_RE = re.compile(r"^[^\n]*?action:", re.MULTILINE)
+
+# Compiled once for _handle_file_edit: words marking an edit query as a fix, or as a request to keep writing
+_FIX_QUERY_RE = re.compile(r"\b(?:fix|issue)\b", re.IGNORECASE)
+_CONTINUATION_QUERY_RE = re.compile(r"\b(?:continue|finish|more|add|write more|keep going)\b", re.IGNORECASE)
+
+# A replace_snippet specification: start line, original content, new content and end line
+_SNIPPET_RE = re.compile(
+    r"<<<<<<< ORIGINAL //\s*Line\s*(\d+)[^\n]*\n(.*?)^\s*=======\s*$(.*?)^\s*>>>>>>> UPDATED //\s*Line\s*(\d+)",
+    re.DOTALL | re.MULTILINE
+)
+
+# Line number prefix added by _number_lines, for stripping it from content the LLM copied back
+_LINE_NUMBER_PREFIX_RE = re.compile(r"^\s*\d+: ")
+
+# Snippet replacements in notes of at least this many blocks only see the blocks around their target
+_EDIT_WINDOW_MIN_BLOCKS = 40
+_EDIT_WINDOW_RADIUS = 3
+# Query words a block's text must contain before it is trusted as the edit target
+_EDIT_WINDOW_MIN_MATCHES = 2
+
+# Snippet replacements in notes at least this large run in a worker thread, off the event loop
+_REPLACE_IN_THREAD_MIN_BYTES = 64 * 1024
+
+# Model used to summarize files on the view path
+_FILE_VIEW_MODEL = "deepseek/deepseek-chat-v3-0324"
+
+# Faster model tried first for views of short content, and the content size up to which it is used
+_FILE_VIEW_SMALL_MODEL = "google/gemini-2.0-flash-001"
+_SMALL_VIEW_MAX_CHARS = 8000
+
+# Viewing only looks at this many characters of a file
+_VIEW_MAX_CHARS = 35000
+# Upper bound on the UTF-8 encoded size of _VIEW_MAX_CHARS characters
+_VIEW_MAX_BYTES = _VIEW_MAX_CHARS * 4
+
+# Prompt for summarizing a file on the view path, parsed once instead of rebuilt per call
+_VIEW_PROMPT = string.Template("""
+        # USER QUERY
+        ${query}
+        
+        # FILE INFORMATION
+        File Name: ${file_name}
+        File Type: ${file_type}
+        Is Note: ${is_note}
+        
+        # FILE CONTENT
+        ${processed_content}
+        ${truncated_note}
+        
+        # TASK
+        Based on the user query, provide the most relevant information from this file.
+        Generate a detailed summary or extract the specific information requested.
+        You must include as much relevant information as possible from the file, and your thoughts.
+
+        IMPORTANT:
+        - If you detect any issues, typos, or needed improvements in the file AND the file is marked as "Is Note: Yes",
+          you can suggest fixing it with action=fix_note_issue
+        - These improvements can be to any aspect of the note - text content, formatting, tables, lists, code blocks, etc.
+        - If the file is NOT a note (Is Note: No), you cannot suggest edits, only provide a summary or get more context
+        
+        Respond in YAML format:
+        ```yaml
+        thinking: |
+            <your step-by-step reasoning about what information is most relevant>
+        action: <one of: provide_summary, needs_more_context, fix_note_issue>
+        parameters:
+            summary: <detailed summary of the file content relevant to the query>
+            next_chunk_start: <if needs_more_context, position to continue from>
+            fix_description: <if action is fix_note_issue, describe what needs to be fixed>
+        ```
+        """)
+
+# Distilled note format shown to the LLM when editing: the props of each block type and one small example of the common ones
+_NOTE_SCHEMA_COMPACT = """A note is a JSON array of blocks: {"id": "<uuid>", "type": "<type>", "props": {...}, "content": [<inline>], "children": [<nested blocks>]}.
+        Block types and their props (textColor/backgroundColor: "default" or a color name; textAlignment: "left", "center" or "right"):
+        - paragraph, bulletListItem, numberedListItem: textColor, backgroundColor, textAlignment
+        - heading: textColor, backgroundColor, textAlignment, level (1-3)
+        - checkListItem: textColor, backgroundColor, textAlignment, checked (true/false)
+        - codeBlock: language
+        - table: textColor; content is {"type": "tableContent", "columnWidths": [null, ...], "rows": [{"cells": [[<inline>], ...]}]}
+        - image, video: backgroundColor, textAlignment, name, url, caption, showPreview, previewWidth; no content
+        - audio: backgroundColor, name, url, caption, showPreview; no content
+        - file: backgroundColor, name, url, caption; no content
+        Inline content is a list of {"type": "text", "text": "...", "styles": {}}, where styles may set bold, italic, underline
+        or strike to true and textColor or backgroundColor to a color, or {"type": "link", "href": "<url>", "content": [<text>]}.
+        Examples:
+        {"id":"a5912cac-94e6-4e58-a676-65f30de19843","type":"heading","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","level":1},"content":[{"type":"text","text":"Heading","styles":{}}],"children":[]}
+        {"id":"a6c4eb71-a9e3-4297-8d57-289e52d75d8e","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"bold ","styles":{"bold":true}},{"type":"link","href":"https://example.com","content":[{"type":"text","text":"link","styles":{}}]}],"children":[]}
+        {"id":"fafb20b9-be57-4f1c-9034-0f81e538c2ca","type":"checkListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","checked":false},"content":[{"type":"text","text":"check","styles":{}}],"children":[]}
+        {"id":"ab147517-625b-4067-a078-42ea96ef2115","type":"codeBlock","props":{"language":"python"},"content":[{"type":"text","text":"code","styles":{}}],"children":[]}
+        {"id":"32c4879e-1f0f-4d17-b5cb-5ad8cd69457f","type":"table","props":{"textColor":"default"},"content":{"type":"tableContent","columnWidths":[null,null],"rows":[{"cells":[[{"type":"text","text":"a","styles":{}}],[]]}]},"children":[]}
+        {"id":"756bc02f-0bcb-4219-8c2b-361c4a85cfd8","type":"image","props":{"backgroundColor":"default","textAlignment":"center","name":"photo","url":"https://example.com/photo.jpg","caption":"","showPreview":true,"previewWidth":512},"children":[]}"""
+
+# Asks OpenRouter for a response that is a single valid JSON object
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Instructions for editing a note, identical for every edit so providers can cache them as a prompt prefix
+_EDIT_SYSTEM_PROMPT = f"""
+        # TASK
+        You are editing a structured note file. The file format is a specialized JSON structure 
+        that must be preserved. Each block has an 'id', 'type', 'props', 'content', and 'children' fields.
+        {_NOTE_SCHEMA_COMPACT}
+        
+        Additionally, you may assume you can use any primary color for the text, or background color.
+        Your response needs to perfectly match this format.
+        
+        The user message holds the user's query, the note content and guidance for this edit.
+        IMPORTANT: The note content shows each top-level block of the JSON array as one numbered line.
+        When specifying line numbers for edits, use these line numbers; a line always holds a whole block.
+        
+        Respond with a single JSON object:
+        {{
+            "thinking": "<your step-by-step reasoning>",
+            "action": "<one of: append, replace_snippet, needs_more_context>",
+            "parameters": {{
+                "modified_content": <if append: a JSON array of the new blocks to add at the end>
+                                    <if replace_snippet: a JSON Patch array or a string, in one of the formats below>,
+                "reason": "<explanation of changes made>"
+            }}
+        }}
+        
+        For replace_snippet, prefer a JSON Patch (RFC 6902) array of "replace", "add" and "remove" operations
+        applied to the note's JSON array. A path starts with the index of a block, which is its line number minus 1:
+        [{{"op": "replace", "path": "/4/content/0/text", "value": "Fixed text"}}, {{"op": "add", "path": "/7", "value": <new block>}}]
+        
+        Otherwise modified_content uses this exact format:
+        <<<<<<< ORIGINAL // Line X
+        (original content to replace)
+        =======
+        (new content)
+        >>>>>>> UPDATED // Line Y
+        
+        IMPORTANT: 
+        1. When replacing content with the format above, include the ENTIRE block(s) you want to replace, not just parts of them.
+        2. Ensure all JSON structure is preserved. All IDs must be kept the same unless specifically changed.
+        3. The line numbers must correspond to the numbered blocks shown in the user message.
+        4. Make sure the replacement content is valid JSON that can be parsed.
+        5. Follow the guidance given for this edit.
+        """
+
+# Guidance closing the edit prompt, by whether the query asks for a fix and whether it asks to keep writing
+_FIX_GUIDANCE = ("Based on issue detection, you need to fix the identified problem in this note. "
+                 "Since this is a fix operation, focus on correcting the specific issue described.")
+_CONTINUATION_GUIDANCE = ("Based on the user requesting to continue or add more to the note, analyze the existing content and add appropriate extensions. "
+                          "Since this is a continuation request, focus on extending the existing content in a natural way.")
+_DEFAULT_GUIDANCE = ("Based on the user's query, determine how to modify this note. "
+                     "Make only the changes necessary to fulfill the user's request.")
+_EDIT_GUIDANCE = {
+    (is_fix, is_continuation): f"""
+        # GUIDANCE
+        {" ".join(text for text, applies in ((_FIX_GUIDANCE, is_fix), (_CONTINUATION_GUIDANCE, is_continuation)) if applies) or _DEFAULT_GUIDANCE}
+        """
+    for is_fix in (False, True)
+    for is_continuation in (False, True)
+}
+
+# Example note covering every block type and style, only shown to the LLM when
+# retrying an edit the compact schema didn't get right
+_NOTE_EXAMPLE = """
+[
+  {
+    "id": "a5912cac-94e6-4e58-a676-65f30de19843",
+    "type": "heading",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left",
+      "level": 1
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "Heading",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "1359bca2-b113-4c62-a7c2-a6b9dfe55ee7",
+    "type": "heading",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left",
+      "level": 2
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "Heading",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "27ce7c91-8de6-4e04-9604-00fcff492bf3",
+    "type": "heading",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left",
+      "level": 3
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "Heading",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "94202c43-e32f-4011-a5fe-81746edfcdde",
+    "type": "numberedListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "numbered",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "2b68268c-b89b-4656-9430-32cec85af15b",
+    "type": "numberedListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "list",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "950076f6-cac6-4f39-ae96-63bba0934870",
+    "type": "bulletListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "bullet",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "409b84f3-0ac3-4fef-b30a-0216b15461c7",
+    "type": "bulletListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "list",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "fafb20b9-be57-4f1c-9034-0f81e538c2ca",
+    "type": "checkListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left",
+      "checked": false
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "check",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "1e5d6848-1b14-4f0e-b343-54c35cb3a141",
+    "type": "checkListItem",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left",
+      "checked": true
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "list",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "c5a16743-171d-4f0a-acd8-4aa5b7133c63",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "Paragraph",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "ab147517-625b-4067-a078-42ea96ef2115",
+    "type": "codeBlock",
+    "props": {
+      "language": "python"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "code",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "32c4879e-1f0f-4d17-b5cb-5ad8cd69457f",
+    "type": "table",
+    "props": {
+      "textColor": "default"
+    },
+    "content": {
+      "type": "tableContent",
+      "columnWidths": [
+        null,
+        null,
+        null
+      ],
+      "rows": [
+        {
+          "cells": [
+            [
+              {
+                "type": "text",
+                "text": "t",
+                "styles": {}
+              }
+            ],
+            [
+              {
+                "type": "text",
+                "text": "a",
+                "styles": {}
+              }
+            ],
+            [
+              {
+                "type": "text",
+                "text": "b",
+                "styles": {}
+              }
+            ]
+          ]
+        },
+        {
+          "cells": [
+            [
+              {
+                "type": "text",
+                "text": "l",
+                "styles": {}
+              }
+            ],
+            [
+              {
+                "type": "text",
+                "text": "e",
+                "styles": {}
+              }
+            ],
+            []
+          ]
+        }
+      ]
+    },
+    "children": []
+  },
+  {
+    "id": "a6c4eb71-a9e3-4297-8d57-289e52d75d8e",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "inline text: ",
+        "styles": {}
+      },
+      {
+        "type": "text",
+        "text": "text, ",
+        "styles": {
+          "bold": true
+        }
+      },
+      {
+        "type": "text",
+        "text": "text, ",
+        "styles": {
+          "italic": true
+        }
+      },
+      {
+        "type": "text",
+        "text": "text,",
+        "styles": {
+          "underline": true
+        }
+      },
+      {
+        "type": "text",
+        "text": " ",
+        "styles": {}
+      },
+      {
+        "type": "text",
+        "text": "text,",
+        "styles": {
+          "strike": true
+        }
+      },
+      {
+        "type": "text",
+        "text": " text",
+        "styles": {
+          "textColor": "red"
+        }
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "97ba2bbe-4bd3-44a2-9caf-b376250ed559",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "center"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "centered",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "13950c09-860b-4ee0-9bee-b630ea53720f",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "right"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "right",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "06c1bc43-af2b-4536-8250-5fef9e53f34b",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "link",
+        "href": "https://interactive-examples.mdn.mozilla.net/media/cc0-audio/t-rex-roar.mp3",
+        "content": [
+          {
+            "type": "text",
+            "text": "link",
+            "styles": {
+              "underline": true,
+              "textColor": "blue"
+            }
+          }
+        ]
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "bdb645f1-8e05-49e0-8307-f258f6d0b21b",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "background",
+        "styles": {
+          "backgroundColor": "purple"
+        }
+      }
+    ],
+    "children": [
+      {
+        "id": "bc21d51b-a0a5-4209-8427-205c7569bd0b",
+        "type": "paragraph",
+        "props": {
+          "textColor": "default",
+          "backgroundColor": "default",
+          "textAlignment": "left"
+        },
+        "content": [
+          {
+            "type": "text",
+            "text": "nested block",
+            "styles": {}
+          }
+        ],
+        "children": []
+      }
+    ]
+  },
+  {
+    "id": "756bc02f-0bcb-4219-8c2b-361c4a85cfd8",
+    "type": "image",
+    "props": {
+      "backgroundColor": "default",
+      "textAlignment": "center",
+      "name": "grapefruit-slice",
+      "url": "https://interactive-examples.mdn.mozilla.net/media/cc0-images/grapefruit-slice-332-332.jpg",
+      "caption": "https://interactive-examples.mdn.mozilla.net/media/cc0-images/grapefruit-slice-332-332.jpg",
+      "showPreview": true,
+      "previewWidth": 512
+    },
+    "children": []
+  },
+  {
+    "id": "68525ebb-7648-4945-96b3-9e40e8508445",
+    "type": "video",
+    "props": {
+      "backgroundColor": "default",
+      "textAlignment": "right",
+      "name": "flower.webm",
+      "url": "https://interactive-examples.mdn.mozilla.net/media/cc0-videos/flower.webm",
+      "caption": "video",
+      "showPreview": true,
+      "previewWidth": 512
+    },
+    "children": []
+  },
+  {
+    "id": "db560f2e-c1b7-4f74-b913-ce6864c4c746",
+    "type": "audio",
+    "props": {
+      "backgroundColor": "default",
+      "name": "t-rex-roar.mp3",
+      "url": "https://interactive-examples.mdn.mozilla.net/media/cc0-audio/t-rex-roar.mp3",
+      "caption": "",
+      "showPreview": true
+    },
+    "children": []
+  },
+  {
+    "id": "b6051d7a-83a7-445e-95d6-baee60ffb211",
+    "type": "file",
+    "props": {
+      "backgroundColor": "default",
+      "name": "Aidan_Andrews_Resume.pdf",
+      "url": "https://aidanandrews22.github.io/content/pdf/Aidan_Andrews_Resume.pdf",
+      "caption": "file"
+    },
+    "children": []
+  },
+  {
+    "id": "5bac388c-c5a0-4017-b754-1817a776f48c",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [
+      {
+        "type": "text",
+        "text": "emoji: 😀 ",
+        "styles": {}
+      }
+    ],
+    "children": []
+  },
+  {
+    "id": "b32c0b17-36f3-4ac7-99d6-b690b1232817",
+    "type": "paragraph",
+    "props": {
+      "textColor": "default",
+      "backgroundColor": "default",
+      "textAlignment": "left"
+    },
+    "content": [],
+    "children": []
+  }
+]
+"""
+
 # Database interaction functions
 async def get_file_by_id(file_id: str) -> Optional[SpaceFile]:
     """
@@ -22,12 +683,27 @@ async def get_file_by_id(file_id: str) -> Optional[SpaceFile]:
     Returns:
         Optional[SpaceFile]: The file information or None if not found.
     """
+    if settings.FILE_CACHE_ENABLED:
+        # Repeat lookups within the TTL, and concurrent ones, share a single query
+        return await file_meta_cache.get_or_compute(
+            file_id,
+            lambda: _fetch_file_by_id(file_id),
+            should_cache=lambda file_info: file_info is not None
+        )
+    return await _fetch_file_by_id(file_id)
+
+async def _fetch_file_by_id(file_id: str) -> Optional[SpaceFile]:
+    """Look up a file in the local mirror, then in the database, bypassing the in-process cache."""
     try:
-        # Use the Supabase client to get file data
-        file_data = await supabase_client.get_space_file(file_id)
+        # The local mirror is only open when enabled, otherwise this returns None
+        file_data = await sqlite_mirror.get_space_file(file_id)
         if not file_data:
-            logger.error(f"File with ID {file_id} not found")
-            return None
+            # Use the Supabase client to get file data
+            file_data = await supabase_client.get_space_file(file_id)
+            if not file_data:
+                logger.error(f"File with ID {file_id} not found")
+                return None
+            await sqlite_mirror.put_space_file(file_id, file_data)
         
         # Convert to SpaceFile object
         return SpaceFile.from_dict(file_data)
@@ -35,7 +711,7 @@ async def get_file_by_id(file_id: str) -> Optional[SpaceFile]:
         logger.error(f"Error getting file by ID: {str(e)}")
         return None
 
-async def download_file(bucket: str, file_path: str) -> str:
+async def download_file(bucket: str, file_path: str) -> bytes:
     """
     Download a file from Supabase storage.
     
@@ -44,41 +720,77 @@ async def download_file(bucket: str, file_path: str) -> str:
         file_path: The path of the file in storage.
         
     Returns:
-        str: The file content as a string.
+        bytes: The raw file content; orjson.loads accepts it without decoding first.
     """
     try:
-        # Use the Supabase client to fetch the file
-        file_bytes = await supabase_client.fetch_file_from_storage(file_path)
-        # Convert bytes to string
-        return file_bytes.decode('utf-8')
+        # Use the Supabase client to fetch the file, keeping the raw bytes cached
+        if settings.FILE_CACHE_ENABLED:
+            file_bytes = await file_content_cache.get_or_compute(
+                (bucket, file_path),
+                lambda: supabase_client.fetch_file_from_storage(file_path)
+            )
+        else:
+            file_bytes = await supabase_client.fetch_file_from_storage(file_path)
+        return file_bytes
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         raise
 
-async def upload_file(bucket: str, file_path: str, content: str) -> bool:
+async def download_file_range(bucket: str, file_path: str, start: int = 0, length: int = _VIEW_MAX_BYTES) -> str:
+    """
+    Download part of a file from Supabase storage.
+    
+    Only the requested bytes are transferred, so callers that look at the start
+    of a file don't pay for the rest of it.
+    
+    Args:
+        bucket: The storage bucket name.
+        file_path: The path of the file in storage.
+        start: Offset of the first byte to download.
+        length: Maximum number of bytes to download.
+        
+    Returns:
+        str: The downloaded content as a string, without any character cut off at the end of the range.
+    """
+    try:
+        # Decode incrementally; a multi-byte character split by the range end is held back
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        
+        # The whole file may already be cached
+        if settings.FILE_CACHE_ENABLED:
+            cached = file_content_cache.get((bucket, file_path))
+            if cached is not None:
+                return decoder.decode(cached[start:start + length])
+        
+        parts = []
+        async for chunk in supabase_client.stream_file_range_from_storage(file_path, start, length, bucket=bucket):
+            parts.append(decoder.decode(chunk))
+        return "".join(parts)
+    except Exception as e:
+        logger.error(f"Error downloading file range: {str(e)}")
+        raise
+
+async def upload_file(bucket: str, file_path: str, content: Union[str, bytes], content_type: str = "application/json") -> bool:
     """
     Upload a file to Supabase storage.
     
     Args:
         bucket: The storage bucket name.
         file_path: The path of the file in storage.
-        content: The content to upload.
+        content: The content to upload, as text or already encoded bytes.
+        content_type: The MIME type stored with the file.
         
     Returns:
         bool: True if upload was successful, False otherwise.
     """
     try:
-        # Convert string to bytes
-        content_bytes = content.encode('utf-8')
-        
-        # Use the Supabase client to upload the file
-        # We need to handle the upload through the storage API
-        # Note: The options need to have string values, not booleans
-        response = supabase_client.client.storage.from_(bucket).upload(
-            file_path,
-            content_bytes,
-            {"contentType": "application/json", "upsert": "true"}
-        )
+        # Convert string to bytes, unless the caller already has them
+        content_bytes = content.encode('utf-8') if isinstance(content, str) else content
+        
+        # Upload through the storage API without blocking the event loop, replacing any existing file
+        await supabase_client.upload_file_to_storage(file_path, content_bytes, bucket=bucket, content_type=content_type)
+        # Don't serve the old content for this path from the cache
+        file_content_cache.invalidate((bucket, file_path))
         
         logger.info(f"File uploaded successfully: {file_path}")
         return True
@@ -86,6 +798,403 @@ async def upload_file(bucket: str, file_path: str, content: str) -> bool:
         logger.error(f"Error uploading file: {str(e)}")
         return False
 
+# Suffixes of the MessagePack copy of a virtual JSON snapshot, and of the snapshot when stored gzipped
+_MSGPACK_SUFFIX = ".msgpack"
+_GZIP_SUFFIX = ".gz"
+
+async def upload_note_snapshot(bucket: str, file_path: str, content: Union[str, bytes]) -> bool:
+    """
+    Upload an edited note as JSON, plus a MessagePack copy when enabled.
+    
+    The JSON file is what the browser reads; with gzip enabled it is stored compressed,
+    under file_path + ".gz", for readers that decompress it. The MessagePack copy is
+    smaller and decodes without escape parsing, for internal readers of the snapshot.
+    
+    Args:
+        bucket: The storage bucket name.
+        file_path: The path of the JSON snapshot in storage.
+        content: The note as JSON text or bytes.
+        
+    Returns:
+        bool: True if the JSON upload was successful, False otherwise.
+    """
+    if settings.FILE_SNAPSHOT_GZIP_ENABLED:
+        content_bytes = content.encode('utf-8') if isinstance(content, str) else content
+        upload_json = upload_file(
+            bucket, file_path + _GZIP_SUFFIX, gzip.compress(content_bytes, compresslevel=6), content_type="application/gzip"
+        )
+    else:
+        upload_json = upload_file(bucket, file_path, content)
+    if not settings.FILE_SNAPSHOT_MSGPACK_ENABLED:
+        return await upload_json
+    
+    packed = msgpack.packb(orjson.loads(content), use_bin_type=True)
+    json_success, packed_success = await asyncio.gather(
+        upload_json,
+        upload_file(bucket, file_path + _MSGPACK_SUFFIX, packed, content_type="application/msgpack")
+    )
+    if not packed_success:
+        logger.warning(f"MessagePack snapshot not stored for {file_path}")
+    return json_success
+
+async def download_note_snapshot(bucket: str, file_path: str) -> Any:
+    """
+    Download and parse a note snapshot, preferring its MessagePack copy when enabled.
+    
+    Args:
+        bucket: The storage bucket name.
+        file_path: The path of the JSON snapshot in storage.
+        
+    Returns:
+        Any: The parsed note.
+    """
+    if settings.FILE_SNAPSHOT_MSGPACK_ENABLED:
+        try:
+            return msgpack.unpackb(await download_file(bucket, file_path + _MSGPACK_SUFFIX), raw=False)
+        except Exception as e:
+            logger.warning(f"Falling back to JSON snapshot for {file_path}: {str(e)}")
+    if settings.FILE_SNAPSHOT_GZIP_ENABLED:
+        return orjson.loads(gzip.decompress(await download_file(bucket, file_path + _GZIP_SUFFIX)))
+    return orjson.loads(await download_file(bucket, file_path))
+
+# Background prefetches, referenced until done so they aren't garbage collected mid-flight
+_prefetch_tasks = set()
+
+def prefetch_file(file_id: str, bucket: str = "Vox") -> None:
+    """
+    Start loading a file's metadata and content into the file caches in the background.
+    
+    Called while the agent is still deciding on a tool, so the Supabase round-trips
+    overlap with that LLM call. A lookup made while the prefetch is in flight waits
+    for it instead of issuing its own.
+    
+    Args:
+        file_id: The ID of the file to prefetch.
+        bucket: The storage bucket name.
+    """
+    if not settings.FILE_CACHE_ENABLED:
+        return
+    task = asyncio.create_task(_prefetch_file(file_id, bucket))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+async def _prefetch_file(file_id: str, bucket: str) -> None:
+    try:
+        file_info = await get_file_by_id(file_id)
+        # Larger files are only ever viewed, which downloads just the start of them
+        if file_info and file_info.file_size is not None and file_info.file_size <= _VIEW_MAX_BYTES:
+            await download_file(bucket, file_info.file_path)
+    except Exception as e:
+        logger.warning(f"Error prefetching file {file_id}: {str(e)}")
+
+# Query words suggesting the LLM may need to point at specific lines of a note
+_LINE_REF_KEYWORDS = ("edit", "fix", "line", "replace", "insert")
+
+def _needs_line_refs(query: str) -> bool:
+    """Cheap check for whether a view query may need line numbers in the note content."""
+    query = query.lower()
+    return any(keyword in query for keyword in _LINE_REF_KEYWORDS)
+
+def _choose_view_model(query: str, content_len: int) -> str:
+    """Pick the model to summarize a file view with: the small one for short content and plain questions."""
+    if content_len < _SMALL_VIEW_MAX_CHARS and not _needs_line_refs(query):
+        return _FILE_VIEW_SMALL_MODEL
+    return _FILE_VIEW_MODEL
+
+def _number_lines(text: str) -> str:
+    """Prefix each line of text with its 1-based line number."""
+    # split('\n') rather than splitlines(), to number lines exactly as _apply_snippet_replacement
+    # counts them; join builds a list from a generator anyway, and StringIO writes were slower still
+    return '\n'.join([f"{i}: {line}" for i, line in enumerate(text.split('\n'), 1)])
+
+def _note_lines(note_data: Any) -> List[str]:
+    """
+    Split a parsed note into the lines it is shown to the LLM as.
+    
+    A note is a list of blocks, so each top-level block is one compact JSON line and
+    a line number addresses a whole block. Anything else is indented JSON.
+    """
+    if isinstance(note_data, list):
+        return [orjson.dumps(block).decode() for block in note_data]
+    return orjson.dumps(note_data, option=orjson.OPT_INDENT_2).decode().split('\n')
+
+def _as_text(content: Union[str, bytes]) -> str:
+    """Return file content as text, decoding downloaded bytes."""
+    return content.decode('utf-8') if isinstance(content, bytes) else content
+
+def _block_index(blocks: List[Any], block_id: Any, hint: int) -> Optional[int]:
+    """
+    Find the index of the top-level block with the given ID.
+    
+    The block at hint, the index the LLM's line number points at, is checked first,
+    so only a wrong line number costs a scan of the note.
+    """
+    if 0 <= hint < len(blocks) and isinstance(blocks[hint], dict) and blocks[hint].get('id') == block_id:
+        return hint
+    for i, block in enumerate(blocks):
+        if isinstance(block, dict) and block.get('id') == block_id:
+            return i
+    return None
+
+def _appended_blocks(modified_content: Any) -> List[Dict[str, Any]]:
+    """
+    Parse the blocks an append adds to a note, as a string or already parsed by JSON mode.
+    
+    A single block object is taken as a list of one block.
+    
+    Raises:
+        ValueError: If the content isn't valid JSON, or isn't a block or list of blocks.
+    """
+    blocks = _loads_lenient(modified_content) if isinstance(modified_content, (str, bytes)) else modified_content
+    if isinstance(blocks, dict):
+        blocks = [blocks]
+    if not isinstance(blocks, list) or not all(isinstance(block, dict) for block in blocks):
+        raise ValueError(f"expected a JSON array of blocks, got {type(blocks).__name__}")
+    return blocks
+
+def _matching_block_index(blocks: List[Any], block: Dict[str, Any], hint: int) -> Optional[int]:
+    """
+    Find the index of the top-level block equal to the given one, checking hint first.
+    """
+    if 0 <= hint < len(blocks) and blocks[hint] == block:
+        return hint
+    for i, candidate in enumerate(blocks):
+        if candidate == block:
+            return i
+    return None
+
+def _line_offset(text: str, line: int, offset: int = 0, offset_line: int = 0) -> int:
+    """
+    Find where a 0-based line of text starts, counting on from a known line start.
+    
+    Returns len(text) + 1 for the line after the last one, so slicing from it gives nothing.
+    """
+    for _ in range(line - offset_line):
+        offset = text.find('\n', offset) + 1
+        if offset == 0:
+            return len(text) + 1
+    return offset
+
+def _apply_json_patch(document: Any, operations: List[Any]) -> Any:
+    """
+    Apply the add, remove and replace operations of a JSON Patch (RFC 6902).
+    
+    The document itself is left untouched: each container on a patched path is
+    copied before it changes, so nothing is applied unless every operation is.
+    
+    Returns:
+        The patched document.
+        
+    Raises:
+        ValueError: If an operation is malformed or unsupported, or its path doesn't apply.
+    """
+    # Containers copied for this patch, kept alive so their ids stay unique
+    copies: Dict[int, Any] = {}
+    
+    def own(container: Any) -> Any:
+        if id(container) in copies:
+            return container
+        copied = list(container) if isinstance(container, list) else dict(container)
+        copies[id(copied)] = copied
+        return copied
+    
+    if not isinstance(document, (list, dict)):
+        raise ValueError("JSON Patch target must be an array or object")
+    result = own(document)
+    
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get("path"), str):
+            raise ValueError(f"Invalid JSON Patch operation: {operation!r}")
+        op, path = operation.get("op"), operation["path"]
+        if op not in ("add", "remove", "replace") or not path.startswith("/"):
+            raise ValueError(f"Unsupported JSON Patch operation: {op} {path}")
+        if op != "remove" and "value" not in operation:
+            raise ValueError(f"JSON Patch {op} at {path} has no value")
+        
+        # Walk to the parent of the target, unescaping each reference token
+        # and copying every container on the way
+        tokens = [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+        parent = result
+        for token in tokens[:-1]:
+            key = _patch_key(parent, token, path)
+            child = parent[key]
+            if not isinstance(child, (list, dict)):
+                raise ValueError(f"JSON Patch path {path} runs through a {type(child).__name__}")
+            parent[key] = parent = own(child)
+        
+        token = tokens[-1]
+        if op == "add" and isinstance(parent, list):
+            parent.insert(len(parent) if token == "-" else _patch_key(parent, token, path, size=len(parent) + 1), operation["value"])
+        elif op == "add":
+            parent[token] = operation["value"]
+        elif op == "remove":
+            del parent[_patch_key(parent, token, path)]
+        else:
+            parent[_patch_key(parent, token, path)] = operation["value"]
+    return result
+
+def _patch_key(parent: Union[List[Any], Dict[str, Any]], token: str, path: str, size: Optional[int] = None) -> Union[int, str]:
+    """
+    Resolve a JSON Pointer reference token against the container it indexes.
+    
+    A token for an array must be a decimal index below size, which defaults to
+    the length of the array; a token for an object must be one of its keys.
+    
+    Raises:
+        ValueError: If the token doesn't resolve.
+    """
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise ValueError(f"JSON Patch path {path} doesn't apply: no member {token!r}")
+        return token
+    size = len(parent) if size is None else size
+    if not (token.isascii() and token.isdigit()) or (len(token) > 1 and token[0] == "0") or int(token) >= size:
+        raise ValueError(f"JSON Patch path {path} doesn't apply: bad index {token!r}")
+    return int(token)
+
+# Control characters an LLM tends to leave unescaped inside JSON strings
+_JSON_STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+def _repair_json(text: str) -> str:
+    """
+    Fix the mistakes that most often make LLM-written JSON unparseable.
+
+    Drops trailing commas and escapes raw newlines and tabs inside strings. A truncated
+    response is deliberately not closed, so part of an edit is never taken for all of it;
+    the result may still fail to parse.
+    """
+    out: List[str] = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            else:
+                ch = _JSON_STRING_ESCAPES.get(ch, ch)
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "]}":
+            _drop_trailing_comma(out)
+        out.append(ch)
+    return "".join(out)
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    """Remove a comma, and any whitespace after it, from the end of the output of _repair_json."""
+    i = len(out)
+    while i and out[i - 1].isspace():
+        i -= 1
+    if i and out[i - 1] == ",":
+        del out[i - 1:]
+
+def _loads_lenient(text: Union[str, bytes]) -> Any:
+    """
+    Parse JSON written by an LLM, repairing it locally if it doesn't parse as is.
+
+    Raises:
+        orjson.JSONDecodeError: If the JSON is invalid even after repair; the error is
+            the one for the original text.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as error:
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="replace")
+        try:
+            value = orjson.loads(_repair_json(text))
+        except orjson.JSONDecodeError:
+            raise error
+        logger.info("Parsed LLM output after repairing its JSON locally")
+        return value
+
+def _try_loads(text: Union[str, bytes]) -> Tuple[bool, Any]:
+    """
+    Parse JSON written by an LLM like _loads_lenient, for callers that branch on whether it parsed.
+    
+    Returns:
+        Tuple[bool, Any]: (True, value) on success, or (False, None) if the text isn't valid JSON.
+    """
+    try:
+        return True, _loads_lenient(text)
+    except orjson.JSONDecodeError:
+        return False, None
+
+def _cache_scope(file_info: SpaceFile, file_content: Union[str, bytes], user_id: Optional[str], space_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Identify the file content and requester an LLM answer about a file depends on.
+    
+    Prompts may only hold part of the file, such as an edit excerpt, so cached answers
+    are keyed on a digest of all the content read instead, and never shared across
+    users or spaces.
+    """
+    raw = file_content.encode('utf-8') if isinstance(file_content, str) else file_content
+    return {
+        "u": user_id,
+        "s": space_id,
+        "f": str(file_info.id),
+        "c": hashlib.blake2b(raw, digest_size=16).hexdigest(),
+    }
+
+def _block_text(node: Any) -> List[str]:
+    """Collect the inline text strings of a block, its content (including table cells) and its children."""
+    if isinstance(node, list):
+        return [text for item in node for text in _block_text(item)]
+    if not isinstance(node, dict):
+        return []
+    texts = []
+    for key in ("text", "content", "rows", "cells", "children"):
+        value = node.get(key)
+        if isinstance(value, str):
+            # Plain string content is the block's text as is
+            texts.append(value)
+        else:
+            texts.extend(_block_text(value))
+    return texts
+
+def _windowed_context(note_data: Any, numbered_content: str, query: str, radius: int = _EDIT_WINDOW_RADIUS) -> Optional[str]:
+    """
+    Cut a line-numbered note down to the blocks around the one a query most likely targets.
+    
+    The target is the top-level block whose text shares the most words with the query; only
+    inline text counts, not keys, IDs or types. Line numbers are kept from the full note, so
+    snippet replacements made against the excerpt still apply.
+    
+    Args:
+        note_data: The parsed note, a list of blocks.
+        numbered_content: The whole note as formatted by _add_line_numbers_to_note.
+        query: The edit query.
+        radius: Number of blocks to keep on either side of the target.
+        
+    Returns:
+        Optional[str]: The excerpt, or None if the note is short or no single block clearly
+            matches the query, i.e. the best has fewer than _EDIT_WINDOW_MIN_MATCHES words or is tied.
+    """
+    if not isinstance(note_data, list) or len(note_data) < _EDIT_WINDOW_MIN_BLOCKS or numbered_content.count('\n') + 1 != len(note_data):
+        return None
+    words = set(re.findall(r"\w{4,}", query.lower()))
+    if not words:
+        return None
+    
+    best, best_score, tied = None, 0, False
+    for i, block in enumerate(note_data):
+        score = len(words.intersection(re.findall(r"\w+", " ".join(_block_text(block)).lower())))
+        if score > best_score:
+            best, best_score, tied = i, score, False
+        elif score == best_score:
+            tied = True
+    if best is None or best_score < _EDIT_WINDOW_MIN_MATCHES or tied:
+        return None
+    
+    # Each block is one numbered line, so block i is line i + 1
+    lines = numbered_content.split('\n')
+    first, last = max(best - radius, 0), min(best + radius, len(lines) - 1)
+    return f"(Excerpt: lines {first + 1}-{last + 1} of {len(lines)}; the rest of the note is unchanged)\n" + '\n'.join(lines[first:last + 1])
+
 
 class FileInteraction(AsyncNode):
     """
@@ -101,14 +1210,15 @@ class FileInteraction(AsyncNode):
         
         logger.info(f"FileInteraction: Processing with parameters: {parameters}, active_file_id: {active_file_id}")
         
-        # Store shared context in parameters for access by other methods
-        parameters["_shared"] = shared
-        
         return {
             "parameters": parameters,
+            "event_queue": shared.get("event_queue"),
             "query": query,
             "context": context,
-            "active_file_id": active_file_id
+            "active_file_id": active_file_id,
+            "user_id": shared.get("user_id"),
+            "space_id": shared.get("space_id"),
+            "regenerate": shared.get("regenerate", False)
         }
     
     async def exec_async(self, prep_res):
@@ -116,8 +1226,7 @@ class FileInteraction(AsyncNode):
         query = prep_res["query"]
         active_file_id = prep_res.get("active_file_id")
         context = prep_res["context"]
-        shared = parameters.get("_shared", {})
-        event_queue = shared.get("event_queue")
+        event_queue = prep_res.get("event_queue")
         
         # Always prioritize active_file_id from context over parameters
         # This is the file ID passed from the agent endpoint
@@ -125,14 +1234,10 @@ class FileInteraction(AsyncNode):
         
         if not file_id:
             # Send event about missing file ID
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_missing_id",
-                        "message": "No file ID provided for file interaction"
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_missing_id event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "file_missing_id",
+                "message": "No file ID provided for file interaction"
+            })
             
             return {
                 "success": False,
@@ -142,349 +1247,295 @@ class FileInteraction(AsyncNode):
         logger.info(f"FileInteraction: Using file_id={file_id}")
         
         # Send event that file lookup is starting
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_lookup_start",
-                    "message": "Looking up file information",
-                    "file_id": file_id
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_lookup_start event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "file_lookup_start",
+            "message": "Looking up file information",
+            "file_id": file_id
+        })
+        
+        # Determine the action (view/read vs edit)
+        action = parameters.get("action", "view")
+        
+        # Viewing only looks at the start of the file, so only that part is downloaded
+        if action in ["view", "read"]:
+            fetch_content = lambda path: download_file_range("Vox", path)
+        else:
+            fetch_content = lambda path: download_file("Vox", path)
+        
+        # If the caller already knows the storage path, download it while the metadata is looked up
+        hinted_path = parameters.get("file_path")
+        download_task = asyncio.create_task(fetch_content(hinted_path)) if hinted_path else None
         
         # Get file information from database
-        file_info = await get_file_by_id(file_id)
+        try:
+            file_info = await get_file_by_id(file_id)
+        except BaseException:
+            if download_task is not None:
+                download_task.cancel()
+            raise
+        
+        if download_task is not None and (not file_info or file_info.file_path != hinted_path):
+            # The hint was wrong, or there is nothing to download
+            download_task.cancel()
+            download_task = None
+        
         if not file_info:
             # Send event about file not found
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_not_found",
-                        "message": f"File with ID {file_id} not found",
-                        "file_id": file_id
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_not_found event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "file_not_found",
+                "message": f"File with ID {file_id} not found",
+                "file_id": file_id
+            })
             
             return {
                 "success": False,
                 "error": f"File with ID {file_id} not found"
             }
         
-        # Send event that file was found
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_found",
-                    "message": f"Found file: {file_info.file_name}",
-                    "file_id": file_id,
-                    "file_name": file_info.file_name,
-                    "file_type": file_info.file_type,
-                    "is_note": file_info.is_note,
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_found event: {str(e)}")
-        
-        # Send event that downloading is starting
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_download_start",
-                    "message": "Downloading file content",
-                    "file_id": file_id,
-                    "file_name": file_info.file_name
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_download_start event: {str(e)}")
+        # Send events that the file was found and downloading is starting, as one batch
+        emit_event(event_queue, [
+            {
+                "type": "file_found",
+                "message": f"Found file: {file_info.file_name}",
+                "file_id": file_id,
+                "file_name": file_info.file_name,
+                "file_type": file_info.file_type,
+                "is_note": file_info.is_note,
+            },
+            {
+                "type": "file_download_start",
+                "message": "Downloading file content",
+                "file_id": file_id,
+                "file_name": file_info.file_name
+            }
+        ])
         
         # Download file from storage
         file_path = file_info.file_path
         try:
-            file_content = await download_file("Vox", file_path)
+            if download_task is not None:
+                file_content = await download_task
+            else:
+                file_content = await fetch_content(file_path)
             
             # Send event that download completed
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_download_complete",
-                        "message": "Successfully downloaded file content",
-                        "file_id": file_id,
-                        "file_name": file_info.file_name,
-                        "content_length": len(file_content)
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_download_complete event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "file_download_complete",
+                "message": "Successfully downloaded file content",
+                "file_id": file_id,
+                "file_name": file_info.file_name,
+                "content_length": len(file_content)
+            })
                     
         except Exception as e:
             # Send event about download error
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_download_error",
-                        "message": f"Error downloading file: {str(e)}",
-                        "file_id": file_id,
-                        "error": str(e)
-                    })
-                except Exception as event_e:
-                    logger.error(f"Error sending file_download_error event: {str(event_e)}")
+            emit_event(event_queue, {
+                "type": "file_download_error",
+                "message": f"Error downloading file: {str(e)}",
+                "file_id": file_id,
+                "error": str(e)
+            })
             
             return {
                 "success": False,
                 "error": f"Error downloading file: {str(e)}"
             }
         
-        # Determine the action (view/read vs edit)
-        action = parameters.get("action", "view")
-        
         # Send event about the action being performed
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_action_determined",
-                    "message": f"File action determined: {action}",
-                    "file_id": file_id,
-                    "file_name": file_info.file_name,
-                    "action": action,
-                    "is_note": file_info.is_note
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_action_determined event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "file_action_determined",
+            "message": f"File action determined: {action}",
+            "file_id": file_id,
+            "file_name": file_info.file_name,
+            "action": action,
+            "is_note": file_info.is_note
+        })
         
         # For non-note files, only reading is allowed
         if not file_info.is_note and action not in ["view", "read"]:
             # Send event about invalid action
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_action_invalid",
-                        "message": "Only note files can be edited",
-                        "file_id": file_id,
-                        "file_name": file_info.file_name,
-                        "action": action,
-                        "is_note": file_info.is_note
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_action_invalid event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "file_action_invalid",
+                "message": "Only note files can be edited",
+                "file_id": file_id,
+                "file_name": file_info.file_name,
+                "action": action,
+                "is_note": file_info.is_note
+            })
             
             return {
                 "success": False,
                 "error": "Only note files can be edited"
             }
         
+        # LLM answers are only replayed for the same file content and requester, and never on an explicit retry
+        cache_scope = None if prep_res.get("regenerate") else _cache_scope(
+            file_info, file_content, prep_res.get("user_id"), prep_res.get("space_id")
+        )
+        
         # Handle the file based on the action and file type
         if action in ["view", "read"]:
-            result = await self._handle_file_view(file_info, file_content, query, event_queue)
+            result = await self._handle_file_view(file_info, file_content, query, event_queue, cache_scope)
             
             # Check if the view operation triggered an auto-edit for a note issue
             if file_info.is_note and "fix_result" in result:
                 # Send event that an automatic fix was applied
-                if event_queue is not None:
-                    try:
-                        await event_queue.put({
-                            "type": "automatic_note_fix_applied",
-                            "message": "Automatic fix was applied based on detected issue in note",
-                            "file_id": file_id,
-                            "file_name": file_info.file_name
-                        })
-                    except Exception as e:
-                        logger.error(f"Error sending automatic_note_fix_applied event: {str(e)}")
+                emit_event(event_queue, {
+                    "type": "automatic_note_fix_applied",
+                    "message": "Automatic fix was applied based on detected issue in note",
+                    "file_id": file_id,
+                    "file_name": file_info.file_name
+                })
                         
             return result
         elif file_info.is_note and action in ["edit", "append", "replace_snippet"]:
-            return await self._handle_file_edit(file_info, file_content, query, action, parameters)
+            return await self._handle_file_edit(file_info, file_content, query, action, parameters, event_queue, cache_scope=cache_scope)
         else:
             # Send event about unknown action
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_action_unknown",
-                        "message": f"Unknown file action: {action}",
-                        "file_id": file_id,
-                        "file_name": file_info.file_name,
-                        "action": action
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_action_unknown event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "file_action_unknown",
+                "message": f"Unknown file action: {action}",
+                "file_id": file_id,
+                "file_name": file_info.file_name,
+                "action": action
+            })
             
             return {
                 "success": False,
                 "error": f"Unknown action: {action}"
             }
     
-    async def _handle_file_view(self, file_info: SpaceFile, file_content: str, query: str, event_queue) -> Dict[str, Any]:
-        """Handle viewing/reading a file and generating a summary"""
+    async def _handle_file_view(self, file_info: SpaceFile, file_content: str, query: str, event_queue, cache_scope: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Handle viewing/reading a file and generating a summary; cache_scope is set when the summary may be cached"""
         
-        # Send event that file view operation is starting
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_view_start",
-                    "message": f"Starting to process file for viewing: {file_info.file_name}",
-                    "file_id": file_info.id,
-                    "file_name": file_info.file_name
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_view_start event: {str(e)}")
+        # Progress events up to the summary request are collected and sent as one batch
+        progress_events = [{
+            "type": "file_view_start",
+            "message": f"Starting to process file for viewing: {file_info.file_name}",
+            "file_id": file_info.id,
+            "file_name": file_info.file_name
+        }]
         
         # Truncate content if needed
-        max_chars = 35000
+        max_chars = _VIEW_MAX_CHARS
         truncated = False
         if len(file_content) > max_chars:
-            # Send event about truncation
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_content_truncated",
-                        "message": f"File content truncated due to size ({len(file_content)} chars)",
-                        "file_id": file_info.id,
-                        "file_name": file_info.file_name,
-                        "original_size": len(file_content),
-                        "truncated_size": max_chars
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_content_truncated event: {str(e)}")
+            # Event about truncation; only the start of the file was downloaded, so its
+            # size comes from the file metadata rather than the content
+            progress_events.append({
+                "type": "file_content_truncated",
+                "message": f"File content truncated due to size ({file_info.file_size} bytes)"
+                           if file_info.file_size else f"File content truncated to {max_chars} chars",
+                "file_id": file_info.id,
+                "file_name": file_info.file_name,
+                "original_size": file_info.file_size,
+                "truncated_size": max_chars
+            })
             
             file_content = file_content[:max_chars]
             truncated = True
         
         # Process content differently based on file type
         if file_info.is_note:
-            # For notes, add line numbers to the properly formatted JSON content
-            processed_content = self._add_line_numbers_to_note(file_content)
+            # For notes, number the JSON content one block per line, but only
+            # when the query may lead to referencing lines; otherwise they just cost tokens
+            numbered = _needs_line_refs(query)
+            processed_content = self._add_line_numbers_to_note(file_content) if numbered else file_content
             
-            # Send event about content processing
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_content_processed",
-                        "message": "Note file content processed with line numbers",
-                        "file_id": file_info.id,
-                        "file_name": file_info.file_name,
-                        "is_note": True
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_content_processed event: {str(e)}")
+            # Event about content processing
+            progress_events.append({
+                "type": "file_content_processed",
+                "message": "Note file content processed with line numbers" if numbered else "Note file content processed",
+                "file_id": file_info.id,
+                "file_name": file_info.file_name,
+                "is_note": True
+            })
         else:
             # For regular files, just use the content as is
+            numbered = False
             processed_content = file_content
             
-            # Send event about content processing
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_content_processed",
-                        "message": "Regular file content processed",
-                        "file_id": file_info.id,
-                        "file_name": file_info.file_name,
-                        "is_note": False
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_content_processed event: {str(e)}")
-        
-        # Send event that LLM summarization is starting
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "file_summary_start",
-                    "message": "Starting to generate file summary",
-                    "file_id": file_info.id,
-                    "file_name": file_info.file_name
-                })
-            except Exception as e:
-                logger.error(f"Error sending file_summary_start event: {str(e)}")
-        
-        # Modified prompt that now tells the LLM it can fix note files if needed
-        prompt = f"""
-        # USER QUERY
-        {query}
+            # Event about content processing
+            progress_events.append({
+                "type": "file_content_processed",
+                "message": "Regular file content processed",
+                "file_id": file_info.id,
+                "file_name": file_info.file_name,
+                "is_note": False
+            })
         
-        # FILE INFORMATION
-        File Name: {file_info.file_name}
-        File Type: {file_info.file_type}
-        Is Note: {'Yes' if file_info.is_note else 'No'}
-        
-        # FILE CONTENT
-        {processed_content}
-        {'(Content truncated due to length)' if truncated else ''}
-        
-        # TASK
-        Based on the user query, provide the most relevant information from this file.
-        Generate a detailed summary or extract the specific information requested.
-        You must include as much relevant information as possible from the file, and your thoughts.
-
-        IMPORTANT:
-        - If you detect any issues, typos, or needed improvements in the file AND the file is marked as "Is Note: Yes",
-          you can suggest fixing it with action=fix_note_issue
-        - These improvements can be to any aspect of the note - text content, formatting, tables, lists, code blocks, etc.
-        - If the file is NOT a note (Is Note: No), you cannot suggest edits, only provide a summary or get more context
+        # Event that LLM summarization is starting
+        progress_events.append({
+            "type": "file_summary_start",
+            "message": "Starting to generate file summary",
+            "file_id": file_info.id,
+            "file_name": file_info.file_name
+        })
         
-        Respond in YAML format:
-        ```yaml
-        thinking: |
-            <your step-by-step reasoning about what information is most relevant>
-        action: <one of: provide_summary, needs_more_context, fix_note_issue>
-        parameters:
-            summary: <detailed summary of the file content relevant to the query>
-            next_chunk_start: <if needs_more_context, position to continue from>
-            fix_description: <if action is fix_note_issue, describe what needs to be fixed>
-        ```
-        """
+        emit_event(event_queue, progress_events)
         
-        # Call LLM with the prompt using Claude 3.7 Sonnet
-        llm_response = await llm_service._call_llm(
-            prompt=prompt,
-            model_name="deepseek/deepseek-chat-v3-0324",
-            stream=False,
-            temperature=0.1
+        # Modified prompt that now tells the LLM it can fix note files if needed
+        prompt = _VIEW_PROMPT.substitute(
+            query=query,
+            file_name=file_info.file_name,
+            file_type=file_info.file_type,
+            is_note='Yes' if file_info.is_note else 'No',
+            processed_content=processed_content,
+            truncated_note='(Content truncated due to length)' if truncated else ''
         )
         
-        # Send event that LLM response was received
-        if event_queue is not None:
+        # Small views go to a faster model first, escalating only if its answer can't be used
+        model_name = _choose_view_model(query, len(processed_content))
+        response = None
+        if model_name != _FILE_VIEW_MODEL:
             try:
-                await event_queue.put({
-                    "type": "file_summary_received",
-                    "message": "Received file summary from language model",
-                    "file_id": file_info.id,
-                    "file_name": file_info.file_name
-                })
+                llm_response = await self._request_summary(prompt, model_name, cache_scope)
+                response = safe_load(self._extract_yaml_from_text(llm_response))
             except Exception as e:
-                logger.error(f"Error sending file_summary_received event: {str(e)}")
+                logger.warning(f"File view with {model_name} failed: {str(e)}")
+            if not isinstance(response, dict) or response.get("action") == "needs_more_context":
+                logger.info(f"Escalating file view from {model_name} to {_FILE_VIEW_MODEL}")
+                model_name = _FILE_VIEW_MODEL
+                response = None
+        if model_name == _FILE_VIEW_MODEL:
+            llm_response = await self._request_summary(prompt, model_name, cache_scope)
+        
+        # Send event that LLM response was received
+        emit_event(event_queue, {
+            "type": "file_summary_received",
+            "message": "Received file summary from language model",
+            "file_id": file_info.id,
+            "file_name": file_info.file_name
+        })
         
         # Parse the YAML response
         try:
-            yaml_content = self._extract_yaml_from_text(llm_response)
-            response = yaml.safe_load(yaml_content)
+            if response is None:
+                yaml_content = self._extract_yaml_from_text(llm_response)
+                response = safe_load(yaml_content)
             
             # Send event about parsed response
-            if event_queue is not None:
-                try:
-                    action = response.get("action", "provide_summary")
-                    await event_queue.put({
-                        "type": "file_summary_parsed",
-                        "message": f"Parsed file summary response: {action}",
-                        "file_id": file_info.id,
-                        "file_name": file_info.file_name,
-                        "action": action
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending file_summary_parsed event: {str(e)}")
+            action = response.get("action", "provide_summary")
+            emit_event(event_queue, {
+                "type": "file_summary_parsed",
+                "message": f"Parsed file summary response: {action}",
+                "file_id": file_info.id,
+                "file_name": file_info.file_name,
+                "action": action
+            })
             
             if response.get("action") == "needs_more_context":
                 # If more context is needed, provide the next chunk
                 next_chunk_start = response.get("parameters", {}).get("next_chunk_start", max_chars)
                 
                 # Send event about needing more context
-                if event_queue is not None:
-                    try:
-                        await event_queue.put({
-                            "type": "file_more_context_needed",
-                            "message": "More file context needed",
-                            "file_id": file_info.id,
-                            "file_name": file_info.file_name,
-                            "next_chunk_start": next_chunk_start
-                        })
-                    except Exception as e:
-                        logger.error(f"Error sending file_more_context_needed event: {str(e)}")
+                emit_event(event_queue, {
+                    "type": "file_more_context_needed",
+                    "message": "More file context needed",
+                    "file_id": file_info.id,
+                    "file_name": file_info.file_name,
+                    "next_chunk_start": next_chunk_start
+                })
                 
                 # This would need to be handled properly to get the next chunk
                 # For now, just return what we have with a note that more context was requested
@@ -502,23 +1553,18 @@ class FileInteraction(AsyncNode):
                 logger.info(f"Issue detected in note file. Attempting to fix: {fix_description}")
                 
                 # Send event about detected issue
-                if event_queue is not None:
-                    try:
-                        await event_queue.put({
-                            "type": "file_issue_detected",
-                            "message": "Issue detected in note file, attempting to fix",
-                            "file_id": file_info.id,
-                            "file_name": file_info.file_name,
-                            "fix_description": fix_description
-                        })
-                    except Exception as e:
-                        logger.error(f"Error sending file_issue_detected event: {str(e)}")
+                emit_event(event_queue, {
+                    "type": "file_issue_detected",
+                    "message": "Issue detected in note file, attempting to fix",
+                    "file_id": file_info.id,
+                    "file_name": file_info.file_name,
+                    "fix_description": fix_description
+                })
                 
                 # Call the edit function to fix the issue
                 # Create parameters needed for edit operation
                 edit_parameters = {
-                    "action": "edit",
-                    "_shared": {"event_queue": event_queue, "query": f"Fix issue: {fix_description}"}
+                    "action": "edit"
                 }
                 
                 edit_result = await self._handle_file_edit(
@@ -526,7 +1572,10 @@ class FileInteraction(AsyncNode):
                     file_content=file_content, 
                     query=f"Fix the following issue in this note: {fix_description}",
                     action="edit",
-                    parameters=edit_parameters
+                    parameters=edit_parameters,
+                    event_queue=event_queue,
+                    numbered_content=processed_content if numbered else None,
+                    cache_scope=cache_scope
                 )
                 
                 # Return with both the summary and edit results
@@ -542,17 +1591,13 @@ class FileInteraction(AsyncNode):
                 summary = response.get("parameters", {}).get("summary", "No summary provided")
                 
                 # Send event about completed summary
-                if event_queue is not None:
-                    try:
-                        await event_queue.put({
-                            "type": "file_summary_complete",
-                            "message": "File summary completed successfully",
-                            "file_id": file_info.id,
-                            "file_name": file_info.file_name,
-                            "summary_length": len(summary)
-                        })
-                    except Exception as e:
-                        logger.error(f"Error sending file_summary_complete event: {str(e)}")
+                emit_event(event_queue, {
+                    "type": "file_summary_complete",
+                    "message": "File summary completed successfully",
+                    "file_id": file_info.id,
+                    "file_name": file_info.file_name,
+                    "summary_length": len(summary)
+                })
                 
                 return {
                     "success": True,
@@ -564,133 +1609,147 @@ class FileInteraction(AsyncNode):
             logger.error(f"Error parsing LLM response: {str(e)}")
             
             # Send event about parsing error
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "file_summary_error",
-                        "message": f"Error parsing file summary: {str(e)}",
-                        "file_id": file_info.id,
-                        "file_name": file_info.file_name,
-                        "error": str(e)
-                    })
-                except Exception as event_e:
-                    logger.error(f"Error sending file_summary_error event: {str(event_e)}")
+            emit_event(event_queue, {
+                "type": "file_summary_error",
+                "message": f"Error parsing file summary: {str(e)}",
+                "file_id": file_info.id,
+                "file_name": file_info.file_name,
+                "error": str(e)
+            })
             
             return {
                 "success": False,
                 "error": f"Error generating file summary: {str(e)}"
             }
     
-    async def _handle_file_edit(self, file_info: SpaceFile, file_content: str, query: str, action: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """Handle editing a note file"""
+    async def _request_summary(self, prompt: str, model_name: str, cache_scope: Optional[Dict[str, Any]] = None) -> str:
+        """Ask the LLM for a file view summary; an identical prompt about the same cache_scope can be replayed"""
+        request_summary = lambda: self._stream_summary(prompt, model_name)
+        if settings.RESPONSE_CACHE_ENABLED and cache_scope is not None:
+            # Concurrent views with the same prompt wait for the first call instead of making their own;
+            # errors are raised rather than returned, so anything computed can be cached
+            cache_key = response_cache.make_key(kind="file_view", scope=cache_scope, prompt=prompt, m=model_name, t=0.1)
+            return await response_cache.get_or_compute(cache_key, request_summary)
+        return await request_summary()
+    
+    async def _stream_summary(self, prompt: str, model_name: str) -> str:
+        """Stream a file view summary from the LLM, returning as soon as its YAML block is complete"""
+        stream = await llm_service._call_llm(
+            prompt=prompt,
+            model_name=model_name,
+            stream=True,
+            temperature=0.1
+        )
+        parts = []
+        text = ""
+        # Offset just past the opening ```yaml fence, once it has arrived
+        body_start = -1
+        try:
+            async for chunk in stream:
+                parts.append(chunk)
+                text += chunk
+                # Only the new chunk, plus room for a fence split across chunks, is scanned each time
+                scan_from = max(len(text) - len(chunk) - 6, 0)
+                if body_start < 0:
+                    fence = text.find("```yaml", scan_from)
+                    if fence < 0:
+                        continue
+                    body_start = fence + 7
+                # Text after the closing fence is never parsed, so don't wait for the model to finish it
+                if text.find("```", max(body_start, scan_from)) >= 0:
+                    break
+        finally:
+            await stream.aclose()
+        
+        # The stream reports failures as a final text chunk, or yields nothing on an API error;
+        # raise them so they aren't cached as a summary
+        if not parts:
+            raise RuntimeError(f"Empty response from {model_name}")
+        if parts[-1].startswith(("\nError: ", "Error from LLM API: ")):
+            raise RuntimeError(parts[-1].strip())
+        return text
+    
+    async def _handle_file_edit(self, file_info: SpaceFile, file_content: Union[str, bytes], query: str, action: str, parameters: Dict[str, Any], event_queue: Optional[asyncio.Queue] = None, numbered_content: Optional[str] = None, cache_scope: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Handle editing a note file; numbered_content is the note with line numbers, if the caller already has it,
+        and cache_scope is set when the LLM's answer may be cached
+        """
         
-        # For notes, we need to validate that the content is proper JSON
+        # For notes, we need to validate that the content is proper JSON (parsed straight from bytes when downloaded)
         try:
-            note_data = json.loads(file_content)
-        except json.JSONDecodeError:
+            note_data = orjson.loads(file_content)
+        except orjson.JSONDecodeError:
             return {
                 "success": False,
                 "error": "Invalid note format: not valid JSON"
             }
         
         # Send event that file edit is starting
-        shared = parameters.get("_shared", {})
-        if shared and "event_queue" in shared and shared["event_queue"] is not None:
-            event = {
-                "type": "file_edit_start",
-                "file_id": file_info.id
-            }
-            await shared["event_queue"].put(event)
+        emit_event(event_queue, {
+            "type": "file_edit_start",
+            "file_id": file_info.id
+        })
         
-        # Add line numbers to formatted JSON content for reference
-        processed_content = self._add_line_numbers_to_note(file_content)
+        # Number the note's blocks for reference, unless the view path already did
+        if numbered_content is not None:
+            processed_content = numbered_content
+        else:
+            processed_content = self._add_line_numbers_to_note(file_content, note_data)
+            # A snippet replacement in a long note only needs the blocks around its target
+            if action == "replace_snippet":
+                processed_content = _windowed_context(note_data, processed_content, query) or processed_content
         logger.info(f"Processed content: {processed_content}")
         
-        note_example = """Note files are always structured like this (this example specifically shows all of the valid options for note content): [{"id":"a5912cac-94e6-4e58-a676-65f30de19843","type":"heading","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","level":1},"content":[{"type":"text","text":"Heading","styles":{}}],"children":[]},{"id":"1359bca2-b113-4c62-a7c2-a6b9dfe55ee7","type":"heading","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","level":2},"content":[{"type":"text","text":"Heading","styles":{}}],"children":[]},{"id":"27ce7c91-8de6-4e04-9604-00fcff492bf3","type":"heading","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","level":3},"content":[{"type":"text","text":"Heading","styles":{}}],"children":[]},{"id":"94202c43-e32f-4011-a5fe-81746edfcdde","type":"numberedListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"numbered","styles":{}}],"children":[]},{"id":"2b68268c-b89b-4656-9430-32cec85af15b","type":"numberedListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"list","styles":{}}],"children":[]},{"id":"950076f6-cac6-4f39-ae96-63bba0934870","type":"bulletListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"bullet","styles":{}}],"children":[]},{"id":"409b84f3-0ac3-4fef-b30a-0216b15461c7","type":"bulletListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"list","styles":{}}],"children":[]},{"id":"fafb20b9-be57-4f1c-9034-0f81e538c2ca","type":"checkListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","checked":false},"content":[{"type":"text","text":"check","styles":{}}],"children":[]},{"id":"1e5d6848-1b14-4f0e-b343-54c35cb3a141","type":"checkListItem","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left","checked":true},"content":[{"type":"text","text":"list","styles":{}}],"children":[]},{"id":"c5a16743-171d-4f0a-acd8-4aa5b7133c63","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"Paragraph","styles":{}}],"children":[]},{"id":"ab147517-625b-4067-a078-42ea96ef2115","type":"codeBlock","props":{"language":"python"},"content":[{"type":"text","text":"code","styles":{}}],"children":[]},{"id":"32c4879e-1f0f-4d17-b5cb-5ad8cd69457f","type":"table","props":{"textColor":"default"},"content":{"type":"tableContent","columnWidths":[null,null,null],"rows":[{"cells":[[{"type":"text","text":"t","styles":{}}],[{"type":"text","text":"a","styles":{}}],[{"type":"text","text":"b","styles":{}}]]},{"cells":[[{"type":"text","text":"l","styles":{}}],[{"type":"text","text":"e","styles":{}}],[]]}]},"children":[]},{"id":"a6c4eb71-a9e3-4297-8d57-289e52d75d8e","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"inline text: ","styles":{}},{"type":"text","text":"text, ","styles":{"bold":true}},{"type":"text","text":"text, ","styles":{"italic":true}},{"type":"text","text":"text,","styles":{"underline":true}},{"type":"text","text":" ","styles":{}},{"type":"text","text":"text,","styles":{"strike":true}},{"type":"text","text":" text","styles":{"textColor":"red"}}],"children":[]},{"id":"97ba2bbe-4bd3-44a2-9caf-b376250ed559","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"center"},"content":[{"type":"text","text":"centered","styles":{}}],"children":[]},{"id":"13950c09-860b-4ee0-9bee-b630ea53720f","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"right"},"content":[{"type":"text","text":"right","styles":{}}],"children":[]},{"id":"06c1bc43-af2b-4536-8250-5fef9e53f34b","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"link","href":"https://interactive-examples.mdn.mozilla.net/media/cc0-audio/t-rex-roar.mp3","content":[{"type":"text","text":"link","styles":{"underline":true,"textColor":"blue"}}]}],"children":[]},{"id":"bdb645f1-8e05-49e0-8307-f258f6d0b21b","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"background","styles":{"backgroundColor":"purple"}}],"children":[{"id":"bc21d51b-a0a5-4209-8427-205c7569bd0b","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"nested block","styles":{}}],"children":[]}]},{"id":"756bc02f-0bcb-4219-8c2b-361c4a85cfd8","type":"image","props":{"backgroundColor":"default","textAlignment":"center","name":"grapefruit-slice","url":"https://interactive-examples.mdn.mozilla.net/media/cc0-images/grapefruit-slice-332-332.jpg","caption":"https://interactive-examples.mdn.mozilla.net/media/cc0-images/grapefruit-slice-332-332.jpg","showPreview":true,"previewWidth":512},"children":[]},{"id":"68525ebb-7648-4945-96b3-9e40e8508445","type":"video","props":{"backgroundColor":"default","textAlignment":"right","name":"flower.webm","url":"https://interactive-examples.mdn.mozilla.net/media/cc0-videos/flower.webm","caption":"video","showPreview":true,"previewWidth":512},"children":[]},{"id":"db560f2e-c1b7-4f74-b913-ce6864c4c746","type":"audio","props":{"backgroundColor":"default","name":"t-rex-roar.mp3","url":"https://interactive-examples.mdn.mozilla.net/media/cc0-audio/t-rex-roar.mp3","caption":"","showPreview":true},"children":[]},{"id":"b6051d7a-83a7-445e-95d6-baee60ffb211","type":"file","props":{"backgroundColor":"default","name":"Aidan_Andrews_Resume.pdf","url":"https://aidanandrews22.github.io/content/pdf/Aidan_Andrews_Resume.pdf","caption":"file"},"children":[]},{"id":"5bac388c-c5a0-4017-b754-1817a776f48c","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[{"type":"text","text":"emoji: 😀 ","styles":{}}],"children":[]},{"id":"b32c0b17-36f3-4ac7-99d6-b690b1232817","type":"paragraph","props":{"textColor":"default","backgroundColor":"default","textAlignment":"left"},"content":[],"children":[]}]"""
-        
         # Check if this is a fix operation
-        is_fix_operation = query.startswith("Fix") or "fix" in query.lower() or "issue" in query.lower()
+        is_fix_operation = query.startswith("Fix") or bool(_FIX_QUERY_RE.search(query))
         
         # Check if this is a continuation operation
-        is_continuation = any(word in query.lower() for word in ["continue", "finish", "more", "add", "write more", "keep going"])
+        is_continuation = bool(_CONTINUATION_QUERY_RE.search(query))
         
-        # Different prompt for notes to ensure structural correctness
-        prompt = f"""
+        # Different prompt for notes to ensure structural correctness; the instructions are static
+        # and sent first, so only this query-dependent part changes between calls. The query and
+        # note open both the edit prompt and its retry, and the guidance is prebuilt per edit kind
+        prompt_prefix = f"""
         # USER QUERY
         {query}
         
         # NOTE CONTENT (WITH LINE NUMBERS)
         {processed_content}
-        
-        # TASK
-        You are editing a structured note file. The file format is a specialized JSON structure 
-        that must be preserved. Each block has an 'id', 'type', 'props', 'content', and 'children' fields.
-        Here is an example of the note content:
-        {note_example}
-        
-        Additionally, you may assume you can use any primary color for the text, or background color.
-        Your response needs to perfectly match this format.
-        
-        IMPORTANT: The content you're seeing is a properly formatted version of the JSON with line numbers.
-        When specifying line numbers for edits, use these formatted line numbers.
-        
-        {"Based on issue detection, you need to fix the identified problem in this note. " if is_fix_operation else ""}
-        {"Based on the user requesting to continue or add more to the note, analyze the existing content and add appropriate extensions. " if is_continuation else ""}
-        {"Based on the user's query, determine how to modify this note. " if not is_fix_operation and not is_continuation else ""}
-        
-        Respond in YAML format:
-        ```yaml
-        thinking: |
-            <your step-by-step reasoning>
-        action: <one of: append, replace_snippet, needs_more_context>
-        parameters:
-            modified_content: |
-                <if append: the new content to add at the end>
-                <if replace_snippet: use the format below>
-            reason: <explanation of changes made>
-        ```
-        
-        For replace_snippet, use this exact format:
-        <<<<<<< ORIGINAL // Line X
-        (original content to replace)
-        =======
-        (new content)
-        >>>>>>> UPDATED // Line Y
-        
-        IMPORTANT: 
-        1. When replacing content, include the ENTIRE JSON object/array you want to replace, not just parts of it.
-        2. Ensure all JSON structure is preserved. All IDs must be kept the same unless specifically changed.
-        3. The line numbers must correspond to the formatted JSON with line numbers shown above.
-        4. Make sure the replacement content is valid JSON that can be parsed.
-        5. {"Since this is a fix operation, focus on correcting the specific issue described." if is_fix_operation else ""}
-        5. {"Since this is a continuation request, focus on extending the existing content in a natural way." if is_continuation else ""}
-        5. {"Make only the changes necessary to fulfill the user's request." if not is_fix_operation and not is_continuation else ""}
         """
+        prompt = prompt_prefix + _EDIT_GUIDANCE[is_fix_operation, is_continuation]
         
-        # Call LLM with the prompt using a reliable model
-        llm_response = await llm_service._call_llm(
+        # Call LLM with the prompt using a reliable model; repeating the same edit on an unchanged
+        # note can replay the earlier answer
+        request_edit = lambda: llm_service._call_llm(
             prompt=prompt,
+            system_prompt=_EDIT_SYSTEM_PROMPT,
             model_name="deepseek/deepseek-chat-v3-0324",
             stream=False,
-            temperature=0.1
+            temperature=0.1,
+            response_format=_JSON_RESPONSE_FORMAT
         )
+        if settings.RESPONSE_CACHE_ENABLED and cache_scope is not None:
+            cache_key = response_cache.make_key(kind="file_edit", scope=cache_scope, prompt=prompt, m="deepseek/deepseek-chat-v3-0324", t=0.1)
+            # Answers without an action can't be applied, so they aren't worth replaying
+            llm_response = await response_cache.get_or_compute(
+                cache_key, request_edit, should_cache=lambda text: '"action"' in text
+            )
+        else:
+            llm_response = await request_edit()
         logger.info(f"LLM response: {llm_response}")
         
-        # Parse the YAML response
+        # Parse the JSON response
         try:
-            yaml_content = self._extract_yaml_from_text(llm_response)
-            response = yaml.safe_load(yaml_content)
+            response = self._parse_json_response(llm_response)
             
             llm_action = response.get("action")
             
             if llm_action == "needs_more_context":
                 # Send event that file edit is complete (even though it failed)
-                if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                    event = {
-                        "type": "file_edit_complete",
-                        "file_id": file_info.id
-                    }
-                    await shared["event_queue"].put(event)
+                emit_event(event_queue, {
+                    "type": "file_edit_complete",
+                    "file_id": file_info.id
+                })
                 
                 return {
                     "success": False,
@@ -704,140 +1763,48 @@ class FileInteraction(AsyncNode):
             # Apply the changes based on the action
             updated_content = None
             if llm_action == "append":
-                # Append content to the end of the file
+                # Append content to the end of the file; JSON mode returns the blocks already parsed,
+                # so a malformed nested string, which used to need a second LLM call, can't occur
                 try:
-                    new_content = json.loads(modified_content)
-                    note_data.extend(new_content)
-                    updated_content = json.dumps(note_data)
-                except json.JSONDecodeError as json_error:
-                    # Try to recover from JSON decode error by retrying with more specific instructions
-                    logger.warning(f"JSON decode error in appended content: {str(json_error)}")
-                    
-                    # Send event about retrying
-                    if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                        try:
-                            await shared["event_queue"].put({
-                                "type": "file_edit_retry",
-                                "message": "Retrying edit with corrected format instructions",
-                                "file_id": file_info.id,
-                                "error": str(json_error)
-                            })
-                        except Exception as e:
-                            logger.error(f"Error sending file_edit_retry event: {str(e)}")
-                    
-                    # Create a retry prompt that includes the error and the original response
-                    retry_prompt = f"""
-                    # USER QUERY
-                    {query}
-                    
-                    # NOTE CONTENT (WITH LINE NUMBERS)
-                    {processed_content}
-                    
-                    # FORMATTING ERROR
-                    Your previous response contained a JSON formatting error:
-                    {str(json_error)}
-                    
-                    # YOUR PREVIOUS RESPONSE
-                    {llm_response}
-                    
-                    # TASK
-                    Correct your previous response to fix the JSON formatting error. Make sure your output 
-                    conforms exactly to the required format for a note file. Each block must be valid JSON.
-                    
-                    The format error is typically related to improperly formatted JSON in the 'modified_content' field.
-                    Make sure that all quotes, braces, and brackets are properly balanced and escaped.
-                    
-                    For 'append' action, the modified_content must be a valid JSON array of note blocks that can be parsed.
-                    
-                    Respond in the same YAML format, but with corrected JSON content:
-                    ```yaml
-                    thinking: |
-                        <your reasoning about the error and how you're fixing it>
-                    action: <one of: append, replace_snippet, needs_more_context>
-                    parameters:
-                        modified_content: |
-                            <if append: the new content to add at the end in valid JSON format>
-                            <if replace_snippet: use the format below with valid JSON content>
-                        reason: <explanation of changes made>
-                    ```
-                    """
+                    note_data.extend(_appended_blocks(modified_content))
+                    updated_content = orjson.dumps(note_data)
+                except (ValueError, TypeError) as json_error:
+                    logger.error(f"Invalid appended content: {str(json_error)}")
                     
-                    # Call LLM with the retry prompt
-                    retry_response = await llm_service._call_llm(
-                        prompt=retry_prompt,
-                        model_name="deepseek/deepseek-chat-v3-0324",
-                        stream=False,
-                        temperature=0.1
-                    )
+                    # Send event that file edit is complete (even though it failed)
+                    emit_event(event_queue, {
+                        "type": "file_edit_complete",
+                        "file_id": file_info.id
+                    })
                     
-                    # Try to parse the retry response
-                    try:
-                        retry_yaml_content = self._extract_yaml_from_text(retry_response)
-                        retry_response_obj = yaml.safe_load(retry_yaml_content)
-                        
-                        # Get the corrected content
-                        retry_action = retry_response_obj.get("action")
-                        retry_modified_content = retry_response_obj.get("parameters", {}).get("modified_content", "")
-                        retry_reason = retry_response_obj.get("parameters", {}).get("reason", "No explanation provided")
-                        
-                        # Try to parse and apply the corrected content
-                        retry_new_content = json.loads(retry_modified_content)
-                        note_data.extend(retry_new_content)
-                        updated_content = json.dumps(note_data)
-                        
-                        # Update the action and reason with the retry values
-                        llm_action = retry_action
-                        reason = retry_reason
-                        
-                        # Log successful retry
-                        logger.info("Successfully recovered from JSON formatting error with retry")
-                        
-                    except (yaml.YAMLError, json.JSONDecodeError) as retry_error:
-                        # If the retry also fails, return the original error
-                        logger.error(f"Retry also failed: {str(retry_error)}")
-                        
-                        # Send event that file edit is complete (even though it failed)
-                        if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                            event = {
-                                "type": "file_edit_complete",
-                                "file_id": file_info.id
-                            }
-                            await shared["event_queue"].put(event)
-                        
-                        return {
-                            "success": False,
-                            "error": f"Invalid JSON format in appended content: {str(json_error)}"
-                        }
+                    return {
+                        "success": False,
+                        "error": f"Invalid JSON format in appended content: {str(json_error)}"
+                    }
                     
             elif llm_action == "replace_snippet":
                 # Parse the snippet replacement format
-                updated_content = self._apply_snippet_replacement(file_content, modified_content)
+                updated_content = await self._replace_snippet(file_content, modified_content)
                 if not updated_content:
                     # Try to recover from snippet replacement error by retrying
                     logger.warning("Failed to apply snippet replacement, attempting retry")
                     
                     # Send event about retrying
-                    if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                        try:
-                            await shared["event_queue"].put({
-                                "type": "file_edit_retry",
-                                "message": "Retrying snippet replacement with corrected format instructions",
-                                "file_id": file_info.id
-                            })
-                        except Exception as e:
-                            logger.error(f"Error sending file_edit_retry event: {str(e)}")
-                    
-                    # Create a retry prompt for snippet replacement
-                    retry_prompt = f"""
-                    # USER QUERY
-                    {query}
-                    
-                    # NOTE CONTENT (WITH LINE NUMBERS)
-                    {processed_content}
+                    emit_event(event_queue, {
+                        "type": "file_edit_retry",
+                        "message": "Retrying snippet replacement with corrected format instructions",
+                        "file_id": file_info.id
+                    })
                     
+                    # Create a retry prompt for snippet replacement, continuing from the same query and note
+                    retry_prompt = prompt_prefix + f"""
                     # FORMATTING ERROR
                     Your previous response contained an error in the snippet replacement format.
                     
+                    # EXAMPLE NOTE
+                    This example shows all of the valid options for note content:
+                    {_NOTE_EXAMPLE}
+                    
                     # YOUR PREVIOUS RESPONSE
                     {llm_response}
                     
@@ -855,34 +1822,30 @@ class FileInteraction(AsyncNode):
                     2. Ensure both original and replacement content are valid JSON.
                     3. Include complete JSON objects, not partial ones.
                     
-                    Respond in the same YAML format, but with corrected snippet replacement:
-                    ```yaml
-                    thinking: |
-                        <your reasoning about the error and how you're fixing it>
-                    action: replace_snippet
-                    parameters:
-                        modified_content: |
-                            <<<<<<< ORIGINAL // Line X
-                            (correct original content)
-                            =======
-                            (correct new content)
-                            >>>>>>> UPDATED // Line Y
-                        reason: <explanation of changes made>
-                    ```
+                    Respond with the same JSON object format, but with a corrected snippet replacement:
+                    {{
+                        "thinking": "<your reasoning about the error and how you're fixing it>",
+                        "action": "replace_snippet",
+                        "parameters": {{
+                            "modified_content": "<<<<<<< ORIGINAL // Line X\\n(correct original content)\\n=======\\n(correct new content)\\n>>>>>>> UPDATED // Line Y",
+                            "reason": "<explanation of changes made>"
+                        }}
+                    }}
                     """
                     
                     # Call LLM with the retry prompt
                     retry_response = await llm_service._call_llm(
                         prompt=retry_prompt,
+                        system_prompt=_EDIT_SYSTEM_PROMPT,
                         model_name="deepseek/deepseek-chat-v3-0324",
                         stream=False,
-                        temperature=0.1
+                        temperature=0.1,
+                        response_format=_JSON_RESPONSE_FORMAT
                     )
                     
                     # Try to parse the retry response
                     try:
-                        retry_yaml_content = self._extract_yaml_from_text(retry_response)
-                        retry_response_obj = yaml.safe_load(retry_yaml_content)
+                        retry_response_obj = self._parse_json_response(retry_response)
                         
                         # Get the corrected content
                         retry_action = retry_response_obj.get("action")
@@ -890,7 +1853,7 @@ class FileInteraction(AsyncNode):
                         retry_reason = retry_response_obj.get("parameters", {}).get("reason", "No explanation provided")
                         
                         # Try to apply the corrected snippet replacement
-                        updated_content = self._apply_snippet_replacement(file_content, retry_modified_content)
+                        updated_content = await self._replace_snippet(file_content, retry_modified_content)
                         if updated_content:
                             # Update the reason with the retry value
                             reason = retry_reason
@@ -902,51 +1865,30 @@ class FileInteraction(AsyncNode):
                             logger.error("Retry failed to apply snippet replacement")
                             
                             # Send event that file edit is complete (even though it failed)
-                            if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                                event = {
-                                    "type": "file_edit_complete",
-                                    "file_id": file_info.id
-                                }
-                                await shared["event_queue"].put(event)
+                            emit_event(event_queue, {
+                                "type": "file_edit_complete",
+                                "file_id": file_info.id
+                            })
                             
                             return {
                                 "success": False,
                                 "error": "Failed to apply snippet replacement after retry"
                             }
                             
-                    except yaml.YAMLError as retry_error:
+                    except ValueError as retry_error:
                         # If the retry also fails, return the original error
                         logger.error(f"Retry also failed: {str(retry_error)}")
                         
                         # Send event that file edit is complete (even though it failed)
-                        if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                            event = {
-                                "type": "file_edit_complete",
-                                "file_id": file_info.id
-                            }
-                            await shared["event_queue"].put(event)
+                        emit_event(event_queue, {
+                            "type": "file_edit_complete",
+                            "file_id": file_info.id
+                        })
                         
                         return {
                             "success": False,
                             "error": "Failed to apply snippet replacement"
                         }
-                
-                # Verify the updated content is valid JSON
-                try:
-                    json.loads(updated_content)
-                except json.JSONDecodeError:
-                    # Send event that file edit is complete (even though it failed)
-                    if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                        event = {
-                            "type": "file_edit_complete",
-                            "file_id": file_info.id
-                        }
-                        await shared["event_queue"].put(event)
-                    
-                    return {
-                        "success": False,
-                        "error": "Replacement resulted in invalid JSON"
-                    }
             
             # Save the updated file
             if updated_content:
@@ -954,16 +1896,14 @@ class FileInteraction(AsyncNode):
                 # This ensures we don't overwrite the original file and store edits in a separate location
                 virtual_path = f"virtual/{file_info.file_path}"
                 logger.info(f"Uploading edited file to virtual path: {virtual_path}")
-                upload_success = await upload_file("Vox", virtual_path, updated_content)
+                upload_success = await upload_note_snapshot("Vox", virtual_path, updated_content)
                 
                 if not upload_success:
                     # Send event that file edit is complete (even though it failed)
-                    if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                        event = {
-                            "type": "file_edit_complete",
-                            "file_id": file_info.id
-                        }
-                        await shared["event_queue"].put(event)
+                    emit_event(event_queue, {
+                        "type": "file_edit_complete",
+                        "file_id": file_info.id
+                    })
                     
                     return {
                         "success": False,
@@ -971,12 +1911,10 @@ class FileInteraction(AsyncNode):
                     }
                 
                 # Send event that file edit is complete
-                if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                    event = {
-                        "type": "file_edit_complete",
-                        "file_id": file_info.id
-                    }
-                    await shared["event_queue"].put(event)
+                emit_event(event_queue, {
+                    "type": "file_edit_complete",
+                    "file_id": file_info.id
+                })
                 
                 return {
                     "success": True,
@@ -985,12 +1923,10 @@ class FileInteraction(AsyncNode):
                 }
             else:
                 # Send event that file edit is complete (with no changes)
-                if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                    event = {
-                        "type": "file_edit_complete",
-                        "file_id": file_info.id
-                    }
-                    await shared["event_queue"].put(event)
+                emit_event(event_queue, {
+                    "type": "file_edit_complete",
+                    "file_id": file_info.id
+                })
                 
                 return {
                     "success": False,
@@ -1000,159 +1936,197 @@ class FileInteraction(AsyncNode):
         except Exception as e:
             logger.error(f"Error handling file edit: {str(e)}")
             # Send event that file edit is complete (even though it failed)
-            if shared and "event_queue" in shared and shared["event_queue"] is not None:
-                event = {
-                    "type": "file_edit_complete",
-                    "file_id": file_info.id
-                }
-                await shared["event_queue"].put(event)
+            emit_event(event_queue, {
+                "type": "file_edit_complete",
+                "file_id": file_info.id
+            })
             
             return {
                 "success": False,
                 "error": f"Error editing file: {str(e)}"
             }
     
-    def _add_line_numbers_to_note(self, note_content: str) -> str:
-        """Add line numbers to the note content for reference"""
+    def _add_line_numbers_to_note(self, note_content: Union[str, bytes], note_data: Any = None) -> str:
+        """Add line numbers to the note content for reference; note_data is the already parsed content, if any"""
+        if not settings.FILE_CACHE_ENABLED:
+            return self._number_note(note_content, note_data)
+        
+        # The same note is numbered again on back-to-back views and edits, so reuse the result by content digest
+        raw = note_content.encode('utf-8') if isinstance(note_content, str) else note_content
+        key = hashlib.blake2b(raw, digest_size=16).digest()
+        numbered = numbered_note_cache.get(key)
+        if numbered is None:
+            numbered = self._number_note(note_content, note_data)
+            numbered_note_cache.set(key, numbered)
+        return numbered
+    
+    def _number_note(self, note_content: Union[str, bytes], note_data: Any = None) -> str:
+        """Number the note one block per line, bypassing the cache"""
         try:
-            # Parse the JSON content
-            json_data = json.loads(note_content)
-            # Format the JSON with proper indentation
-            formatted_content = json.dumps(json_data, indent=4)
-            # Add line numbers to each line
-            lines = formatted_content.split('\n')
-            return '\n'.join([f"{i+1}: {line}" for i, line in enumerate(lines)])
-        except json.JSONDecodeError:
+            # Parse the JSON content, unless the caller already has
+            json_data = orjson.loads(note_content) if note_data is None else note_data
+            # _apply_snippet_replacement splits the note into the same lines, so line numbers match
+            return _number_lines('\n'.join(_note_lines(json_data)))
+        except orjson.JSONDecodeError:
             # If JSON parsing fails, fall back to the original method
-            lines = note_content.split('\n')
-            return '\n'.join([f"{i+1}: {line}" for i, line in enumerate(lines)])
+            if isinstance(note_content, bytes):
+                note_content = note_content.decode('utf-8', errors='replace')
+            return _number_lines(note_content)
+    
+    def _parse_json_response(self, text: str) -> Dict[str, Any]:
+        """Parse a JSON mode LLM response, tolerating text around the object if the provider ignored JSON mode"""
+        try:
+            return _loads_lenient(text)
+        except orjson.JSONDecodeError:
+            return _loads_lenient(llm_service._extract_json_from_text(text))
     
     def _extract_yaml_from_text(self, text: str) -> str:
         """Extract YAML content from the LLM response"""
         # Find YAML block denoted by ```yaml and ``` markers
-        yaml_start = text.find("```yaml")
-        if yaml_start != -1:
-            # Move past the ```yaml marker
-            yaml_start += 7
-            yaml_end = text.find("```", yaml_start)
-            if yaml_end != -1:
-                return text[yaml_start:yaml_end].strip()
-        
-        # If no markers, try to find what looks like YAML content
-        # Look for "action:" as a key indicator
-        action_idx = text.find("action:")
-        if action_idx != -1:
-            # Find the start of the YAML-like content
-            yaml_start = text.rfind("\n", 0, action_idx)
-            if yaml_start == -1:
-                yaml_start = 0
-            else:
-                yaml_start += 1  # Skip the newline
-                
-            return text[yaml_start:].strip()
+        match = _YAML_FENCE_RE.search(text)
+        if match:
+            return match.group(1).strip()
+        
+        # If no markers, try to find what looks like YAML content,
+        # starting at the line with the first "action:" key
+        match = _YAML_ACTION_LINE_RE.search(text)
+        if match:
+            return text[match.start():].strip()
             
         # If we can't extract YAML, return the original text
         return text
     
-    def _apply_snippet_replacement(self, original_content: str, replacement_spec: str) -> Optional[str]:
-        """Apply a snippet replacement to the original content"""
+    async def _replace_snippet(self, original_content: Union[str, bytes], replacement_spec: Any) -> Optional[str]:
+        """Apply a snippet replacement or JSON Patch, parsing and serializing large notes in a worker thread"""
+        if len(original_content) < _REPLACE_IN_THREAD_MIN_BYTES:
+            return self._apply_snippet_replacement(original_content, replacement_spec)
+        return await asyncio.to_thread(self._apply_snippet_replacement, original_content, replacement_spec)
+    
+    def _apply_snippet_replacement(self, original_content: Union[str, bytes], replacement_spec: Any) -> Optional[str]:
+        """
+        Apply a snippet replacement to the original content.
+        
+        The replacement is either a JSON Patch, applied straight to the parsed note, or a
+        line-based specification in the ORIGINAL/UPDATED marker format.
+        
+        Returns the updated note as JSON, or None if the replacement can't be applied.
+        Every result is serialized from parsed JSON, or is the unchanged original, so it
+        never needs validating again.
+        """
         try:
-            # Parse the original content as JSON
-            original_json = json.loads(original_content)
-            
-            # Parse the replacement specification
-            original_marker = "<<<<<<< ORIGINAL //"
-            separator = "======="
-            updated_marker = ">>>>>>> UPDATED //"
+            # JSON mode returns a patch already parsed, but it may also arrive as a string
+            if isinstance(replacement_spec, str) and replacement_spec.lstrip().startswith('['):
+                parsed, patch = _try_loads(replacement_spec)
+                if parsed:
+                    replacement_spec = patch
+            if isinstance(replacement_spec, (list, dict)):
+                original_json = orjson.loads(original_content)
+                patched = _apply_json_patch(original_json, replacement_spec if isinstance(replacement_spec, list) else [replacement_spec])
+                return orjson.dumps(patched).decode()
+            if not isinstance(replacement_spec, str):
+                # Neither a patch nor marker text, e.g. null or a number
+                return None
             
-            if original_marker not in replacement_spec or separator not in replacement_spec or updated_marker not in replacement_spec:
+            # Parse the replacement specification, extracting the line numbers and content in one scan
+            match = _SNIPPET_RE.search(replacement_spec)
+            if not match:
                 logger.error("Invalid replacement specification format")
                 return None
             
-            # Extract the line numbers and content
-            parts = replacement_spec.split(original_marker)[1]
-            original_line_info, rest = parts.split("\n", 1)
-            original_line = int(original_line_info.strip().split("Line")[1].strip())
+            original_line = int(match.group(1))
+            original_content_to_replace = match.group(2).strip()
+            new_content = match.group(3).strip()
+            updated_line = int(match.group(4))
             
-            parts = rest.split(separator)
-            original_content_to_replace = parts[0].strip()
+            # A replacement that doesn't change anything leaves the note as it was, unparsed
+            if original_content_to_replace == new_content:
+                logger.info("Snippet replacement makes no changes")
+                return _as_text(original_content)
             
-            parts = parts[1].split(updated_marker)
-            new_content = parts[0].strip()
-            updated_line_info = parts[1].strip().split("Line")[1].strip()
-            updated_line = int(updated_line_info)
-            
-            # Format the original JSON to match the line numbers in the replacement spec
-            formatted_original = json.dumps(original_json, indent=4).split('\n')
+            # Parse the original content as JSON
+            original_json = orjson.loads(original_content)
             
-            # Verify the line numbers
-            if original_line < 1 or original_line > len(formatted_original) or updated_line < 1 or updated_line > len(formatted_original):
-                logger.error(f"Invalid line numbers: {original_line} to {updated_line}")
-                return None
+            # Parse the new content once; every approach below reuses it
+            new_parsed, parsed_new = _try_loads(new_content)
             
             # Extract the original content to be replaced
-            # We need to parse the content instead of using line numbers directly
-            try:
-                # If original_content_to_replace is valid JSON, we can use it to locate the corresponding element
-                json_to_replace = json.loads(original_content_to_replace)
+            # We need to parse the content instead of using line numbers directly;
+            # if it isn't valid JSON, the line-based approach below is used instead
+            parsed, json_to_replace = _try_loads(original_content_to_replace)
+            
+            # Find the item to replace in the original JSON
+            # For simplicity, we'll identify it by 'id' if present
+            if parsed and isinstance(json_to_replace, dict) and 'id' in json_to_replace and isinstance(original_json, list):
+                item_id = json_to_replace['id']
                 
-                # Find the item to replace in the original JSON
-                # For simplicity, we'll identify it by 'id' if present
-                if isinstance(json_to_replace, dict) and 'id' in json_to_replace:
-                    item_id = json_to_replace['id']
-                    
-                    # Find the item in the original JSON
-                    for i, item in enumerate(original_json):
-                        if isinstance(item, dict) and item.get('id') == item_id:
-                            # Replace the item
-                            original_json[i] = json.loads(new_content)
-                            # Return the updated JSON
-                            return json.dumps(original_json)
-            except json.JSONDecodeError:
-                # If the content to replace isn't valid JSON, use the line-based approach
-                pass
+                # Find the item in the original JSON, usually the block on the line the spec names
+                i = _block_index(original_json, item_id, original_line - 1)
+                if i is not None and new_parsed:
+                    if parsed_new == original_json[i]:
+                        logger.info("Snippet replacement makes no changes")
+                        return _as_text(original_content)
+                    # Replace the item
+                    original_json[i] = parsed_new
+                    # Return the updated JSON
+                    return orjson.dumps(original_json).decode()
+            
+            # A block without an ID can still be found by its content, wherever it is
+            if parsed and new_parsed and isinstance(json_to_replace, dict) and isinstance(original_json, list):
+                i = _matching_block_index(original_json, json_to_replace, original_line - 1)
+                if i is not None:
+                    original_json[i:i + 1] = parsed_new if isinstance(parsed_new, list) else [parsed_new]
+                    return orjson.dumps(original_json).decode()
+            
+            # If we couldn't use the JSON-based approach, try line-based replacement.
+            # A note shows one block per line, so only other JSON needs splitting into lines
+            is_block_list = isinstance(original_json, list)
+            formatted_original = None if is_block_list else orjson.dumps(original_json, option=orjson.OPT_INDENT_2).decode()
+            line_count = len(original_json) if is_block_list else formatted_original.count('\n') + 1
             
-            # If we couldn't use the JSON-based approach, try line-based replacement
-            # Replace the specified lines in the formatted content
-            replacement_lines = new_content.split('\n')
+            # Verify the line numbers
+            if original_line < 1 or original_line > line_count or updated_line < 1 or updated_line > line_count:
+                logger.error(f"Invalid line numbers: {original_line} to {updated_line}")
+                return None
             
-            # Apply the replacement to the formatted JSON
-            # We need to handle the line numbers correctly
             start_idx = original_line - 1
             end_idx = updated_line
             
-            # Apply the changes
-            formatted_original[start_idx:end_idx] = replacement_lines
+            if is_block_list:
+                # Each line is a whole block, so the new content replaces blocks X to Y
+                new_blocks = parsed_new
+                if not new_parsed:
+                    # Several blocks written one per line, as they are shown, possibly with their line numbers
+                    strip_line_number = _LINE_NUMBER_PREFIX_RE.sub
+                    block_lines = [strip_line_number("", line).rstrip().rstrip(",") for line in new_content.split('\n')]
+                    new_blocks = _loads_lenient("[" + ",".join(line for line in block_lines if line) + "]")
+                if isinstance(new_blocks, dict):
+                    new_blocks = [new_blocks]
+                original_json[start_idx:end_idx] = new_blocks
+                return orjson.dumps(original_json).decode()
             
-            # Convert back to a string
-            formatted_result = '\n'.join(formatted_original)
+            # Replace the specified lines in the formatted content, copying it once around the new content
+            start_offset = _line_offset(formatted_original, start_idx)
+            end_offset = _line_offset(formatted_original, end_idx, start_offset, start_idx)
+            formatted_result = formatted_original[:start_offset] + new_content
+            if end_offset <= len(formatted_original):
+                formatted_result += '\n' + formatted_original[end_offset:]
             
             # Try to parse the result to make sure it's valid JSON
-            try:
-                result_json = json.loads(formatted_result)
+            parsed, result_json = _try_loads(formatted_result)
+            if parsed:
                 # Return the JSON in its original compact format
-                return json.dumps(result_json)
-            except json.JSONDecodeError:
-                # If the formatted result isn't valid JSON, try to extract JSON portions
-                # This is a fallback approach that tries to find valid JSON in the modified content
-                logger.warning("Formatted result is not valid JSON, attempting to extract valid JSON")
-                
-                # Try to find and parse any JSON objects in the new content
-                try:
-                    new_json = json.loads(new_content)
-                    
-                    # If we reach this point, the new_content is valid JSON
-                    # Let's use the line numbers to identify where to put it
-                    # This is a simplified approach that may need adjustment
-                    
-                    # Simplified implementation - convert to string and attempt to replace
-                    compact_result = json.dumps(original_json)
-                    return compact_result
-                except json.JSONDecodeError:
-                    logger.error("Could not extract valid JSON from replacement")
-                    return None
+                return orjson.dumps(result_json).decode()
             
-        except Exception as e:
+            # Valid new content that doesn't fit the lines it was given can't be placed
+            # safely, and returning the note unchanged would report an edit that never happened
+            if new_parsed:
+                logger.error("Replacement is valid JSON but doesn't fit the given lines")
+            else:
+                logger.error("Could not extract valid JSON from replacement")
+            return None
+            
+        except ValueError as e:
+            # Invalid JSON in the note or the replacement; other errors are bugs and propagate
             logger.error(f"Error applying snippet replacement: {str(e)}")
             return None
     
@@ -3,9 +3,11 @@
 from typing import Union, Dict, Any, AsyncGenerator, List, Optional
 from pocketflow import AsyncFlow
 from app.agents.toolshed.nodes import ToolShedDecisionNode
-from app.agents.tools.file import FileInteraction
+# Imported as a module: the file tool imports app.agents.base, which imports this module
+from app.agents.tools import file as file_tool
 from app.agents.tools.web_search import WebSearch
 from app.core.logging import logger
+from app.agents.base.events import emit_event
 import asyncio
 
 def create_toolshed_flow() -> AsyncFlow:
@@ -26,7 +28,7 @@ def create_toolshed_flow() -> AsyncFlow:
     decision_node = ToolShedDecisionNode()
     
     # Create instances of all tool nodes
-    file_interaction = FileInteraction()
+    file_interaction = file_tool.FileInteraction()
     web_search = WebSearch()
     
     # Connect decision node to each tool node
@@ -44,7 +46,8 @@ async def run_toolshed_flow(
     active_file_id: Optional[str] = None,
     space_id: Optional[str] = None,
     user_id: Optional[str] = None,
-    event_queue: Optional[asyncio.Queue] = None
+    event_queue: Optional[asyncio.Queue] = None,
+    regenerate: bool = False
 ) -> Dict[str, Any]:
     """
     Run the toolshed flow with the given inputs.
@@ -58,6 +61,7 @@ async def run_toolshed_flow(
         space_id: ID of the current space
         user_id: ID of the current user
         event_queue: Optional queue for sending events back to the client
+        regenerate: Whether the user asked for a fresh answer, bypassing cached results
         
     Returns:
         Dict[str, Any]: Results of the tool execution with metadata
@@ -65,15 +69,11 @@ async def run_toolshed_flow(
     logger.info(f"Running toolshed flow for query='{query}', active_file_id={active_file_id}")
     
     # If we have an event queue, send a toolshed start event
-    if event_queue is not None:
-        try:
-            await event_queue.put({
-                "type": "toolshed_start",
-                "message": "Starting toolshed flow to determine which tool to use",
-                "query": query
-            })
-        except Exception as e:
-            logger.error(f"Error sending toolshed_start event: {str(e)}")
+    emit_event(event_queue, {
+        "type": "toolshed_start",
+        "message": "Starting toolshed flow to determine which tool to use",
+        "query": query
+    })
     
     # Create a shared context for the flow
     shared = {
@@ -86,7 +86,8 @@ async def run_toolshed_flow(
         "user_id": user_id,
         "tool_parameters": {},   # Will be populated by decision node
         "tool_results": None,    # Will be populated by the specific tool node
-        "event_queue": event_queue  # Pass the event queue to the tools
+        "event_queue": event_queue,  # Pass the event queue to the tools
+        "regenerate": regenerate
     }
     
     try:
@@ -99,14 +100,10 @@ async def run_toolshed_flow(
             logger.warning("ToolShed flow completed but no tool_results were set")
             
             # Send event about no tool being executed
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "toolshed_no_tool",
-                        "message": "No tool action was performed to complete this request"
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending toolshed_no_tool event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "toolshed_no_tool",
+                "message": "No tool action was performed to complete this request"
+            })
                     
             # Set a default tool_results to avoid NoneType errors
             shared["tool_results"] = {
@@ -118,7 +115,7 @@ async def run_toolshed_flow(
             if event_queue is not None:
                 try:
                     tool_results = shared.get("tool_results", {})
-                    await event_queue.put({
+                    emit_event(event_queue, {
                         "type": "toolshed_complete",
                         "message": "Toolshed flow completed successfully",
                         "tool_used": tool_results.get("tool_used", "unknown"),
@@ -133,16 +130,12 @@ async def run_toolshed_flow(
         logger.error(f"Toolshed flow error traceback: {error_traceback}")
         
         # Send error event
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "toolshed_error",
-                    "message": f"Error in toolshed flow: {str(e)}",
-                    "error": str(e),
-                    "traceback": error_traceback
-                })
-            except Exception as event_e:
-                logger.error(f"Error sending toolshed_error event: {str(event_e)}")
+        emit_event(event_queue, {
+            "type": "toolshed_error",
+            "message": f"Error in toolshed flow: {str(e)}",
+            "error": str(e),
+            "traceback": error_traceback
+        })
         
         # Set an error result
         shared["tool_results"] = {
@@ -3,7 +3,11 @@
 from typing import Dict, Any, List, Optional
 from pocketflow import AsyncNode
 from app.services.llm_service import llm_service
+# Imported as a module: the file tool imports app.agents.base, which imports this module
+from app.agents.tools import file as file_tool
 from app.core.logging import logger
+from app.core.yaml_utils import safe_load
+from app.agents.base.events import emit_event
 import yaml
 import pickle
 
@@ -42,17 +46,17 @@ class ToolShedDecisionNode(AsyncNode):
         
         logger.info(f"ToolShedDecisionNode: Processing query '{query}', active_file_id={active_file_id}")
         
+        # Warm the file caches while the tool decision is made, in case the file tool runs
+        if active_file_id:
+            file_tool.prefetch_file(active_file_id)
+        
         # Send event about tool decision starting
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "tool_decision_start",
-                    "message": "Determining which tool to use for the query",
-                    "query": query,
-                    "active_file_id": active_file_id
-                })
-            except Exception as e:
-                logger.error(f"Error sending tool_decision_start event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "tool_decision_start",
+            "message": "Determining which tool to use for the query",
+            "query": query,
+            "active_file_id": active_file_id
+        })
         
         return {
             "query": query,
@@ -73,15 +77,11 @@ class ToolShedDecisionNode(AsyncNode):
         event_queue = shared.get("event_queue")
         
         # Send event that LLM is being queried for tool decision
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "tool_decision_llm_query",
-                    "message": "Querying language model to determine the appropriate tool",
-                    "available_tools": list(available_tools.keys())
-                })
-            except Exception as e:
-                logger.error(f"Error sending tool_decision_llm_query event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "tool_decision_llm_query",
+            "message": "Querying language model to determine the appropriate tool",
+            "available_tools": list(available_tools.keys())
+        })
         
         # Note about the active file ID for the prompt
         active_file_info = f"""
@@ -141,14 +141,10 @@ class ToolShedDecisionNode(AsyncNode):
         """
         
         # Send event that LLM is being queried for tool decision
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "tool_decision_prompt_sent",
-                    "message": "Sent prompt to language model to determine tool selection"
-                })
-            except Exception as e:
-                logger.error(f"Error sending tool_decision_prompt_sent event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "tool_decision_prompt_sent",
+            "message": "Sent prompt to language model to determine tool selection"
+        })
         
         # Call LLM with the prompt
         llm_response = await llm_service._call_llm(
@@ -158,14 +154,10 @@ class ToolShedDecisionNode(AsyncNode):
         )
         
         # Send event that LLM response was received
-        if event_queue is not None:
-            try:
-                await event_queue.put({
-                    "type": "tool_decision_llm_response",
-                    "message": "Received response from language model for tool selection"
-                })
-            except Exception as e:
-                logger.error(f"Error sending tool_decision_llm_response event: {str(e)}")
+        emit_event(event_queue, {
+            "type": "tool_decision_llm_response",
+            "message": "Received response from language model for tool selection"
+        })
         
         # Parse the YAML response
         try:
@@ -175,14 +167,14 @@ class ToolShedDecisionNode(AsyncNode):
             else:
                 yaml_content = llm_response
                 
-            decision = yaml.safe_load(yaml_content)
+            decision = safe_load(yaml_content)
             
             # Send event about the parsed decision
             if event_queue is not None:
                 try:
                     action = decision.get("action", "none")
                     parameters = decision.get("parameters", {})
-                    await event_queue.put({
+                    emit_event(event_queue, {
                         "type": "tool_decision_parsed",
                         "message": f"Parsed tool decision: {action}",
                         "action": action,
@@ -200,15 +192,11 @@ class ToolShedDecisionNode(AsyncNode):
             }
             
             # Send error event
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "tool_decision_parse_error",
-                        "message": "Failed to parse language model response as YAML",
-                        "raw_response": llm_response[:500]  # Include part of the response for debugging
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending tool_decision_parse_error event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "tool_decision_parse_error",
+                "message": "Failed to parse language model response as YAML",
+                "raw_response": llm_response[:500]  # Include part of the response for debugging
+            })
         
         return decision
     
@@ -235,7 +223,7 @@ class ToolShedDecisionNode(AsyncNode):
             try:
                 # Format the reasoning with a clear header
                 reasoning_content = f"Decision Reasoning: I'm deciding what tool to use for '{prep_res.get('query', '')}'\n\n{decision['thinking']}"
-                await event_queue.put({
+                emit_event(event_queue, {
                     "type": "reasoning",
                     "content": reasoning_content
                 })
@@ -247,15 +235,11 @@ class ToolShedDecisionNode(AsyncNode):
             logger.info("ToolShedDecisionNode: No tool needed, returning None to end the flow")
             
             # Send no tool needed event
-            if event_queue is not None:
-                try:
-                    await event_queue.put({
-                        "type": "tool_decision_no_tool",
-                        "message": "Determined that no tool is needed for this query",
-                        "thinking": decision.get("thinking", "")[:500]  # Include part of the thinking
-                    })
-                except Exception as e:
-                    logger.error(f"Error sending tool_decision_no_tool event: {str(e)}")
+            emit_event(event_queue, {
+                "type": "tool_decision_no_tool",
+                "message": "Determined that no tool is needed for this query",
+                "thinking": decision.get("thinking", "")[:500]  # Include part of the thinking
+            })
             
             # Set a tool_results with a specific no_tool flag to avoid NoneType errors
             shared["tool_results"] = {
@@ -272,7 +256,7 @@ class ToolShedDecisionNode(AsyncNode):
         if event_queue is not None:
             try:
                 parameters = decision.get("parameters", {})
-                await event_queue.put({
+                emit_event(event_queue, {
                     "type": "tool_selected",
                     "message": f"Selected tool: {action}",
                     "tool": action,
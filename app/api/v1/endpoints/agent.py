@@ -1,28 +1,50 @@
 """
 API endpoints for agent operations.
 """
-import json
 import time
 import uuid
 from typing import Any, Dict, List
 import traceback
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import orjson
+
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import ValidationError
 
 from app.core.logging import logger
-from app.schemas.agent import AgentRequest, AgentResponse, AgentEvent
+from app.schemas.agent import AgentRequest, AgentResponse, AgentEvent, intern_event_type
 from app.agents.base.flow import run_agent_flow
 from app.db.supabase import supabase_client
 from app.models.chat_models import ChatSessionCreate, ChatMessageCreate
 
 router = APIRouter()
 
+# AgentRequest's compiled validator, called directly for each request body
+_validate_request_json = AgentRequest.__pydantic_validator__.validate_json
+
+
+def _sse_event(data: Dict[str, Any]) -> bytes:
+    """
+    Encodes one server-sent event, serializing its data with orjson.
+    """
+    return b"data: " + orjson.dumps(data, default=str) + b"\n\n"
+
 
-@router.post("/run", response_model=AgentResponse)
+@router.post(
+    "/run",
+    response_model=AgentResponse,
+    # The body is validated in the handler, so describe it for the API docs here
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": AgentRequest.model_json_schema()}}
+        }
+    }
+)
 async def run_agent(
-    request: AgentRequest,
+    raw_request: Request,
     background_tasks: BackgroundTasks
 ) -> Any:
     """
@@ -34,17 +56,19 @@ async def run_agent(
     3. Returns the response
     
     Args:
-        request: Contains space_id, query, active_file_id, stream, model_name, top_k, user_id, and chat_session_id parameters
+        raw_request: An AgentRequest body with space_id, query, active_file_id, stream, model_name, top_k, user_id, and chat_session_id parameters
         background_tasks: For handling cleanup tasks
         
     Returns:
         AgentResponse or StreamingResponse: Contains the agent's response and metadata
     """
+    # Parse and validate the raw body in one pass, rather than decoding it to a dict first
+    try:
+        request = _validate_request_json(await raw_request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    
     try:
-        # Force streaming to true unless explicitly set to false
-        if request.stream is None:
-            request.stream = True
-            
         logger.info(f"Executing agent workflow for space_id={request.space_id}, query='{request.query}', stream={request.stream}, active_file_id={request.active_file_id}, model_name={request.model_name}, top_k={request.top_k}, user_id={request.user_id}, chat_session_id={request.chat_session_id}")
         
         start_time = time.time()
@@ -103,14 +127,17 @@ async def run_agent(
                         stream=True,
                         model_name=request.model_name,
                         top_k=request.top_k,
-                        user_id=request.user_id
+                        user_id=request.user_id,
+                        regenerate=request.regenerate
                     )
                     
                     # Track if we've sent the sources event
                     sources_sent = False
                     # Buffer for collecting reasoning content
                     reasoning_buffer = ""
-                    # Buffer for collecting agent events
+                    # Whether the response is saved once streaming completes
+                    save_response = bool(request.save_to_db and chat_session_id and request.user_id)
+                    # Buffer for collecting agent events, only kept when they will be saved
                     agent_events: List[AgentEvent] = []
                     # Buffer for collecting response content
                     response_buffer = ""
@@ -125,7 +152,7 @@ async def run_agent(
                                     "type": "sources",
                                     "sources": []  # Empty sources for now
                                 }
-                                yield f"data: {json.dumps(sources_data)}\n\n"
+                                yield _sse_event(sources_data)
                                 sources_sent = True
                             continue
                             
@@ -137,35 +164,31 @@ async def run_agent(
                             # Parse the event type and data
                             event_end = chunk.find("]", 7)
                             if event_end > 7:
-                                event_type = chunk[7:event_end]
+                                # model_construct skips validators, so intern the type here
+                                event_type = intern_event_type(chunk[7:event_end])
                                 event_data = chunk[event_end+1:chunk.find("[/EVENT]")]
                                 
-                                # Create an AgentEvent object
-                                event_obj = AgentEvent(
-                                    type="agent_event",
-                                    event_type=event_type
-                                )
-                                
-                                # Set the appropriate field based on event type
+                                # Create an AgentEvent object with the appropriate field based on event type;
+                                # event_type and event_data come from the chunk, so there is nothing to validate
                                 if event_type == "decision":
-                                    event_obj.decision = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'decision', 'decision': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, decision=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'decision', 'decision': event_data})
                                     
                                 elif event_type == "file_edit_start":
-                                    event_obj.file_id = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'file_edit_start', 'file_id': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, file_id=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'file_edit_start', 'file_id': event_data})
                                     
                                 elif event_type == "file_edit_complete":
-                                    event_obj.file_id = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'file_edit_complete', 'file_id': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, file_id=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'file_edit_complete', 'file_id': event_data})
                                     
                                 elif event_type == "tool_complete":
-                                    event_obj.tool = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'tool_complete', 'tool': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, tool=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'tool_complete', 'tool': event_data})
                                     
                                 elif event_type == "rag_complete":
-                                    event_obj.message = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'rag_complete', 'message': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, message=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'rag_complete', 'message': event_data})
                                     
                                 elif event_type == "tool_selected":
                                     if isinstance(event_data, dict) and "tool" in event_data:
@@ -173,25 +196,26 @@ async def run_agent(
                                     else:
                                         tool_name = event_data
                                         
-                                    event_obj.tool = tool_name
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, tool=tool_name)
                                     # Include parameters if available
                                     parameters = event.get("parameters", {})
                                     
                                     # Send event to client with tool and parameters
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': 'tool_selected', 'tool': tool_name, 'parameters': parameters})}\n\n"
+                                    yield _sse_event({'type': 'agent_event', 'event_type': 'tool_selected', 'tool': tool_name, 'parameters': parameters})
                                     
                                 # Handle error events
                                 elif event_type == "error":
-                                    event_obj.message = event_data
-                                    yield f"data: {json.dumps({'type': 'error', 'message': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, message=event_data)
+                                    yield _sse_event({'type': 'error', 'message': event_data})
                                     
                                 # Handle all other event types
                                 else:
-                                    event_obj.data = event_data
-                                    yield f"data: {json.dumps({'type': 'agent_event', 'event_type': event_type, 'data': event_data})}\n\n"
+                                    event_obj = AgentEvent.model_construct(event_type=event_type, data=event_data)
+                                    yield _sse_event({'type': 'agent_event', 'event_type': event_type, 'data': event_data})
                                 
                                 # Store the event for later saving
-                                agent_events.append(event_obj)
+                                if save_response:
+                                    agent_events.append(event_obj)
                             continue
                             
                         elif "<reasoning>" in chunk:
@@ -211,7 +235,7 @@ async def run_agent(
                                     "type": "reasoning",
                                     "content": reasoning_buffer
                                 }
-                                yield f"data: {json.dumps(reasoning_data)}\n\n"
+                                yield _sse_event(reasoning_data)
                                 
                                 # Remove the reasoning part from the chunk before processing the rest
                                 chunk = chunk[:start_idx - len("<reasoning>")] + chunk[end_idx + len("</reasoning>"):]
@@ -223,7 +247,7 @@ async def run_agent(
                                     "content": chunk
                                 }
                                 response_buffer += chunk
-                                yield f"data: {json.dumps(token_data)}\n\n"
+                                yield _sse_event(token_data)
                             
                         elif "Step " in chunk and "Reasoning:" in chunk:
                             # This is thinking/reasoning content
@@ -233,7 +257,7 @@ async def run_agent(
                             }
                             # Accumulate reasoning in the buffer
                             reasoning_buffer += chunk + "\n"
-                            yield f"data: {json.dumps(reasoning_data)}\n\n"
+                            yield _sse_event(reasoning_data)
                             
                         else:
                             # This is a token from the LLM - send immediately without buffering
@@ -242,10 +266,10 @@ async def run_agent(
                                 "content": chunk
                             }
                             response_buffer += chunk
-                            yield f"data: {json.dumps(token_data)}\n\n"
+                            yield _sse_event(token_data)
                     
                     # Once streaming is complete, save the AI response to the database
-                    if request.save_to_db and chat_session_id and request.user_id:
+                    if save_response:
                         try:
                             # Create message data
                             ai_message_data = ChatMessageCreate(
@@ -254,7 +278,7 @@ async def run_agent(
                                 user_id=request.user_id,
                                 content=response_buffer.strip(),
                                 is_user=False,
-                                workflow=agent_events and [event.dict() for event in agent_events],
+                                workflow=agent_events and [event.model_dump() for event in agent_events],
                                 reasoning={"content": reasoning_buffer.strip()} if reasoning_buffer.strip() else None
                             )
                             
@@ -272,7 +296,7 @@ async def run_agent(
                         "query_time_ms": query_time_ms,
                         "chat_session_id": chat_session_id
                     }
-                    yield f"data: {json.dumps(done_data)}\n\n"
+                    yield _sse_event(done_data)
                     
                 except Exception as e:
                     logger.error(f"Error in event generator: {str(e)}")
@@ -280,7 +304,7 @@ async def run_agent(
                         "type": "error",
                         "error": str(e)
                     }
-                    yield f"data: {json.dumps(error_data)}\n\n"
+                    yield _sse_event(error_data)
             
             return StreamingResponse(
                 event_generator(),
@@ -296,7 +320,8 @@ async def run_agent(
             stream=False,
             model_name=request.model_name,
             top_k=request.top_k,
-            user_id=request.user_id
+            user_id=request.user_id,
+            regenerate=request.regenerate
         )
         
         # Calculate query time
@@ -340,13 +365,10 @@ async def run_agent(
             success=True,
             response=response_text.strip(),
             chat_session_id=chat_session_id,
-            metadata={
-                "flow_type": "pocketflow_agent",
-                "thinking": response_data.get("thinking", []),
-                "reasoning": reasoning,  # Add extracted reasoning
-                "query_time_ms": query_time_ms,
-                "sources": []  # Empty sources placeholder
-            }
+            thinking=response_data.get("thinking", []),
+            reasoning=reasoning,  # Add extracted reasoning
+            query_time_ms=query_time_ms,
+            metadata={"flow_type": "pocketflow_agent"}
         )
         
     except ValidationError as e:
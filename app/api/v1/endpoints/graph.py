@@ -4,7 +4,6 @@ API endpoints for graph operations.
 import json
 import time
 import uuid
-import yaml
 from typing import Any, Dict, List, Optional, Tuple
 import traceback
 
@@ -13,6 +12,7 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from app.core.logging import logger
+from app.core.yaml_utils import safe_load
 from app.services.llm_service import llm_service
 from app.db.supabase import supabase_client
 
@@ -347,7 +347,7 @@ async def generate_graph_structure_from_notes(notes: List[Dict[str, Any]], space
         
         # Extract YAML from the LLM response
         yaml_str = extract_yaml_from_text(response_text)
-        result = yaml.safe_load(yaml_str)
+        result = safe_load(yaml_str)
         
         graph_data = result.get("graph", {})
         node_map = result.get("node_map", {})
@@ -486,7 +486,7 @@ async def generate_research_content_for_graph(
             
             # Extract YAML from the LLM response
             yaml_str = extract_yaml_from_text(response_text)
-            entry_data = yaml.safe_load(yaml_str)
+            entry_data = safe_load(yaml_str)
             
             # Ensure related_note_ids is properly formatted
             if "related_note_ids" in entry_data:
@@ -576,7 +576,7 @@ async def generate_research_content_for_graph(
                     
                     # Extract YAML from the LLM response
                     sub_yaml_str = extract_yaml_from_text(sub_response_text)
-                    sub_entry_data = yaml.safe_load(sub_yaml_str)
+                    sub_entry_data = safe_load(sub_yaml_str)
                     
                     # Ensure related_note_ids is properly formatted
                     if "related_note_ids" in sub_entry_data:
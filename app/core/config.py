@@ -45,6 +45,28 @@ class Settings(BaseSettings):
     # Code Execution Sandbox Configuration
     CODE_SANDBOX_URL: str = Field("http://localhost:8001", env="CODE_SANDBOX_URL")
 
+    # Semantic Decision Cache Configuration
+    SEMANTIC_CACHE_ENABLED: bool = Field(False, env="SEMANTIC_CACHE_ENABLED")
+    SEMANTIC_CACHE_THRESHOLD: float = Field(0.93, env="SEMANTIC_CACHE_THRESHOLD")
+    SEMANTIC_CACHE_MAXSIZE: int = Field(2048, env="SEMANTIC_CACHE_MAXSIZE")
+
+    # Exact-match LLM Response Cache Configuration
+    RESPONSE_CACHE_ENABLED: bool = Field(False, env="RESPONSE_CACHE_ENABLED")
+    RESPONSE_CACHE_MAXSIZE: int = Field(4096, env="RESPONSE_CACHE_MAXSIZE")
+    RESPONSE_CACHE_TTL: float = Field(300.0, env="RESPONSE_CACHE_TTL")
+
+    # File Metadata and Content Cache Configuration
+    FILE_CACHE_ENABLED: bool = Field(True, env="FILE_CACHE_ENABLED")
+    FILE_CACHE_TTL: float = Field(60.0, env="FILE_CACHE_TTL")
+    FILE_META_CACHE_MAXSIZE: int = Field(512, env="FILE_META_CACHE_MAXSIZE")
+    FILE_CONTENT_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, env="FILE_CONTENT_CACHE_MAX_BYTES")
+    FILE_META_MIRROR_ENABLED: bool = Field(False, env="FILE_META_MIRROR_ENABLED")
+    FILE_META_MIRROR_PATH: str = Field("~/.voxed/file_meta.sqlite", env="FILE_META_MIRROR_PATH")
+    # Also store edited notes as MessagePack next to the JSON snapshot, for internal readers
+    FILE_SNAPSHOT_MSGPACK_ENABLED: bool = Field(False, env="FILE_SNAPSHOT_MSGPACK_ENABLED")
+    # Store the JSON snapshot of edited notes gzipped, as <path>.gz, for readers that decompress it
+    FILE_SNAPSHOT_GZIP_ENABLED: bool = Field(False, env="FILE_SNAPSHOT_GZIP_ENABLED")
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -0,0 +1,23 @@
+"""
+YAML parsing shared by the agents and API endpoints.
+"""
+from typing import Any
+
+import yaml
+
+# libyaml's C loader when PyYAML was built with it, the pure Python one otherwise
+_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def safe_load(stream: str) -> Any:
+    """
+    Parses a YAML document with the safe loader, like yaml.safe_load but faster
+    for the multi-KB YAML responses LLMs return.
+
+    Args:
+        stream: The YAML text.
+
+    Returns:
+        Any: The parsed document.
+    """
+    return yaml.load(stream, Loader=_SAFE_LOADER)
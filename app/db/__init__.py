@@ -1,7 +1,8 @@
 """
-Database client modules for Supabase and Pinecone.
+Database client modules for Supabase, Pinecone and the local SQLite mirror.
 """
 from app.db.pinecone import pinecone_client
+from app.db.sqlite import sqlite_mirror
 from app.db.supabase import supabase_client
 
-__all__ = ["pinecone_client", "supabase_client"] 
\ No newline at end of file
+__all__ = ["pinecone_client", "sqlite_mirror", "supabase_client"] 
@@ -0,0 +1,135 @@
+"""
+SQLite client module for a local mirror of Supabase rows.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+class SQLiteMirror:
+    """
+    Local SQLite copy of recently fetched space_files rows.
+
+    Lookups are sub-millisecond and survive restarts, unlike the in-process
+    file cache, so a small working set of files rarely needs a Supabase
+    round-trip. Rows older than the TTL are treated as missing. The sqlite3
+    calls run in a worker thread so they don't block the event loop.
+    """
+
+    def __init__(self, path: str, ttl: float = 60.0) -> None:
+        """
+        Initializes the mirror; the database is opened by `open`.
+
+        Args:
+            path: Path of the SQLite database file.
+            ttl: Seconds a mirrored row stays valid.
+        """
+        self.path = Path(path).expanduser()
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        # sqlite3 connections aren't safe to use from several threads at once
+        self._lock = threading.Lock()
+
+    async def open(self) -> None:
+        """
+        Opens the database, creating it and its table if needed.
+        """
+        await asyncio.to_thread(self._open)
+        logger.info(f"SQLite mirror opened at {self.path}")
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS space_file (id TEXT PRIMARY KEY, updated_at REAL NOT NULL, blob BLOB NOT NULL)"
+        )
+        self._conn = conn
+
+    async def close(self) -> None:
+        """
+        Closes the database.
+        """
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+            logger.info("SQLite mirror closed")
+
+    async def get_space_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a mirrored space_files row, or None if missing or stale.
+
+        Args:
+            file_id: The ID of the file.
+
+        Returns:
+            Optional[Dict[str, Any]]: The row as fetched from Supabase.
+        """
+        if self._conn is None:
+            return None
+        try:
+            return await asyncio.to_thread(self._get_space_file, file_id)
+        except Exception as e:
+            logger.error(f"Error reading space file from SQLite mirror: {e}")
+            return None
+
+    def _get_space_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob FROM space_file WHERE id = ? AND updated_at > ?",
+                (file_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def put_space_file(self, file_id: str, file_data: Dict[str, Any]) -> None:
+        """
+        Stores a space_files row as fetched from Supabase.
+
+        Args:
+            file_id: The ID of the file.
+            file_data: The row to mirror.
+        """
+        if self._conn is None:
+            return
+        try:
+            blob = json.dumps(file_data, default=str).encode("utf-8")
+            await asyncio.to_thread(self._put_space_file, file_id, blob)
+        except Exception as e:
+            logger.error(f"Error writing space file to SQLite mirror: {e}")
+
+    def _put_space_file(self, file_id: str, blob: bytes) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO space_file (id, updated_at, blob) VALUES (?, ?, ?)",
+                (file_id, time.time(), blob)
+            )
+
+    async def delete_space_file(self, file_id: str) -> None:
+        """
+        Drops a mirrored space_files row, if any.
+
+        Args:
+            file_id: The ID of the file.
+        """
+        if self._conn is None:
+            return
+        try:
+            await asyncio.to_thread(self._delete_space_file, file_id)
+        except Exception as e:
+            logger.error(f"Error deleting space file from SQLite mirror: {e}")
+
+    def _delete_space_file(self, file_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM space_file WHERE id = ?", (file_id,))
+
+
+# Global instance of the SQLite mirror, opened at startup when enabled
+sqlite_mirror = SQLiteMirror(settings.FILE_META_MIRROR_PATH, ttl=settings.FILE_CACHE_TTL)
@@ -1,9 +1,11 @@
 """
 Supabase client module for connecting to Supabase.
 """
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Dict, Optional, List
+from urllib.parse import quote
 import json
 
+import httpx
 from supabase import Client, create_client
 
 from app.core.config import settings
@@ -20,6 +22,7 @@ class SupabaseClient:
 
     _instance: Optional["SupabaseClient"] = None
     _client: Optional[Client] = None
+    _http_client: Optional[httpx.AsyncClient] = None
 
     def __new__(cls) -> "SupabaseClient":
         if cls._instance is None:
@@ -137,12 +140,109 @@ class SupabaseClient:
             bytes: The file contents.
         """
         try:
-            response = self.client.storage.from_("Vox").download(file_path)
-            return response
+            # Async request over the pooled client, so the event loop isn't blocked for the download
+            response = await self.http_client.get(f"/object/Vox/{quote(file_path, safe='/')}")
+            response.raise_for_status()
+            return response.content
         except Exception as e:
             logger.error(f"Error fetching file from storage: {e}")
             raise
 
+    async def upload_file_to_storage(
+        self, file_path: str, content: bytes, bucket: str = "Vox", content_type: str = "application/json"
+    ) -> None:
+        """
+        Uploads a file to Supabase storage, replacing any existing file at the path.
+        
+        Args:
+            file_path: The path of the file in storage.
+            content: The file contents.
+            bucket: The storage bucket name.
+            content_type: The MIME type stored with the file.
+        """
+        try:
+            response = await self.http_client.post(
+                f"/object/{bucket}/{quote(file_path, safe='/')}",
+                content=content,
+                headers={"Content-Type": content_type, "x-upsert": "true"}
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"Error uploading file to storage: {e}")
+            raise
+
+    async def close(self) -> None:
+        """
+        Closes the storage HTTP client, if it was opened.
+        """
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            SupabaseClient._http_client = None
+            logger.info("Supabase storage HTTP client closed")
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """
+        Returns an async HTTP client for calling the storage API directly,
+        for requests the Supabase client doesn't support.
+        
+        Returns:
+            httpx.AsyncClient: The HTTP client, authorized with the service role key.
+        """
+        if self._http_client is None:
+            key = settings.SUPABASE_SERVICE_ROLE_KEY
+            # Keep-alive pool shared by all storage requests, so each one skips the TCP and TLS handshake
+            SupabaseClient._http_client = httpx.AsyncClient(
+                base_url=f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1",
+                headers={"Authorization": f"Bearer {key}", "apikey": key},
+                timeout=60.0,
+                limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+            )
+        return self._http_client
+
+    async def stream_file_range_from_storage(
+        self, file_path: str, start: int = 0, length: Optional[int] = None, bucket: str = "Vox"
+    ) -> AsyncIterator[bytes]:
+        """
+        Streams a byte range of a file from Supabase storage.
+        
+        Args:
+            file_path: The path of the file in storage.
+            start: Offset of the first byte to fetch.
+            length: Maximum number of bytes to fetch, or None for the rest of the file.
+            bucket: The storage bucket name.
+            
+        Yields:
+            bytes: Chunks of the requested range, in order.
+        """
+        end = "" if length is None else start + length - 1
+        headers = {"Range": f"bytes={start}-{end}"}
+        try:
+            url = f"/object/{bucket}/{quote(file_path, safe='/')}"
+            async with self.http_client.stream("GET", url, headers=headers) as response:
+                # The range starts at or past the end of the file, e.g. any range of an empty file
+                if response.status_code == 416:
+                    return
+                response.raise_for_status()
+                # A server that ignores Range answers 200 with the whole file, so trim it here
+                skip = start if response.status_code == 200 else 0
+                remaining = length
+                async for chunk in response.aiter_bytes():
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if remaining is not None:
+                        chunk = chunk[:remaining]
+                        remaining -= len(chunk)
+                    if chunk:
+                        yield chunk
+                    if remaining == 0:
+                        break
+        except Exception as e:
+            logger.error(f"Error fetching file range from storage: {e}")
+            raise
+
     async def get_user_toggled_files(self, user_id: str) -> List[str]:
         """
         Fetches the toggled files for a user from the users table.
@@ -12,6 +12,8 @@ from fastapi.openapi.utils import get_openapi
 from app.api.v1.api import api_router
 from app.core.config import settings
 from app.core.logging import logger, setup_logging
+from app.db.sqlite import sqlite_mirror
+from app.db.supabase import supabase_client
 from app.services.embedding_service import embedding_service
 from app.services.llm_service import llm_service
 
@@ -27,6 +29,16 @@ async def lifespan(app: FastAPI):
     setup_logging()
     logger.info("Starting application")
     
+    # Warm up outbound connections so the first request doesn't pay for them
+    warmups = [llm_service.warmup()]
+    if settings.SEMANTIC_CACHE_ENABLED:
+        # Only the semantic decision cache embeds queries on the request path
+        warmups.append(embedding_service.warmup())
+    await asyncio.gather(*warmups)
+    
+    if settings.FILE_META_MIRROR_ENABLED:
+        await sqlite_mirror.open()
+    
     # Yield control to the application
     yield
     
@@ -34,6 +46,8 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down application")
     await llm_service.close()
     await embedding_service.close()
+    await sqlite_mirror.close()
+    await supabase_client.close()
 
 
 app = FastAPI(
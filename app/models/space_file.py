@@ -9,8 +9,23 @@ from uuid import UUID
 class SpaceFile:
     """
     Represents a space file record in the database.
+
+    Instances have a fixed slot layout instead of a per-instance dict, making
+    them smaller and quicker to build; many are kept in the file caches.
     """
 
+    __slots__ = (
+        "id",
+        "space_id",
+        "user_id",
+        "file_name",
+        "file_path",
+        "file_type",
+        "file_size",
+        "created_at",
+        "is_note",
+    )
+
     id: UUID
     space_id: UUID
     user_id: str
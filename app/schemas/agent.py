@@ -1,12 +1,29 @@
 """
 Schema definitions for agent operations.
 """
+import sys
 from typing import Dict, Any, Optional, Union, List
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+# Event types the agent emits, interned so every event shares one string per type
+_EVENT_TYPES = {
+    name: sys.intern(name)
+    for name in (
+        "agent_event", "decision", "file_edit_start", "file_edit_complete",
+        "tool_selected", "tool_complete", "rag_complete", "error"
+    )
+}
+
+
+def intern_event_type(value: Any) -> Any:
+    """Returns the shared copy of a known event type, or the value unchanged."""
+    return _EVENT_TYPES.get(value, value) if isinstance(value, str) else value
 
 
 class QueryResult(BaseModel):
     """Schema for a single query result/source."""
+    model_config = ConfigDict(frozen=True)
+
     id: str = Field(..., description="Unique identifier for the source")
     content: str = Field(..., description="Content of the source")
     metadata: Dict[str, Any] = Field(default_factory=dict, description="Metadata about the source")
@@ -14,12 +31,16 @@ class QueryResult(BaseModel):
 
 class ThinkingStep(BaseModel):
     """Schema for a thinking/reasoning step."""
+    model_config = ConfigDict(frozen=True)
+
     step: int = Field(..., description="Step number in the reasoning process")
     thinking: str = Field(..., description="The reasoning/thinking content")
 
 
 class AgentEvent(BaseModel):
     """Schema for agent workflow events."""
+    model_config = ConfigDict(frozen=True)
+
     type: str = Field("agent_event", description="The type of event (usually 'agent_event')")
     event_type: str = Field(..., description="The specific event type (decision, file_edit_start, etc.)")
     decision: Optional[str] = Field(None, description="Decision made by the agent")
@@ -28,9 +49,17 @@ class AgentEvent(BaseModel):
     message: Optional[str] = Field(None, description="Event message")
     data: Optional[str] = Field(None, description="Additional event data")
 
+    @field_validator('type', 'event_type', mode='before')
+    @classmethod
+    def intern_type(cls, v: Any) -> Any:
+        """Share one string per known event type across events."""
+        return intern_event_type(v)
+
 
 class AgentRequest(BaseModel):
     """Schema for agent request."""
+    model_config = ConfigDict(frozen=True)
+
     space_id: str = Field(..., description="ID of the space the query pertains to")
     active_file_id: Optional[str] = Field(None, description="ID of the active file the user is working with")
     query: str = Field(..., description="The user's question or command")
@@ -40,33 +69,17 @@ class AgentRequest(BaseModel):
     user_id: Optional[str] = Field(None, description="Optional user ID for tracking or personalization")
     chat_session_id: Optional[str] = Field(None, description="ID of the chat session this request belongs to")
     save_to_db: bool = Field(True, description="Whether to save the request and response to the database")
+    regenerate: bool = Field(False, description="Whether this is an explicit retry, which bypasses cached responses")
 
 
 class AgentResponse(BaseModel):
     """Schema for agent response."""
     success: bool = Field(..., description="Whether the agent execution was successful")
     response: str = Field(..., description="The response text (answer)")
+    sources: List[QueryResult] = Field(default_factory=list, description="Sources used for this response")
+    thinking: List[ThinkingStep] = Field(default_factory=list, description="Thinking steps for this response")
+    reasoning: str = Field("", description="Reasoning content extracted from the response")
+    query_time_ms: int = Field(0, description="Query execution time in milliseconds")
     metadata: Dict[str, Any] = Field(default_factory=dict, description="Additional information about the response")
     chat_session_id: Optional[str] = Field(None, description="ID of the chat session this response belongs to")
     workflow: Optional[List[AgentEvent]] = Field(None, description="Workflow events from the agent process")
-    
-    @property
-    def sources(self) -> List[QueryResult]:
-        """Get the sources used for this response."""
-        return self.metadata.get("sources", [])
-    
-    @property
-    def thinking(self) -> List[ThinkingStep]:
-        """Get the thinking steps for this response."""
-        return self.metadata.get("thinking", [])
-    
-    @property
-    def reasoning(self) -> str:
-        """Get the reasoning content."""
-        return self.metadata.get("reasoning", "")
-    
-    @property
-    def query_time_ms(self) -> int:
-        """Get the query execution time in milliseconds."""
-        return self.metadata.get("query_time_ms", 0)
-                         
@@ -0,0 +1,329 @@
+"""
+Cache service module for in-process caching of expensive LLM results.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+def _key_default(obj: Any) -> Any:
+    """Encodes values json can't, so equal contents give equal keys."""
+    if isinstance(obj, deque):
+        return list(obj)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+
+class SemanticDecisionCache:
+    """
+    Bounded LRU cache of agent decisions keyed by query embedding.
+
+    Embeddings are stored normalised in a preallocated matrix so a lookup is a
+    single matrix-vector product (inner product == cosine similarity). A hit
+    additionally requires the action history signature to match, since the
+    same query can lead to a different decision later in the workflow.
+    """
+
+    def __init__(self, maxsize: int = 2048, threshold: float = 0.93):
+        """
+        Initializes an empty cache.
+
+        Args:
+            maxsize: Maximum number of decisions to keep.
+            threshold: Minimum cosine similarity for a lookup to count as a hit.
+        """
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        # Slot index -> cached decision, ordered from least to most recently used
+        self._slots: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # Allocated lazily once the embedding dimension is known
+        self._vectors: Optional[np.ndarray] = None
+        self._signatures = np.zeros(maxsize, dtype=np.int64)
+
+    @staticmethod
+    def _normalise(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that were served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def lookup(self, embedding: List[float], signature: str) -> Optional[Dict[str, Any]]:
+        """
+        Finds the most similar cached decision for the given embedding.
+
+        Args:
+            embedding: The query embedding.
+            signature: Signature of the state the decision was made in.
+
+        Returns:
+            Optional[Dict[str, Any]]: A copy of the cached decision, or None on a miss.
+        """
+        vector = self._normalise(embedding)
+        size = len(self._slots)
+        if vector is None or self._vectors is None or size == 0 or vector.shape[0] != self._vectors.shape[1]:
+            self.misses += 1
+            return None
+
+        scores = self._vectors[:size] @ vector
+        scores[self._signatures[:size] != hash(signature)] = -1.0
+        slot = int(np.argmax(scores))
+        score = float(scores[slot])
+
+        if score < self.threshold:
+            self.misses += 1
+            logger.info(f"Semantic decision cache miss (best={score:.3f}, hit rate={self.hit_rate:.2%})")
+            return None
+
+        self.hits += 1
+        self._slots.move_to_end(slot)
+        logger.info(f"Semantic decision cache hit (similarity={score:.3f}, hit rate={self.hit_rate:.2%})")
+        return dict(self._slots[slot])
+
+    def add(self, embedding: List[float], signature: str, decision: Dict[str, Any]) -> None:
+        """
+        Stores a decision, evicting the least recently used entry when full.
+
+        Args:
+            embedding: The query embedding.
+            signature: Signature of the state the decision was made in.
+            decision: The decision to cache.
+        """
+        vector = self._normalise(embedding)
+        if vector is None:
+            return
+
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            # First entry, or the embedding model changed: start over
+            self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+            self._slots.clear()
+
+        if len(self._slots) >= self.maxsize:
+            slot, _ = self._slots.popitem(last=False)
+        else:
+            slot = len(self._slots)
+
+        self._vectors[slot] = vector
+        self._signatures[slot] = hash(signature)
+        self._slots[slot] = dict(decision)
+
+
+class ResponseCache:
+    """
+    Bounded exact-match LRU cache for LLM results.
+
+    Keys are digests of every input that shapes the result, so a hit is never a
+    false positive. Concurrent misses on the same key are collapsed into a
+    single computation by a per-key lock.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        Initializes an empty cache.
+
+        Args:
+            maxsize: Maximum number of results to keep.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()
+        # Key -> [lock, number of callers using it], dropped when the last caller leaves
+        self._locks: Dict[bytes, list] = {}
+
+    @staticmethod
+    def make_key(**parts: Any) -> bytes:
+        """
+        Builds a stable cache key from the given inputs.
+
+        Returns:
+            bytes: A 16 byte blake2b digest of the JSON encoded inputs.
+        """
+        payload = json.dumps(parts, sort_keys=True, default=_key_default)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key: bytes, default: Any = None) -> Any:
+        """
+        Returns the cached result for a key, or default on a miss.
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def _peek(self, key: bytes) -> Any:
+        """Returns the cached result for a key without touching stats or recency."""
+        return self._entries.get(key, self._MISSING)
+
+    def set(self, key: bytes, value: Any) -> None:
+        """
+        Stores a result, evicting the least recently used entry when full.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: bytes,
+        compute: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: True
+    ) -> Any:
+        """
+        Returns the cached result for a key, computing it at most once concurrently.
+
+        Args:
+            key: The cache key.
+            compute: Coroutine factory producing the result on a miss.
+            should_cache: Predicate deciding whether a computed result is stored.
+
+        Returns:
+            Any: The cached or freshly computed result.
+        """
+        value = self.get(key, self._MISSING)
+        if value is not self._MISSING:
+            return value
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Another caller may have filled the entry while we waited
+                if self._peek(key) is not self._MISSING:
+                    return self.get(key)
+                value = await compute()
+                if should_cache(value):
+                    self.set(key, value)
+                return value
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+
+class TTLCache(ResponseCache):
+    """
+    LRU cache whose entries also expire after a fixed time to live.
+
+    Optionally bounded by the total size of its values as well as their count,
+    for caching file contents of very different sizes. Concurrent misses on
+    the same key are collapsed into a single fetch, as in ResponseCache.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 512,
+        ttl: float = 60.0,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = len
+    ):
+        """
+        Initializes an empty cache.
+
+        Args:
+            maxsize: Maximum number of entries to keep.
+            ttl: Seconds an entry stays valid after it is stored.
+            max_bytes: Maximum total size of the cached values, or None for no limit.
+            sizeof: Returns the size of a value, used with max_bytes.
+        """
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value for a key, or default on a miss or expiry.
+        """
+        value = self._peek(key)
+        if value is self._MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def _peek(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._MISSING
+        if entry[0] <= time.monotonic():
+            self.invalidate(key)
+            return self._MISSING
+        return entry[2]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Stores a value, evicting least recently used entries while over either limit.
+        """
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Would evict everything else and still not fit
+            self.invalidate(key)
+            return
+        self.invalidate(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.total_bytes += size
+        while len(self._entries) > self.maxsize or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drops the entry for a key, if any.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+
+# Global instance of the semantic decision cache
+decision_cache = SemanticDecisionCache(
+    maxsize=settings.SEMANTIC_CACHE_MAXSIZE,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD
+)
+
+# Global instance of the exact-match LLM response cache; entries expire so answers don't go stale
+response_cache = TTLCache(maxsize=settings.RESPONSE_CACHE_MAXSIZE, ttl=settings.RESPONSE_CACHE_TTL)
+
+# Global instances of the file caches used by the file interaction tool:
+# SpaceFile rows by file ID, and raw storage bytes by (bucket, path)
+file_meta_cache = TTLCache(maxsize=settings.FILE_META_CACHE_MAXSIZE, ttl=settings.FILE_CACHE_TTL)
+file_content_cache = TTLCache(
+    maxsize=settings.FILE_META_CACHE_MAXSIZE,
+    ttl=settings.FILE_CACHE_TTL,
+    max_bytes=settings.FILE_CONTENT_CACHE_MAX_BYTES
+)
+
+# Global instance of the cache of line-numbered notes, keyed by a digest of the note content
+numbered_note_cache = TTLCache(
+    maxsize=128,
+    ttl=settings.FILE_CACHE_TTL,
+    max_bytes=settings.FILE_CONTENT_CACHE_MAX_BYTES
+)
@@ -35,6 +35,17 @@ class EmbeddingService:
         await self.client.aclose()
         logger.info("Embedding service client closed")
 
+    async def warmup(self):
+        """
+        Generates a throwaway embedding so the embedding API connection is open
+        before the first query needs it.
+        """
+        try:
+            await self.generate_embedding("warmup")
+            logger.info("Embedding service warmed up")
+        except Exception as e:
+            logger.warning(f"Embedding service warmup failed: {e}")
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
     async def generate_embedding(self, text: str) -> List[float]:
         """
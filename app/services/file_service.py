@@ -7,9 +7,11 @@ from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID
 
 from app.core.logging import logger
+from app.db.sqlite import sqlite_mirror
 from app.db.supabase import supabase_client
 from app.models.file_metadata import FileMetadata
 from app.models.space_file import SpaceFile
+from app.services.cache_service import file_content_cache, file_meta_cache
 from app.services.file_processors import FileProcessorFactory
 
 
@@ -255,6 +257,11 @@ class FileService:
             # Step 3: Delete file from database
             db_response = await supabase_client.delete_space_file(str(file_id))
             
+            # Stop serving the deleted file from local copies
+            file_meta_cache.invalidate(str(file_id))
+            file_content_cache.invalidate(("Vox", file_path))
+            await sqlite_mirror.delete_space_file(str(file_id))
+            
             return {
                 "success": db_response.get("success", False),
                 "message": f"File {file_id} deleted successfully",
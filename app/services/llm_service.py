@@ -2,11 +2,10 @@
 LLM service module for handling interactions with language models.
 """
 import json
-import asyncio
 import yaml
-from typing import Any, AsyncGenerator, Dict, Union, List
+from itertools import islice
+from typing import Any, AsyncGenerator, Dict, Optional, Union, List
 
-import requests
 import httpx
 from fastapi import HTTPException
 from tenacity import retry, stop_after_attempt, wait_exponential
@@ -14,6 +13,10 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 from app.core.config import settings
 from app.core.logging import logger
 
+# Non-streaming completions can take minutes to generate, so waiting for the response
+# is unbounded, as it was before the shared client; only connecting is limited
+_COMPLETION_TIMEOUT = httpx.Timeout(60.0, connect=10.0, read=None)
+
 
 class LLMService:
     """
@@ -33,8 +36,11 @@ class LLMService:
             "Content-Type": "application/json"
         }
         
-        # Keep httpx clients for any custom requests
-        self.http_client = httpx.AsyncClient(timeout=60.0)
+        # One pooled client shared by every call, so connections are reused across requests
+        self.http_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+        )
         
         logger.info("LLM service initialized with OpenRouter API client")
 
@@ -45,6 +51,18 @@ class LLMService:
         await self.http_client.aclose()
         logger.info("LLM service clients closed")
 
+    async def warmup(self):
+        """
+        Opens a pooled connection to OpenRouter ahead of the first request, so
+        DNS, TCP and TLS setup aren't paid on the request path.
+        """
+        try:
+            # Any response will do, we only need the connection
+            await self.http_client.head(f"{self.base_url}/models", headers=self.headers)
+            logger.info("LLM service connection warmed up")
+        except Exception as e:
+            logger.warning(f"LLM service warmup failed: {e}")
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
     async def generate_file_description(self, file_content: str, file_name: str, file_type: str) -> Dict[str, Any]:
         """
@@ -121,10 +139,12 @@ class LLMService:
         model_name: str = "deepseek/deepseek-chat:free", 
         stream: bool = False,
         temperature: float = 0.4,
-        max_tokens: int = 2048
+        max_tokens: int = 2048,
+        system_prompt: Optional[str] = None,
+        response_format: Optional[Dict[str, Any]] = None
     ) -> Union[str, AsyncGenerator[str, None]]:
         """
-        Consolidated function to call any LLM through OpenRouter using requests.
+        Consolidated function to call any LLM through OpenRouter using the shared HTTP client.
         
         Args:
             prompt: The prompt to send to the model.
@@ -132,14 +152,18 @@ class LLMService:
             stream: Whether to stream the response.
             temperature: The temperature parameter for the model (controls randomness).
             max_tokens: The maximum number of tokens to generate.
+            system_prompt: Static instructions sent ahead of the prompt as a system message,
+                so providers can cache them as a shared prefix across calls.
+            response_format: OpenRouter response format, e.g. {"type": "json_object"} for JSON mode.
             
         Returns:
             Union[str, AsyncGenerator[str, None]]: The generated response or a stream of tokens.
         """
         try:
             # Set default model if not specified
-            if not model_name or model_name.lower() == "gemini":
-                model_name = "deepseek/deepseek-chat:free"
+            model_lower = model_name.lower() if model_name else ""
+            if not model_lower or model_lower == "gemini":
+                model_name = model_lower = "deepseek/deepseek-chat:free"
                 
             # Map some common model aliases to their OpenRouter equivalents
             model_mapping = {
@@ -148,18 +172,26 @@ class LLMService:
                 "gpt-4": "openai/gpt-4-turbo"
             }
             
-            if model_name.lower() in model_mapping:
-                model_name = model_mapping[model_name.lower()]
+            if model_lower in model_mapping:
+                model_name = model_mapping[model_lower]
+                model_lower = model_name.lower()
                 
             logger.info(f"DEBUG - Using model {model_name} through OpenRouter")
             
             # Prepare messages in the format expected by OpenRouter
             messages = [{"role": "user", "content": prompt}]
+            if system_prompt:
+                if model_lower.startswith("anthropic/"):
+                    # Anthropic only caches prefixes marked with a breakpoint; other providers cache them automatically
+                    system_content = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+                else:
+                    system_content = system_prompt
+                messages.insert(0, {"role": "system", "content": system_content})
             logger.info(f"DEBUG - Prompt being sent to llm: {prompt}")
             
             # Prepare the payload
             include_reasoning = False
-            if model_name.lower() == "deepseek/deepseek-r1:free" or "thinking" in model_name.lower() or "o3" in model_name.lower() or "o1" in model_name.lower():
+            if model_lower == "deepseek/deepseek-r1:free" or "thinking" in model_lower or "o3" in model_lower or "o1" in model_lower:
                 include_reasoning = True
             
             payload = {
@@ -170,6 +202,8 @@ class LLMService:
                 "stream": stream,
                 "include_reasoning": include_reasoning
             }
+            if response_format:
+                payload["response_format"] = response_format
             logger.info(f"DEBUG - Payload: {payload}")
             
             # URL for OpenRouter API
@@ -182,41 +216,40 @@ class LLMService:
                 # This method returns an async generator
                 async def stream_generator():
                     try:
-                        # Use httpx for async HTTP requests
-                        async with httpx.AsyncClient(timeout=60.0) as client:
-                            async with client.stream('POST', url, headers=self.headers, json=payload) as response:
-                                buffer = ""
-                                async for chunk in response.aiter_text():
-                                    buffer += chunk
-                                    while True:
-                                        # Find the next complete SSE line
-                                        line_end = buffer.find('\n')
-                                        if line_end == -1:
-                                            break
+                        # Stream over the shared client so the pooled connection is reused
+                        async with self.http_client.stream('POST', url, headers=self.headers, json=payload) as response:
+                            buffer = ""
+                            async for chunk in response.aiter_text():
+                                buffer += chunk
+                                while True:
+                                    # Find the next complete SSE line
+                                    line_end = buffer.find('\n')
+                                    if line_end == -1:
+                                        break
 
-                                        line = buffer[:line_end].strip()
-                                        buffer = buffer[line_end + 1:]
+                                    line = buffer[:line_end].strip()
+                                    buffer = buffer[line_end + 1:]
 
-                                        if line.startswith('data: '):
-                                            data = line[6:]
-                                            if data == '[DONE]':
-                                                break
+                                    if line.startswith('data: '):
+                                        data = line[6:]
+                                        if data == '[DONE]':
+                                            break
 
-                                            try:
-                                                data_obj = json.loads(data)
-                                                content = data_obj["choices"][0]["delta"].get("content")
-                                                if content:
-                                                    logger.info(f"DEBUG - Streaming chunk: {content}")
-                                                    yield content
-                                                
-                                                # Check for reasoning content
-                                                reasoning = data_obj["choices"][0]["delta"].get("reasoning")
-                                                if reasoning:
-                                                    logger.info(f"DEBUG - Streaming reasoning: {reasoning}")
-                                                    # Wrap reasoning in a special delimiter for client identification
-                                                    yield f"<reasoning>{reasoning}</reasoning>"
-                                            except json.JSONDecodeError:
-                                                pass
+                                        try:
+                                            data_obj = json.loads(data)
+                                            content = data_obj["choices"][0]["delta"].get("content")
+                                            if content:
+                                                logger.info(f"DEBUG - Streaming chunk: {content}")
+                                                yield content
+                                            
+                                            # Check for reasoning content
+                                            reasoning = data_obj["choices"][0]["delta"].get("reasoning")
+                                            if reasoning:
+                                                logger.info(f"DEBUG - Streaming reasoning: {reasoning}")
+                                                # Wrap reasoning in a special delimiter for client identification
+                                                yield f"<reasoning>{reasoning}</reasoning>"
+                                        except json.JSONDecodeError:
+                                            pass
                     except Exception as e:
                         logger.error(f"Error in OpenRouter stream: {e}")
                         yield f"\nError: {str(e)}"
@@ -227,13 +260,12 @@ class LLMService:
                 # Non-streaming mode
                 logger.info(f"DEBUG - Using non-streaming mode")
                 
-                # Use requests in a thread to avoid blocking
-                response = await asyncio.to_thread(
-                    requests.post,
-                    url=url,
-                    headers=self.headers,
-                    json=payload
-                )
+                try:
+                    response = await self.http_client.post(url, headers=self.headers, json=payload, timeout=_COMPLETION_TIMEOUT)
+                except httpx.TimeoutException as e:
+                    error_msg = f"Timed out sending request to OpenRouter: {type(e).__name__}"
+                    logger.error(error_msg)
+                    raise HTTPException(status_code=504, detail=error_msg)
                 
                 if response.status_code != 200:
                     error_msg = f"OpenRouter API error: {response.status_code} - {response.text}"
@@ -331,7 +363,7 @@ class LLMService:
         try:
             # Check if we have a successful file edit in the recent history
             file_edit_success = False
-            for action in action_history[-5:] if action_history else []:
+            for action in islice(action_history, max(0, len(action_history) - 5), None) if action_history else ():
                 if (action.get('action') == "tool" and 
                     action.get('tool_name') == "file_interaction" and
                     action.get('success', False) and 
@@ -343,7 +375,8 @@ class LLMService:
             history_text = ""
             
             if action_history:
-                for i, action in enumerate(action_history[-3:]):  # Only use last 3 actions for brevity
+                # Only use last 3 actions for brevity; islice since the history may be a deque
+                for i, action in enumerate(islice(action_history, max(0, len(action_history) - 3), None)):
                     action_type = action.get('action', 'unknown')
                     if action_type == "tool":
                         # Include more details about the tool action
@@ -0,0 +1,168 @@
+"""
+Tests for the in-process caches.
+"""
+import asyncio
+from collections import deque
+
+import pytest
+
+from app.services import cache_service
+from app.services.cache_service import ResponseCache, SemanticDecisionCache, TTLCache
+
+
+def test_semantic_cache_hit_returns_copy():
+    """A lookup with the same embedding and signature returns a copy of the decision."""
+    cache = SemanticDecisionCache(maxsize=4, threshold=0.9)
+    cache.add([1.0, 0.0, 0.0], "sig", {"action": "rag"})
+
+    decision = cache.lookup([2.0, 0.1, 0.0], "sig")
+    assert decision == {"action": "rag"}
+    decision["action"] = "finish"
+    assert cache.lookup([1.0, 0.0, 0.0], "sig") == {"action": "rag"}
+    assert cache.hits == 2
+
+
+def test_semantic_cache_misses():
+    """Different signatures, dissimilar embeddings and zero vectors all miss."""
+    cache = SemanticDecisionCache(maxsize=4, threshold=0.9)
+    cache.add([1.0, 0.0], "sig", {"action": "rag"})
+
+    assert cache.lookup([1.0, 0.0], "other") is None
+    assert cache.lookup([0.0, 1.0], "sig") is None
+    assert cache.lookup([0.0, 0.0], "sig") is None
+    assert cache.misses == 3
+
+    cache.add([0.0, 0.0], "sig", {"action": "tool"})
+    assert len(cache._slots) == 1
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    """A full cache reuses the slot of the least recently used decision."""
+    cache = SemanticDecisionCache(maxsize=2, threshold=0.9)
+    cache.add([1.0, 0.0, 0.0], "sig", {"action": "a"})
+    cache.add([0.0, 1.0, 0.0], "sig", {"action": "b"})
+    assert cache.lookup([1.0, 0.0, 0.0], "sig") == {"action": "a"}
+
+    cache.add([0.0, 0.0, 1.0], "sig", {"action": "c"})
+    assert cache.lookup([0.0, 1.0, 0.0], "sig") is None
+    assert cache.lookup([1.0, 0.0, 0.0], "sig") == {"action": "a"}
+    assert cache.lookup([0.0, 0.0, 1.0], "sig") == {"action": "c"}
+
+
+def test_semantic_cache_resets_on_dimension_change():
+    """Embeddings of a new size replace everything cached so far."""
+    cache = SemanticDecisionCache(maxsize=4, threshold=0.9)
+    cache.add([1.0, 0.0], "sig", {"action": "a"})
+    cache.add([1.0, 0.0, 0.0], "sig", {"action": "b"})
+
+    assert cache.lookup([1.0, 0.0], "sig") is None
+    assert cache.lookup([1.0, 0.0, 0.0], "sig") == {"action": "b"}
+
+
+def test_response_cache_keys():
+    """Keys depend on every input, not on argument order or container type."""
+    key = ResponseCache.make_key(kind="decision", q="hi", h=[{"action": "rag"}])
+    assert key == ResponseCache.make_key(h=deque([{"action": "rag"}]), q="hi", kind="decision")
+    assert key != ResponseCache.make_key(kind="decision", q="hi", h=[])
+    assert len(key) == 16
+
+
+def test_response_cache_evicts_least_recently_used():
+    """A full cache drops the entry used longest ago."""
+    cache = ResponseCache(maxsize=2)
+    cache.set(b"a", 1)
+    cache.set(b"b", 2)
+    assert cache.get(b"a") == 1
+
+    cache.set(b"c", 3)
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == 1
+    assert cache.get(b"c") == 3
+
+
+@pytest.mark.asyncio
+async def test_response_cache_collapses_concurrent_misses():
+    """Concurrent misses on one key share a single computation."""
+    cache = ResponseCache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"action": "finish"}
+
+    results = await asyncio.gather(*(cache.get_or_compute(b"key", compute) for _ in range(5)))
+
+    assert calls == 1
+    assert all(result == {"action": "finish"} for result in results)
+    assert cache._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_response_cache_skips_uncacheable_results():
+    """Results rejected by should_cache are returned but computed again next time."""
+    cache = ResponseCache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        return {"thinking": "Error: timeout"}
+
+    for _ in range(2):
+        await cache.get_or_compute(b"key", compute, should_cache=lambda value: False)
+
+    assert calls == 2
+    assert cache.get(b"key") is None
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    """Entries are gone once their time to live has passed."""
+    now = [100.0]
+    monkeypatch.setattr(cache_service.time, "monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=4, ttl=10.0)
+    cache.set("key", b"value")
+
+    now[0] = 109.0
+    assert cache.get("key") == b"value"
+    now[0] = 110.0
+    assert cache.get("key") is None
+    assert "key" not in cache._entries
+
+
+def test_ttl_cache_bounds_total_size():
+    """Least recently used entries are evicted to stay under max_bytes."""
+    cache = TTLCache(maxsize=10, ttl=60.0, max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+
+    cache.set("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.total_bytes == 8
+
+    cache.set("huge", b"x" * 11)
+    assert cache.get("huge") is None
+    cache.set("a", b"a")
+    cache.invalidate("c")
+    assert cache.total_bytes == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_get_or_compute():
+    """TTLCache supports the same single-flight lookups as ResponseCache."""
+    cache = TTLCache(maxsize=4, ttl=60.0)
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"content"
+
+    results = await asyncio.gather(*(cache.get_or_compute(("Vox", "path"), fetch) for _ in range(3)))
+
+    assert results == [b"content"] * 3
+    assert calls == 1
+    assert cache.get(("Vox", "path")) == b"content"
@@ -0,0 +1,128 @@
+"""
+Tests for batching workflow events onto the event queue.
+"""
+import asyncio
+
+import pytest
+
+from app.agents.base.events import DecisionEvent, EventBatcher, TokenEvent, emit_event
+
+
+async def _drain(queue: asyncio.Queue, batcher: EventBatcher) -> list:
+    """Reads items until the queue and the batcher's backlog are both empty."""
+    items = []
+    while not queue.empty() or batcher.pending:
+        items.append(await asyncio.wait_for(queue.get(), 1))
+    return items
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_when_full():
+    """Reaching max_items puts the buffered events on the queue as one batch."""
+    queue = asyncio.Queue()
+    batcher = EventBatcher(queue, max_items=3, flush_ms=1000)
+    for i in range(3):
+        batcher.emit(TokenEvent(content=str(i)))
+
+    assert queue.get_nowait() == [TokenEvent(content="0"), TokenEvent(content="1"), TokenEvent(content="2")]
+    assert not batcher.pending
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_after_delay():
+    """Buffered events are flushed flush_ms after the first one."""
+    queue = asyncio.Queue()
+    batcher = EventBatcher(queue, max_items=16, flush_ms=5)
+    batcher.emit(DecisionEvent(decision="rag"))
+    assert queue.empty()
+
+    assert await asyncio.wait_for(queue.get(), 1) == [DecisionEvent(decision="rag")]
+
+
+@pytest.mark.asyncio
+async def test_batcher_backlog_keeps_order():
+    """Batches that don't fit in a full queue wait in order instead of being dropped."""
+    queue = asyncio.Queue(maxsize=1)
+    batcher = EventBatcher(queue, max_items=1)
+    for i in range(4):
+        batcher.emit(TokenEvent(content=str(i)))
+    assert batcher.pending
+
+    items = await _drain(queue, batcher)
+    assert items == [[TokenEvent(content=str(i))] for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_emit_event_follows_batched_events():
+    """Dict events put directly on the queue never overtake events emitted before them."""
+    queue = asyncio.Queue(maxsize=2)
+    batcher = EventBatcher(queue, max_items=16, flush_ms=1000)
+    batcher.emit(DecisionEvent(decision="tool"))
+    emit_event(queue, {"type": "tool_selected", "tool": "file_interaction"})
+    emit_event(queue, [{"type": "file_edit_start"}, {"type": "file_edit_progress"}])
+    emit_event(queue, {"type": "file_edit_complete"})
+
+    items = await _drain(queue, batcher)
+    assert items == [
+        [DecisionEvent(decision="tool")],
+        {"type": "tool_selected", "tool": "file_interaction"},
+        [{"type": "file_edit_start"}, {"type": "file_edit_progress"}],
+        {"type": "file_edit_complete"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_emit_event_without_batcher_never_drops():
+    """A full queue without a batcher holds events back in order rather than evicting any."""
+    queue = asyncio.Queue(maxsize=1)
+    for i in range(3):
+        emit_event(queue, {"type": "progress", "step": i})
+    emit_event(queue, {"type": "tool_complete"})
+
+    items = []
+    for _ in range(4):
+        items.append(await asyncio.wait_for(queue.get(), 1))
+    assert items == [{"type": "progress", "step": i} for i in range(3)] + [{"type": "tool_complete"}]
+
+
+def test_emit_event_without_queue():
+    """Emitting with no queue does nothing."""
+    emit_event(None, {"type": "tool_complete"})
+
+
+@pytest.mark.asyncio
+async def test_backlog_drops_progress_events_when_full():
+    """Past max_backlog, progress events make room while tokens and terminal events are kept."""
+    queue = asyncio.Queue(maxsize=1)
+    batcher = EventBatcher(queue, max_items=1, max_backlog=2)
+    batcher.send({"type": "file_edit_start"})
+    batcher.send({"type": "thinking", "step": 1})
+    batcher.send({"type": "file_edit_progress"})
+    batcher.send({"type": "file_edit_progress"})
+    batcher.emit(TokenEvent(content="a"))
+    batcher.send({"type": "tool_complete"})
+
+    items = await _drain(queue, batcher)
+    assert items == [
+        {"type": "file_edit_start"},
+        {"type": "thinking", "step": 1},
+        [TokenEvent(content="a")],
+        {"type": "tool_complete"},
+    ]
+    assert batcher.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_close_discards_backlog():
+    """Closing stops the drain task and drops everything not yet on the queue."""
+    queue = asyncio.Queue(maxsize=1)
+    batcher = EventBatcher(queue, max_items=16, flush_ms=1000)
+    batcher.send({"type": "decision_start"})
+    batcher.send({"type": "tool_complete"})
+    batcher.emit(TokenEvent(content="a"))
+
+    batcher.close()
+    await asyncio.sleep(0)
+    assert not batcher.pending
+    assert queue.get_nowait() == {"type": "decision_start"}
+    assert queue.empty()
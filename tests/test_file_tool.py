@@ -0,0 +1,252 @@
+"""
+Tests for the note editing helpers of the file interaction tool.
+"""
+import orjson
+import pytest
+
+from app.agents.tools.file import (
+    _EDIT_WINDOW_MIN_BLOCKS,
+    _SNIPPET_RE,
+    FileInteraction,
+    _appended_blocks,
+    _cache_scope,
+    _apply_json_patch,
+    _loads_lenient,
+    _matching_block_index,
+    _repair_json,
+    _windowed_context,
+)
+from app.models.space_file import SpaceFile
+
+
+def _spec(original_line: int, original: str, new: str, updated_line: int) -> str:
+    """Builds a snippet replacement in the ORIGINAL/UPDATED marker format."""
+    return (
+        f"<<<<<<< ORIGINAL // Line {original_line}\n{original}\n=======\n"
+        f"{new}\n>>>>>>> UPDATED // Line {updated_line}"
+    )
+
+
+def _replace(note, spec):
+    """Applies a replacement to a note given as JSON values, returning the parsed result or None."""
+    result = FileInteraction()._apply_snippet_replacement(orjson.dumps(note), spec)
+    return None if result is None else orjson.loads(result)
+
+
+def test_snippet_re_extracts_lines_and_content():
+    """The markers give both line numbers and the content on either side of the divider."""
+    match = _SNIPPET_RE.search(_spec(3, '{"id": "a"}', '{"id": "a", "x": 1}\n{"id": "b"}', 4))
+
+    assert match.group(1) == "3"
+    assert match.group(2).strip() == '{"id": "a"}'
+    assert match.group(3).strip() == '{"id": "a", "x": 1}\n{"id": "b"}'
+    assert match.group(4) == "4"
+
+
+def test_snippet_re_tolerates_loose_markers():
+    """Extra text after the markers and spacing around the divider still parse."""
+    spec = "Here you go:\n<<<<<<< ORIGINAL //Line 2 (the list)\nold\n  =======  \nnew\n>>>>>>> UPDATED //  Line 2"
+    match = _SNIPPET_RE.search(spec)
+
+    assert (match.group(1), match.group(2).strip(), match.group(3).strip(), match.group(4)) == ("2", "old", "new", "2")
+    assert _SNIPPET_RE.search("<<<<<<< ORIGINAL // Line 1\nold\n>>>>>>> UPDATED // Line 1") is None
+
+
+def test_snippet_replacement_by_block_id():
+    """A block with an ID is replaced wherever it is, even if the line number is off."""
+    note = [{"id": "a", "type": "paragraph"}, {"id": "b", "type": "heading"}]
+
+    result = _replace(note, _spec(1, '{"id": "b", "type": "heading"}', '{"id": "b", "type": "paragraph"}', 1))
+    assert result == [{"id": "a", "type": "paragraph"}, {"id": "b", "type": "paragraph"}]
+    assert _replace(note, "no markers here") is None
+
+
+@pytest.mark.parametrize("spec", [None, 42, 1.5, True])
+def test_snippet_replacement_rejects_non_text_specs(spec):
+    """A replacement that is neither a patch nor marker text is rejected rather than raising."""
+    assert _replace([{"id": "a"}], spec) is None
+
+
+def _numbered(note) -> str:
+    """Numbers a note one block per line, as it is shown to the LLM."""
+    return "\n".join(f"{i}: {orjson.dumps(block).decode()}" for i, block in enumerate(note, 1))
+
+
+def test_windowed_context_keeps_blocks_around_target():
+    """Long notes are cut to the blocks around the one the query names, keeping line numbers."""
+    note = [{"id": str(i), "text": f"filler {i}"} for i in range(_EDIT_WINDOW_MIN_BLOCKS + 10)]
+    note[20]["text"] = "Quarterly revenue summary"
+
+    excerpt = _windowed_context(note, _numbered(note), "Fix the quarterly revenue paragraph", radius=2)
+
+    lines = excerpt.split("\n")
+    assert lines[0] == f"(Excerpt: lines 19-23 of {len(note)}; the rest of the note is unchanged)"
+    assert [line.split(":", 1)[0] for line in lines[1:]] == ["19", "20", "21", "22", "23"]
+
+
+def test_windowed_context_skips_short_or_unmatched_notes():
+    """Short notes, and queries matching no block, get the whole note instead."""
+    short = [{"id": "a", "text": "revenue"}]
+    long = [{"id": str(i), "text": "filler"} for i in range(_EDIT_WINDOW_MIN_BLOCKS)]
+
+    assert _windowed_context(short, _numbered(short), "revenue") is None
+    assert _windowed_context(long, _numbered(long), "quarterly revenue") is None
+    assert _windowed_context(long, _numbered(long), "fix it") is None
+
+
+def test_windowed_context_scores_nested_inline_text():
+    """Text inside a block's content and children is what the query is matched against."""
+    note = [{"id": str(i), "type": "paragraph", "content": []} for i in range(_EDIT_WINDOW_MIN_BLOCKS)]
+    note[30]["children"] = [{"type": "paragraph", "content": [{"type": "text", "text": "Quarterly revenue", "styles": {}}]}]
+
+    excerpt = _windowed_context(note, _numbered(note), "Fix the quarterly revenue paragraph", radius=0)
+    assert excerpt.split("\n")[1].startswith("31:")
+
+
+def test_windowed_context_needs_a_clear_winner():
+    """Tied blocks, or a best block with too few matching words, give the whole note."""
+    note = [{"id": str(i), "text": "filler"} for i in range(_EDIT_WINDOW_MIN_BLOCKS)]
+    note[5]["text"] = note[25]["text"] = "Quarterly revenue summary"
+    note[10]["text"] = "Revenue"
+
+    assert _windowed_context(note, _numbered(note), "Fix the quarterly revenue paragraph") is None
+    assert _windowed_context(note, _numbered(note), "Fix the revenue paragraph") is None
+
+
+def test_windowed_context_ignores_keys_ids_and_types():
+    """Words that only appear in block keys, IDs or types don't pick a target."""
+    note = [{"id": f"block-{i}", "type": "paragraph", "props": {"textColor": "default"}, "text": "filler"}
+            for i in range(_EDIT_WINDOW_MIN_BLOCKS)]
+    note[12]["id"] = "heading-summary"
+    note[12]["type"] = "heading"
+
+    assert _windowed_context(note, _numbered(note), "Make the summary heading bold") is None
+    assert _windowed_context(note, _numbered(note), "Change the paragraph textcolor") is None
+
+
+def test_repair_json_fixes_common_slips():
+    """Trailing commas are dropped and raw control characters in strings escaped."""
+    assert orjson.loads(_repair_json('[{"a": 1,}, {"b": [1, 2, ],},\n]')) == [{"a": 1}, {"b": [1, 2]}]
+    assert orjson.loads(_repair_json('{"text": "line one\nline\ttwo", "x": "a,]"}')) == {
+        "text": "line one\nline\ttwo",
+        "x": "a,]",
+    }
+    assert _repair_json('{"text": "say \\"hi\\",}"}') == '{"text": "say \\"hi\\",}"}'
+
+
+def test_loads_lenient():
+    """Valid JSON parses as is, repairable JSON after repair, and anything else raises."""
+    assert _loads_lenient(b'[1, 2]') == [1, 2]
+    assert _loads_lenient('[{"id": "a",},]') == [{"id": "a"}]
+
+    with pytest.raises(orjson.JSONDecodeError):
+        # A truncated response is never closed, so half an edit can't be applied
+        _loads_lenient('[{"id": "a"}, {"id": "b"')
+
+
+def test_json_patch_applies_operations_to_a_copy():
+    """Operations apply in order to a patched copy, leaving the input unchanged."""
+    note = [{"id": "a", "content": [{"text": "old"}]}, {"id": "b"}]
+    before = orjson.loads(orjson.dumps(note))
+
+    patched = _apply_json_patch(note, [
+        {"op": "replace", "path": "/0/content/0/text", "value": "new"},
+        {"op": "add", "path": "/-", "value": {"id": "c"}},
+        {"op": "add", "path": "/2/props", "value": {"level": 1}},
+        {"op": "remove", "path": "/1"},
+        {"op": "add", "path": "/0/a~1b~0c", "value": True},
+    ])
+
+    assert patched == [{"id": "a", "content": [{"text": "new"}], "a/b~c": True}, {"id": "c", "props": {"level": 1}}]
+    assert note == before
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "replace", "path": "/0/content/x/text", "value": 1},
+    {"op": "replace", "path": "/-/id", "value": 1},
+    {"op": "replace", "path": "/01", "value": 1},
+    {"op": "replace", "path": "/5", "value": 1},
+    {"op": "replace", "path": "/0/id/deeper", "value": 1},
+    {"op": "replace", "path": "/0/missing", "value": 1},
+    {"op": "remove", "path": "/0/missing"},
+    {"op": "add", "path": "/3", "value": 1},
+    {"op": "move", "path": "/0", "from": "/1"},
+    {"op": "replace", "path": "0", "value": 1},
+    {"op": "replace", "path": "/0"},
+    "not an operation",
+])
+def test_json_patch_rejects_bad_operations(operation):
+    """Every malformed operation or path that doesn't apply raises ValueError."""
+    with pytest.raises(ValueError):
+        _apply_json_patch([{"id": "a", "content": []}, {"id": "b"}], [operation])
+
+
+def test_json_patch_is_all_or_nothing():
+    """A failing operation leaves the note without the operations before it."""
+    note = [{"id": "a", "content": [{"text": "x"}]}]
+    operations = [
+        {"op": "replace", "path": "/0/content/0/text", "value": "y"},
+        {"op": "remove", "path": "/4"},
+    ]
+
+    with pytest.raises(ValueError):
+        _apply_json_patch(note, operations)
+    assert note == [{"id": "a", "content": [{"text": "x"}]}]
+    assert _replace(note, operations) is None
+
+
+def test_snippet_replacement_accepts_json_patch():
+    """A patch given as a parsed array, a single operation or a JSON string is applied."""
+    note = [{"id": "a", "type": "paragraph"}]
+    operation = {"op": "replace", "path": "/0/type", "value": "heading"}
+
+    for spec in ([operation], operation, orjson.dumps([operation]).decode()):
+        assert _replace(note, spec) == [{"id": "a", "type": "heading"}]
+
+
+def test_matching_block_index_prefers_hint():
+    """Equal blocks are found at the hinted index first, then by scanning."""
+    blocks = [{"type": "divider"}, {"type": "paragraph"}, {"type": "divider"}]
+
+    assert _matching_block_index(blocks, {"type": "divider"}, 2) == 2
+    assert _matching_block_index(blocks, {"type": "divider"}, 1) == 0
+    assert _matching_block_index(blocks, {"type": "divider"}, 99) == 0
+    assert _matching_block_index(blocks, {"type": "heading"}, 0) is None
+
+
+def test_snippet_replacement_matches_blocks_by_content():
+    """A block without an ID is found by its content even when the line number is wrong."""
+    note = [{"type": "divider"}, {"type": "paragraph", "text": "old"}]
+
+    result = _replace(note, _spec(1, '{"type": "paragraph", "text": "old"}', '{"type": "paragraph", "text": "new"}', 1))
+    assert result == [{"type": "divider"}, {"type": "paragraph", "text": "new"}]
+
+    # Content that matches no block falls back to the line numbers
+    result = _replace(note, _spec(1, '{"type": "paragraph", "text": "gone"}', '{"type": "heading"}', 1))
+    assert result == [{"type": "heading"}, {"type": "paragraph", "text": "old"}]
+
+
+def test_appended_blocks_accepts_blocks():
+    """Appended content may be a list of blocks or a single block, as text or parsed."""
+    assert _appended_blocks('[{"id": "a"}, {"id": "b"}]') == [{"id": "a"}, {"id": "b"}]
+    assert _appended_blocks('{"id": "a"}') == [{"id": "a"}]
+    assert _appended_blocks([{"id": "a"}]) == [{"id": "a"}]
+    assert _appended_blocks({"id": "a"}) == [{"id": "a"}]
+
+
+@pytest.mark.parametrize("content", ['"a paragraph"', "a paragraph", '[{"id": "a"}, "b"]', 42, None, "[1, 2]"])
+def test_appended_blocks_rejects_non_blocks(content):
+    """Anything but blocks raises instead of being spliced into the note."""
+    with pytest.raises(ValueError):
+        _appended_blocks(content)
+
+
+def test_cache_scope_covers_whole_content_and_requester():
+    """Cached answers are told apart by the full file content and by who asked, not only the prompt."""
+    file_info = SpaceFile(id="f", space_id="s", user_id="owner", file_name="n", file_path="p", file_type="note", file_size=4)
+    scope = _cache_scope(file_info, '[{"id": "a"}]', "u1", "s1")
+
+    assert scope == _cache_scope(file_info, b'[{"id": "a"}]', "u1", "s1")
+    assert scope != _cache_scope(file_info, '[{"id": "a"}, {"id": "b"}]', "u1", "s1")
+    assert scope != _cache_scope(file_info, '[{"id": "a"}]', "u2", "s1")
+    assert scope != _cache_scope(file_info, '[{"id": "a"}]', "u1", "s2")
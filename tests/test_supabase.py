@@ -0,0 +1,65 @@
+"""
+Tests for ranged downloads from Supabase storage.
+"""
+from typing import Callable, List
+
+import httpx
+import pytest
+
+from app.db.supabase import SupabaseClient, supabase_client
+
+_CONTENT = b"0123456789abcdefghij"
+
+
+def _use_storage(monkeypatch, handler: Callable[[httpx.Request], httpx.Response]) -> List[httpx.Request]:
+    """Routes storage requests to handler, returning the list of requests it received."""
+    requests: List[httpx.Request] = []
+
+    def record(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return handler(request)
+
+    client = httpx.AsyncClient(base_url="http://storage.test/storage/v1", transport=httpx.MockTransport(record))
+    monkeypatch.setattr(SupabaseClient, "_http_client", client)
+    return requests
+
+
+async def _read(file_path: str, start: int = 0, length=None) -> bytes:
+    return b"".join([chunk async for chunk in supabase_client.stream_file_range_from_storage(file_path, start, length)])
+
+
+@pytest.mark.asyncio
+async def test_range_request_returns_partial_content(monkeypatch):
+    """A server honouring Range answers 206 with just the requested bytes."""
+    requests = _use_storage(monkeypatch, lambda request: httpx.Response(206, content=_CONTENT[5:9]))
+
+    assert await _read("notes/a b#1?.json", start=5, length=4) == b"5678"
+    assert requests[0].headers["Range"] == "bytes=5-8"
+    assert requests[0].url.raw_path == b"/storage/v1/object/Vox/notes/a%20b%231%3F.json"
+
+
+@pytest.mark.asyncio
+async def test_range_ignored_by_server_is_trimmed(monkeypatch):
+    """A 200 with the whole file is cut down to the requested range."""
+    requests = _use_storage(monkeypatch, lambda request: httpx.Response(200, content=_CONTENT))
+
+    assert await _read("note.json", start=5, length=4) == b"5678"
+    assert await _read("note.json", start=15) == b"fghij"
+    assert requests[1].headers["Range"] == "bytes=15-"
+
+
+@pytest.mark.asyncio
+async def test_unsatisfiable_range_is_empty(monkeypatch):
+    """An empty file answers 416 to any range, which reads as no content."""
+    _use_storage(monkeypatch, lambda request: httpx.Response(416))
+
+    assert await _read("empty.json", length=4) == b""
+
+
+@pytest.mark.asyncio
+async def test_range_errors_are_raised(monkeypatch):
+    """Other error statuses still raise."""
+    _use_storage(monkeypatch, lambda request: httpx.Response(404))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await _read("missing.json", length=4)